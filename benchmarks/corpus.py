@@ -0,0 +1,137 @@
+# Generated corpus of representative pages for the benchmarks. Pages are built
+# from a fixed seed, so every run (and every machine) sees the same documents.
+
+import json
+import random
+from typing import Dict, List, NamedTuple
+
+WORDS = ('search index crawler python rust performance memory latency cache '
+         'parser markup browser server database query vector language model '
+         'release version feature bug fix support library framework example '
+         'the of and to in is for with on that this by from at as are be').split()
+
+
+class Page(NamedTuple):
+    kind: str
+    url: str
+    html: str
+    content_type: str
+
+
+def _sentence(rng: random.Random, length: int) -> str:
+    words = [rng.choice(WORDS) for _ in range(length)]
+    return ' '.join(words).capitalize() + '.'
+
+
+def _paragraphs(rng: random.Random, count: int) -> List[str]:
+    return ['<p>{}</p>'.format(' '.join(_sentence(rng, rng.randint(8, 20)) for _ in range(5)))
+            for _ in range(count)]
+
+
+def _boilerplate(rng: random.Random) -> Dict[str, str]:
+    nav = ''.join('<li><a href="/section/{0}">{0}</a></li>'.format(rng.choice(WORDS))
+                  for _ in range(30))
+    footer = ''.join('<a href="/about/{0}">{0}</a> '.format(rng.choice(WORDS)) for _ in range(40))
+    return {
+        'nav': '<nav><ul>{}</ul></nav>'.format(nav),
+        'footer': '<footer>{}<p>Copyright, all rights reserved</p></footer>'.format(footer),
+        'cookies': '<div class="cookie-banner">We use cookies to improve your experience. '
+                   '<a href="/privacy">Privacy policy</a> <button>Accept</button></div>',
+    }
+
+
+def json_ld_news_page(rng: random.Random, i: int) -> Page:
+    url = 'https://news.example.com/2023/01/article-{}'.format(i)
+    keywords = [rng.choice(WORDS) for _ in range(8)]
+    graph = [{'@type': 'WebSite', '@id': 'https://news.example.com/#website',
+              'url': 'https://news.example.com/', 'name': 'Example News'}]
+    # Typical SEO plugin output: lots of nodes, only one of them is the article
+    for n in range(20):
+        graph.append({'@type': 'ImageObject', '@id': '{}#image-{}'.format(url, n),
+                      'url': 'https://news.example.com/img/{}-{}.jpg'.format(i, n),
+                      'width': 1200, 'height': 800, 'caption': _sentence(rng, 10)})
+    graph.append({'@type': 'NewsArticle', '@id': url, 'url': url,
+                  'headline': _sentence(rng, 8), 'datePublished': '2023-01-{:02d}T10:00:00+00:00'.format(i % 28 + 1),
+                  'keywords': ','.join(keywords),
+                  'author': {'@type': 'Person', 'name': 'Someone'}})
+    breadcrumbs = {'@context': 'https://schema.org', '@type': 'BreadcrumbList',
+                   'itemListElement': [{'@type': 'ListItem', 'position': n, 'name': rng.choice(WORDS),
+                                        'item': 'https://news.example.com/{}'.format(n)} for n in range(5)]}
+    parts = _boilerplate(rng)
+    html = '''<!DOCTYPE html><html><head><title>{title}</title>
+<meta charset="utf-8">
+<script type="application/ld+json">{graph}</script>
+<script type="application/ld+json">{breadcrumbs}</script>
+<script>window.analytics = {{"id": "UA-000", "events": []}};</script>
+</head><body>{nav}{cookies}<main><article><h1>{title}</h1>{body}</article></main>{footer}</body></html>'''.format(
+        title=_sentence(rng, 8),
+        graph=json.dumps({'@context': 'https://schema.org', '@graph': graph}),
+        breadcrumbs=json.dumps(breadcrumbs),
+        body=''.join(_paragraphs(rng, 30)), **parts)
+    return Page('json-ld-news', url, html, 'text/html; charset=utf-8')
+
+
+def rdfa_blog_page(rng: random.Random, i: int) -> Page:
+    url = 'https://blog.example.org/posts/{}/'.format(i)
+    tags = ''.join('<meta property="article:tag" content="{}" />'.format(rng.choice(WORDS))
+                   for _ in range(6))
+    parts = _boilerplate(rng)
+    html = '''<html prefix="og: http://ogp.me/ns# article: http://ogp.me/ns/article#"><head>
+<title>{title}</title>
+<meta property="og:type" content="article" />
+<meta property="og:title" content="{title}" />
+<meta property="og:url" content="{url}" />
+<meta property="article:published_time" content="2022-06-{day:02d}T08:30:00Z" />
+{tags}
+</head><body vocab="http://schema.org/" typeof="Blog">{nav}
+<div property="blogPost" typeof="BlogPosting"><h1 property="headline">{title}</h1>
+<div property="articleBody">{body}</div></div>
+<aside>{aside}</aside>{footer}</body></html>'''.format(
+        title=_sentence(rng, 6), url=url, day=i % 28 + 1, tags=tags,
+        body=''.join(_paragraphs(rng, 15)), aside=''.join(_paragraphs(rng, 3)),
+        nav=parts['nav'], footer=parts['footer'])
+    return Page('rdfa-blog', url, html, 'text/html; charset=utf-8')
+
+
+def huge_readme_page(rng: random.Random, i: int) -> Page:
+    url = 'https://github.com/example/project-{}'.format(i)
+    sections = []
+    for n in range(400):
+        sections.append('<h2>{}</h2>'.format(_sentence(rng, 4)))
+        sections.extend(_paragraphs(rng, 3))
+        sections.append('<pre><code>{}</code></pre>'.format(
+            '\n'.join('x = {}({})'.format(rng.choice(WORDS), n) for _ in range(10))))
+        sections.append('<ul>{}</ul>'.format(''.join(
+            '<li><a href="https://example.com/{0}">{0}</a></li>'.format(rng.choice(WORDS)) for _ in range(5))))
+    html = '<div id="readme" class="Box-body"><article class="markdown-body">{}</article></div>'.format(
+        ''.join(sections))
+    return Page('huge-readme', url, html, 'application/vnd.github.v3.html; charset=utf-8')
+
+
+def malformed_page(rng: random.Random, i: int) -> Page:
+    url = 'http://old-site.example.net/page{}.html'.format(i)
+    body = []
+    for _ in range(40):
+        # Unclosed tags, stray closing tags, bad nesting
+        body.append('<p><b>{}<i>{}</b></i>'.format(_sentence(rng, 10), _sentence(rng, 6)))
+        body.append('<td>{}</tr></div>'.format(rng.choice(WORDS)))
+        body.append('<font color=red>{}'.format(_sentence(rng, 5)))
+    html = '''<HTML><HEAD><TITLE>{title}
+<meta name=keywords content="{keywords}">
+<script type="application/ld+json">{{"@type": "Article", "datePublished": "2010-01-01", "keywords": [broken</script>
+</HEAD><BODY BGCOLOR=white><table><tr><td>{body}</BODY>'''.format(
+        title=_sentence(rng, 5), keywords=','.join(rng.choice(WORDS) for _ in range(5)),
+        body=''.join(body))
+    return Page('malformed', url, html, 'text/html')
+
+
+GENERATORS = [json_ld_news_page, rdfa_blog_page, huge_readme_page, malformed_page]
+
+
+def generate(pages_per_kind: int = 5, seed: int = 20230101) -> List[Page]:
+    rng = random.Random(seed)
+    pages = []
+    for generator in GENERATORS:
+        for i in range(pages_per_kind):
+            pages.append(generator(rng, i))
+    return pages
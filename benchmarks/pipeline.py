@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Pushes a synthetic stream of items through the item pipelines (minus the
+# elasticsearch sink) and reports throughput and peak memory.
+#
+# Usage: python -m benchmarks.pipeline [--items N] [--in-flight N]
+
+import argparse
+import resource
+import sys
+import time
+from collections import deque
+from typing import Any, Iterator, List
+
+from searchbox.items import CrawlItem
+from searchbox.pipelines import (CleanupPipeline, ConvertToItemPipeline, LanguagePipeline,
+                                 SearchboxPipeline)
+
+
+class _Logger:
+    def exception(self, msg: str) -> None:
+        sys.stderr.write(msg + '\n')
+
+
+class _Spider:
+    name = 'benchmark'
+    logger = _Logger()
+
+
+def synthetic_items(count: int) -> Iterator[CrawlItem]:
+    # Same mix the spiders produce: API metadata items with tags, followed by
+    # content items for the same URL. No html, so this measures the item
+    # handling itself rather than the metadata extraction.
+    for i in range(count):
+        url = 'https://example.com/project/{}'.format(i)
+        if i % 2 == 0:
+            yield CrawlItem(name='project {}'.format(i),
+                            description='A description of project {}'.format(i),
+                            url=url,
+                            last_update='2023-01-01T00:00:00',
+                            repository_tags=['python', 'search', 'tag{}'.format(i % 50)])
+        else:
+            yield CrawlItem(url=url, content='Some content ' * 64,
+                            repository_backlink='https://github.com/user/{}'.format(i))
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run(count: int, in_flight: int) -> None:
+    spider: Any = _Spider()
+    pipelines: List[Any] = [SearchboxPipeline(), CleanupPipeline(), ConvertToItemPipeline(),
+                            LanguagePipeline(merge=True)]
+
+    start_rss = peak_rss_mb()
+    start = time.perf_counter()
+    processed = 0
+
+    # Items wait in a window before being processed, like they would in the
+    # scraper queue while the pipelines are busy
+    window: 'deque[CrawlItem]' = deque()
+
+    def process(item: CrawlItem) -> None:
+        result: Any = item
+        for pipeline in pipelines:
+            result = pipeline.process_item(result, spider)
+
+    for item in synthetic_items(count):
+        window.append(item)
+        if len(window) > in_flight:
+            process(window.popleft())
+            processed += 1
+
+    while window:
+        process(window.popleft())
+        processed += 1
+
+    elapsed = time.perf_counter() - start
+
+    print('items:        {}'.format(processed))
+    print('elapsed:      {:.2f}s'.format(elapsed))
+    print('items/sec:    {:.0f}'.format(processed / elapsed if elapsed else 0.0))
+    print('peak RSS:     {:.1f}MB (at start: {:.1f}MB)'.format(peak_rss_mb(), start_rss))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Item pipeline benchmark')
+    parser.add_argument('--items', type=int, default=100000,
+                        help='Number of synthetic items to process')
+    parser.add_argument('--in-flight', type=int, default=10000,
+                        help='Number of items waiting to be processed at any time')
+    args = parser.parse_args()
+    run(args.items, args.in_flight)
+
+
+if __name__ == '__main__':
+    main()
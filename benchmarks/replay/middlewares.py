@@ -0,0 +1,100 @@
+# Components the replay settings add to a normal crawl: every outgoing request
+# is sent to the replay stub instead of its real host, and the response is
+# given its original URL back before the spider sees it, so spiders, the
+# router and the pipelines run unchanged.
+
+import json
+import os
+from collections.abc import Iterable
+from typing import Any, Type, Union
+from urllib.parse import urlsplit
+
+from scrapy import Request, Spider, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response
+
+from searchbox.types import SpiderRequests, SpiderResults
+
+from .server import to_stub_url
+
+REPLAY_URL_ENV = 'SEARCHBOX_REPLAY_URL'
+STATS_DIR_ENV = 'SEARCHBOX_REPLAY_STATS_DIR'
+
+
+class ReplaySpiderMiddleware(object):
+    def __init__(self, stub_base: str) -> None:
+        self.stub_base = stub_base
+
+    @classmethod
+    def from_crawler(cls: Type['ReplaySpiderMiddleware'], crawler: Crawler) -> 'ReplaySpiderMiddleware':
+        stub_base = os.environ.get(REPLAY_URL_ENV)
+        if not stub_base:
+            raise NotConfigured
+        return cls(stub_base)
+
+    def _rewrite(self, request: Request) -> Request:
+        if 'replay_url' in request.meta:
+            return request
+        host = urlsplit(request.url).netloc
+        # Keep one download slot per original host, so the per-domain
+        # concurrency limits behave like in a real crawl
+        meta = dict(request.meta, replay_url=request.url, download_slot=host)
+        return request.replace(url=to_stub_url(self.stub_base, request.url), meta=meta)
+
+    def process_spider_output(
+        self,
+        result: SpiderResults,
+        spider: Spider,
+        response: Any = None,
+    ) -> SpiderResults:
+        for i in result:
+            yield self._rewrite(i) if isinstance(i, Request) else i
+
+    def process_start_requests(
+        self, start_requests: Iterable[Request], spider: Spider
+    ) -> SpiderRequests:
+        for r in start_requests:
+            yield self._rewrite(r)
+
+
+class ReplayDownloaderMiddleware(object):
+    @classmethod
+    def from_crawler(cls: Type['ReplayDownloaderMiddleware'], crawler: Crawler) -> 'ReplayDownloaderMiddleware':
+        if not os.environ.get(REPLAY_URL_ENV):
+            raise NotConfigured
+        return cls()
+
+    def process_response(
+        self, request: Request, response: Response, spider: Spider
+    ) -> Union[Request, Response]:
+        original = request.meta.get('replay_url')
+        if original is None:
+            return response
+        return response.replace(url=original)
+
+
+# Writes each spider's final stats, the runner adds them up for the report
+class StatsDumpExtension(object):
+    def __init__(self, crawler: Crawler, output_dir: str) -> None:
+        self.crawler = crawler
+        self.output_dir = output_dir
+
+    @classmethod
+    def from_crawler(cls: Type['StatsDumpExtension'], crawler: Crawler) -> 'StatsDumpExtension':
+        output_dir = os.environ.get(STATS_DIR_ENV)
+        if not output_dir:
+            raise NotConfigured
+        ext = cls(crawler, output_dir)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_closed(self, spider: Spider) -> None:
+        assert self.crawler.stats is not None
+        stats = self.crawler.stats.get_stats()
+        name = spider.name
+        shard = self.crawler.settings.get('SEARCHBOX_SHARD')
+        if shard:
+            name += '-' + shard.replace('/', '-of-')
+        with open(os.path.join(self.output_dir, '{}.json'.format(name)), 'w') as f:
+            json.dump(stats, f, indent=2, sort_keys=True, default=str)
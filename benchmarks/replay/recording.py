@@ -0,0 +1,194 @@
+# Recordings map requests to the responses the replay stub serves for them.
+#
+# Requests are matched by method, URL and form body, minus the parameters
+# that change on every run or carry credentials (OAuth signatures, API keys),
+# see `request_key`. A recording can be saved as JSON lines and loaded back,
+# the synthetic one below stands in for the four APIs and the pages they link.
+
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from ..corpus import json_ld_news_page, malformed_page, rdfa_blog_page
+
+VOLATILE_PARAMS = ('oauth_', 'consumer_key', 'access_token')
+
+
+class RecordedResponse(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+Recording = Dict[str, RecordedResponse]
+
+
+def _stable_params(params: Iterable[Tuple[str, str]]) -> str:
+    return urlencode(sorted((k, v) for k, v in params if not k.startswith(VOLATILE_PARAMS)))
+
+
+def request_key(method: str, url: str, body: bytes = b'') -> str:
+    parts = urlsplit(url)
+    query = _stable_params(parse_qsl(parts.query, keep_blank_values=True))
+    form = ''
+    if method == 'POST' and body:
+        form = _stable_params(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+    return '{} {}://{}{}?{} {}'.format(method, parts.scheme, parts.netloc, parts.path, query, form)
+
+
+def save(recording: Recording, path: str) -> None:
+    with open(path, 'w') as f:
+        for key, response in recording.items():
+            f.write(json.dumps({'key': key, 'status': response.status, 'headers': response.headers,
+                                'body': response.body.decode('utf-8')}) + '\n')
+
+
+def load(path: str) -> Recording:
+    recording = {}
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            recording[entry['key']] = RecordedResponse(entry['status'], entry['headers'],
+                                                       entry['body'].encode('utf-8'))
+    return recording
+
+
+JSON_HEADERS = {'Content-Type': 'application/json; charset=utf-8'}
+HTML_HEADERS = {'Content-Type': 'text/html; charset=utf-8'}
+
+
+def _json(data: object, link: Optional[str] = None) -> RecordedResponse:
+    headers = dict(JSON_HEADERS)
+    if link:
+        headers['Link'] = '<{}>; rel="next"'.format(link)
+    return RecordedResponse(200, headers, json.dumps(data).encode('utf-8'))
+
+
+def _html(html: str, content_type: str = HTML_HEADERS['Content-Type']) -> RecordedResponse:
+    return RecordedResponse(200, {'Content-Type': content_type}, html.encode('utf-8'))
+
+
+PAGE_GENERATORS = [json_ld_news_page, rdfa_blog_page, malformed_page]
+
+
+class Synthesizer(object):
+    def __init__(self, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.recording: Recording = {}
+        self.base_date = datetime(2023, 1, 1)
+
+    def add(self, method: str, url: str, response: RecordedResponse, body: bytes = b'') -> None:
+        self.recording[request_key(method, url, body)] = response
+
+    def page(self, url: str) -> None:
+        # Content from the benchmark corpus, served under a URL on its own
+        # host, the way bookmarked pages are spread over many domains
+        generator = self.rng.choice(PAGE_GENERATORS)
+        page = generator(self.rng, self.rng.randint(0, 1000))
+        self.add('GET', url, _html(page.html))
+
+    def readme(self) -> str:
+        sections = []
+        for n in range(self.rng.randint(3, 30)):
+            words = ' '.join(self.rng.choice(['install', 'usage', 'fast', 'config', 'example',
+                                              'the', 'and', 'library', 'api']) for _ in range(60))
+            sections.append('<h2>Section {}</h2><p>{}</p><pre><code>run --{}</code></pre>'.format(
+                n, words, n))
+        return '<div id="readme"><article class="markdown-body">{}</article></div>'.format(
+            ''.join(sections))
+
+    def date(self, days: int) -> str:
+        return (self.base_date - timedelta(days=days)).isoformat() + 'Z'
+
+    def github(self, user: str, repos: int, per_page: int = 30) -> None:
+        self.add('GET', 'https://api.github.com/gists/starred', _json([]))
+        base = 'https://api.github.com/users/{}/starred'.format(user)
+        pages = (repos + per_page - 1) // per_page
+        for page in range(pages):
+            url = base if page == 0 else '{}?page={}'.format(base, page + 1)
+            next_url = '{}?page={}'.format(base, page + 2) if page + 1 < pages else None
+            starred = []
+            for i in range(page * per_page, min(repos, (page + 1) * per_page)):
+                api_url = 'https://api.github.com/repos/owner{0}/repo{0}'.format(i)
+                starred.append({'url': api_url, 'html_url': 'https://github.com/owner{0}/repo{0}'.format(i),
+                                'name': 'repo{}'.format(i), 'description': 'Repository number {}'.format(i)})
+                homepage = 'https://site-{}.example/'.format(i) if i % 2 == 0 else None
+                self.add('GET', api_url, _json({'url': api_url, 'updated_at': self.date(i),
+                                                'topics': ['topic{}'.format(i % 7), 'python'],
+                                                'name': 'repo{}'.format(i), 'homepage': homepage}))
+                self.add('GET', api_url + '/readme',
+                         _html(self.readme(), 'application/vnd.github.v3.html; charset=utf-8'))
+                if homepage:
+                    self.page(homepage)
+            self.add('GET', url, _json(starred, link=next_url))
+
+    def gitlab(self, user: str, projects: int) -> None:
+        self.add('GET', 'https://gitlab.com/api/v4/users?username={}'.format(user), _json([{'id': 42}]))
+        # The spider asks for one project per page
+        base = 'https://gitlab.com/api/v4/users/42/starred_projects?per_page=1'
+        for i in range(projects):
+            url = base if i == 0 else '{}&page={}'.format(base, i + 1)
+            next_url = '{}&page={}'.format(base, i + 2) if i + 1 < projects else None
+            web_url = 'https://gitlab.com/gowner{0}/gproject{0}'.format(i)
+            homepage = 'https://gsite-{}.example/'.format(i)
+            readme_url = web_url + '/-/blob/main/README.md'
+            project = {'web_url': web_url, 'name': 'gproject{}'.format(i),
+                       'description': 'A project, see [the site]({})'.format(homepage),
+                       'last_activity_at': self.date(i), 'tag_list': ['gitlab', 'tag{}'.format(i % 5)],
+                       'readme_url': readme_url}
+            self.add('GET', url, _json([project], link=next_url))
+            self.add('GET', readme_url + '?format=json', _json({'html': self.readme()}))
+            self.page(homepage)
+
+    def pocket(self, items: int, per_page: int = 50) -> None:
+        url = 'https://getpocket.com/v3/get'
+        for offset in range(0, items + per_page, per_page):
+            entries = {}
+            for i in range(offset, min(items, offset + per_page)):
+                item_url = 'https://psite-{}.example/article/{}'.format(i % 500, i)
+                entries[str(i)] = {'item_id': str(i), 'resolved_title': 'Article {}'.format(i),
+                                   'excerpt': 'An article worth reading later', 'time_added': str(1600000000 + i),
+                                   'resolved_url': item_url, 'given_url': item_url,
+                                   'tags': {'reading': {}, 'topic-{}'.format(i % 9): {}}}
+                self.page(item_url)
+            body = urlencode([('count', str(per_page)), ('offset', str(offset)),
+                              ('state', 'all'), ('detailType', 'complete')]).encode('utf-8')
+            self.add('POST', url, _json({'status': 1, 'list': entries}), body=body)
+
+    def twitter(self, tweets: int, per_page: int = 100) -> None:
+        base = 'https://api.twitter.com/1.1/favorites/list.json?count={}&tweet_mode=extended'.format(per_page)
+        ids = [10 ** 15 - i * 1000 for i in range(tweets)]
+        max_id: Optional[int] = None
+        for start in range(0, tweets + per_page, per_page):
+            url = base if max_id is None else '{}&max_id={}'.format(base, max_id)
+            page: List[Dict[str, Any]] = []
+            for i in range(start, min(tweets, start + per_page)):
+                linked = 'https://tsite-{}.example/post/{}'.format(i % 300, i)
+                created = (self.base_date - timedelta(hours=i)).strftime('%a %b %d %H:%M:%S +0000 %Y')
+                page.append({'id': ids[i], 'full_text': 'Interesting thread number {} #python'.format(i),
+                             'created_at': created, 'user': {'screen_name': 'someone{}'.format(i % 40)},
+                             'entities': {'hashtags': [{'text': 'python'}], 'urls': [{'expanded_url': linked}]}})
+                self.page(linked)
+            self.add('GET', url, _json(page))
+            if page:
+                max_id = page[-1]['id'] - 1
+
+
+def synthesize(repos: int, gitlab_projects: int, pocket_items: int, tweets: int,
+               user: str = 'replay-user', seed: int = 20230101) -> Recording:
+    synthesizer = Synthesizer(seed)
+    synthesizer.github(user, repos)
+    synthesizer.gitlab(user, gitlab_projects)
+    synthesizer.pocket(pocket_items)
+    synthesizer.twitter(tweets)
+    return synthesizer.recording
+
+
+def summary(recording: Recording) -> List[str]:
+    hosts: Dict[str, int] = {}
+    for key in recording:
+        host = urlsplit(key.split(' ')[1]).netloc
+        hosts[host] = hosts.get(host, 0) + 1
+    return ['{} responses over {} hosts'.format(len(recording), len(hosts))]
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Offline end-to-end crawl benchmark: runs the real crawl (all four spiders,
+# the router, extractors and pipelines) against a local stub serving recorded
+# API responses and pages, and a fake elasticsearch that accepts the bulk
+# requests. Reports wall time, items and requests per second and peak memory.
+#
+# Usage: python -m benchmarks.replay.run [--repos N] [--gitlab-projects N]
+#                                        [--pocket-items N] [--tweets N]
+#                                        [--latency SECS] [--recording FILE]
+#                                        [--save-recording FILE] [--save FILE]
+#                                        [--workers] [--shards N]
+#
+# Without --recording the responses are synthesized from a fixed seed.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from . import recording as recordings
+from .middlewares import REPLAY_URL_ENV, STATS_DIR_ENV
+from .recording import Recording
+from .server import FakeElasticsearch, ReplayServer, documents_received
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SECRETS_TEMPLATE = '''
+github = {{'users_to_crawl': ['{user}'], 'username': '{user}', 'personal_access_token': 'replay'}}
+gitlab = {{'users_to_crawl': ['{user}'], 'personal_access_token': 'replay'}}
+pocket = {{'consumer_key': 'replay', 'access_token': 'replay'}}
+twitter = {{'consumer_key': 'replay', 'consumer_secret': 'replay',
+           'access_token_key': 'replay', 'access_token_secret': 'replay'}}
+elastic = {{'url': '{elastic_url}'}}
+'''
+
+# Makes the work directory the project directory of the crawl, so its data
+# (job state, seen requests, tag vocabulary, timings) stays out of the real
+# project's .scrapy folder
+SCRAPY_CFG_TEMPLATE = '''[settings]
+default = benchmarks.replay.settings
+
+[datadir]
+default = {data_dir}
+'''
+
+
+def run_crawl(replay: ReplayServer, elastic: FakeElasticsearch, user: str, workdir: str,
+              crawl_args: List[str]) -> Dict[str, Any]:
+    secrets_file = os.path.join(workdir, 'secrets.py')
+    with open(secrets_file, 'w') as f:
+        f.write(SECRETS_TEMPLATE.format(user=user, elastic_url=elastic.url))
+    with open(os.path.join(workdir, 'scrapy.cfg'), 'w') as f:
+        f.write(SCRAPY_CFG_TEMPLATE.format(data_dir=os.path.join(workdir, '.scrapy')))
+    stats_dir = os.path.join(workdir, 'stats')
+    os.makedirs(stats_dir)
+
+    env = dict(os.environ)
+    env.update({
+        'SCRAPY_SETTINGS_MODULE': 'benchmarks.replay.settings',
+        'PYTHONPATH': ROOT,
+        'SEARCHBOX_SECRETS': secrets_file,
+        REPLAY_URL_ENV: replay.url,
+        STATS_DIR_ENV: stats_dir,
+    })
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'searchbox', 'crawl.py')] + crawl_args,
+                   cwd=workdir, env=env, check=True)
+    elapsed = time.perf_counter() - start
+
+    stats = {}
+    for name in sorted(os.listdir(stats_dir)):
+        with open(os.path.join(stats_dir, name)) as f:
+            stats[name[:-len('.json')]] = json.load(f)
+    if not stats:
+        raise RuntimeError('The crawl finished without any stats, no spider ran')
+
+    items = sum(s.get('item_scraped_count', 0) for s in stats.values())
+    requests = sum(s.get('downloader/request_count', 0) for s in stats.values())
+    return {
+        'seconds': elapsed,
+        'items': items,
+        'requests': requests,
+        'items_per_sec': items / elapsed,
+        'requests_per_sec': requests / elapsed,
+        # Kilobytes on Linux. The largest process, with --workers that's
+        # one of the workers, not their total.
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0,
+        'documents_indexed': documents_received(elastic),
+        'bulk_requests': elastic.bulk_requests,
+        'responses_served': replay.served,
+        'responses_missing': sum(replay.missing.values()),
+        'spiders': {name: {'items': s.get('item_scraped_count', 0),
+                           'requests': s.get('downloader/request_count', 0)}
+                    for name, s in stats.items()},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Offline crawl benchmark against recorded responses')
+    parser.add_argument('--repos', type=int, default=200, help='Starred GitHub repositories')
+    parser.add_argument('--gitlab-projects', type=int, default=50, help='Starred GitLab projects')
+    parser.add_argument('--pocket-items', type=int, default=300, help='Pocket items')
+    parser.add_argument('--tweets', type=int, default=300, help='Liked tweets')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds the stub waits before every response')
+    parser.add_argument('--recording', help='Replay this recording instead of a synthetic one')
+    parser.add_argument('--save-recording', help='Save the replayed recording to this file')
+    parser.add_argument('--save', help='Save the results as JSON to this file')
+    parser.add_argument('--user', default='replay-user')
+    parser.add_argument('--workers', action='store_true', help='Crawl with a process per spider')
+    parser.add_argument('--shards', type=int, default=1, help='With --workers, processes per spider')
+    args = parser.parse_args()
+
+    recording: Recording
+    if args.recording:
+        recording = recordings.load(args.recording)
+    else:
+        recording = recordings.synthesize(args.repos, args.gitlab_projects, args.pocket_items,
+                                          args.tweets, user=args.user)
+    if args.save_recording:
+        recordings.save(recording, args.save_recording)
+    for line in recordings.summary(recording):
+        print('Recording: {}'.format(line))
+
+    replay = ReplayServer(recording, latency=args.latency)
+    elastic = FakeElasticsearch()
+    replay.start()
+    elastic.start()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            # Never resume whatever an earlier, interrupted run left behind
+            crawl_args = ['--restart']
+            if args.workers:
+                crawl_args += ['--workers', '--shards', str(args.shards)]
+            result = run_crawl(replay, elastic, args.user, workdir, crawl_args)
+    finally:
+        replay.stop()
+        elastic.stop()
+
+    print('{:<24} {:>8} {:>10}'.format('spider', 'items', 'requests'))
+    for name, spider in result['spiders'].items():
+        print('{:<24} {:>8} {:>10}'.format(name, spider['items'], spider['requests']))
+    print()
+    print('Wall time:      {:.2f}s'.format(result['seconds']))
+    print('Items/sec:      {:.1f} ({} items)'.format(result['items_per_sec'], result['items']))
+    print('Requests/sec:   {:.1f} ({} requests)'.format(result['requests_per_sec'], result['requests']))
+    print('Peak RSS:       {:.1f}MB'.format(result['peak_rss_mb']))
+    print('Indexed:        {} documents in {} bulk requests'.format(
+        result['documents_indexed'], result['bulk_requests']))
+    if result['responses_missing']:
+        print('Not recorded:   {} requests got a 404'.format(result['responses_missing']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# Local HTTP servers for the replay benchmark: the stub serving recorded
+# responses, and a fake elasticsearch that accepts bulk requests and counts
+# what it receives.
+#
+# Stub URLs embed the original one: http://127.0.0.1:PORT/<scheme>/<host>/<path>
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+from .recording import Recording, request_key
+
+
+def to_stub_url(stub_base: str, url: str) -> str:
+    parts = urlsplit(url)
+    stub = '{}/{}/{}{}'.format(stub_base, parts.scheme, parts.netloc, parts.path or '/')
+    if parts.query:
+        stub += '?' + parts.query
+    return stub
+
+
+def from_stub_path(path: str) -> str:
+    scheme, rest = path.lstrip('/').split('/', 1)
+    return '{}://{}'.format(scheme, rest)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler: Any) -> None:
+        super().__init__(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class ReplayServer(_Server):
+    def __init__(self, recording: Recording, latency: float = 0.0) -> None:
+        self.recording = recording
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.served = 0
+        self.missing: Dict[str, int] = {}
+        super().__init__(_ReplayHandler)
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    server: ReplayServer
+    protocol_version = 'HTTP/1.1'
+
+    def _replay(self, method: str) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        url = from_stub_path(self.path)
+        response = self.server.recording.get(request_key(method, url, body))
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        with self.server.lock:
+            if response is None:
+                key = request_key(method, url, body)
+                self.server.missing[key] = self.server.missing.get(key, 0) + 1
+            else:
+                self.server.served += 1
+
+        if response is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def do_GET(self) -> None:
+        self._replay('GET')
+
+    def do_POST(self) -> None:
+        self._replay('POST')
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class FakeElasticsearch(_Server):
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.bulk_requests = 0
+        self.operations: Dict[str, int] = {}
+        self.bytes_received = 0
+        super().__init__(_ElasticHandler)
+
+
+class _ElasticHandler(BaseHTTPRequestHandler):
+    server: FakeElasticsearch
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, data: Any, status: int = 200) -> None:
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        # Checked by the 7.x clients since 7.14
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        self._send_json({'name': 'replay', 'cluster_name': 'replay', 'tagline': 'You Know, for Search',
+                         'version': {'number': '7.17.0', 'build_flavor': 'default'}})
+
+    def do_HEAD(self) -> None:
+        self._send_json({})
+
+    def _bulk(self, body: bytes) -> None:
+        items = []
+        counts: Dict[str, int] = {}
+        expect_source = False
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            if expect_source:
+                expect_source = False
+                continue
+            action: Dict[str, Any] = json.loads(line)
+            op, meta = next(iter(action.items()))
+            counts[op] = counts.get(op, 0) + 1
+            # Everything but deletes is followed by a document
+            expect_source = op != 'delete'
+            items.append({op: {'_index': meta.get('_index'), '_id': meta.get('_id'),
+                               'status': 200, 'result': 'updated'}})
+
+        with self.server.lock:
+            self.server.bulk_requests += 1
+            self.server.bytes_received += len(body)
+            for op, count in counts.items():
+                self.server.operations[op] = self.server.operations.get(op, 0) + count
+
+        self._send_json({'took': 1, 'errors': False, 'items': items})
+
+    def _handle_write(self) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if urlsplit(self.path).path.endswith('/_bulk'):
+            self._bulk(body)
+        else:
+            self._send_json({'acknowledged': True})
+
+    def do_POST(self) -> None:
+        self._handle_write()
+
+    def do_PUT(self) -> None:
+        self._handle_write()
+
+    def do_DELETE(self) -> None:
+        self._send_json({'acknowledged': True})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def documents_received(es: FakeElasticsearch) -> int:
+    return sum(count for op, count in es.operations.items() if op != 'delete')
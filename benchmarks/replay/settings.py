@@ -0,0 +1,28 @@
+# Settings for crawls against the replay stub, see benchmarks/replay/run.py.
+# Everything else is the normal crawl configuration.
+
+from searchbox.settings import *  # noqa: F401,F403
+from searchbox.settings import EXTENSIONS, SPIDER_MIDDLEWARES
+
+# The stub has no robots.txt, and caching would make the replay measure the
+# cache instead of the crawl
+ROBOTSTXT_OBEY = False
+HTTPCACHE_ENABLED = False
+# Every run starts from an empty index
+SEARCHBOX_SKIP_UNCHANGED = False
+SEARCHBOX_REFRESH_FILE = ''
+SEARCHBOX_LIVE_URLS_FILE = ''
+
+LOG_LEVEL = 'ERROR'
+
+SPIDER_MIDDLEWARES = dict(SPIDER_MIDDLEWARES)
+# After the router, right before requests reach the engine
+SPIDER_MIDDLEWARES['benchmarks.replay.middlewares.ReplaySpiderMiddleware'] = -10
+
+DOWNLOADER_MIDDLEWARES = {
+    # First to see responses, so the other middlewares get the original URL
+    'benchmarks.replay.middlewares.ReplayDownloaderMiddleware': 1000,
+}
+
+EXTENSIONS = dict(EXTENSIONS)
+EXTENSIONS['benchmarks.replay.middlewares.StatsDumpExtension'] = 0
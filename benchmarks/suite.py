@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# Throughput and memory benchmarks for the extractors and the item pipelines,
+# over the generated corpus in benchmarks/corpus.py.
+#
+# Usage: python -m benchmarks.suite [--repeat N] [--pages N] [--only CASE]
+#                                   [--save FILE] [--compare FILE]
+#
+# --save writes the results as a baseline, --compare prints the change against
+# a baseline and exits with an error if any case regressed past --threshold.
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from scrapy.http import HtmlResponse, Request, TextResponse
+
+from searchbox.content import main_content
+from searchbox.extractors import MicroformatExtractor, body_text, compare_urls
+from searchbox.items import CrawlItem
+from searchbox.language import detect
+from searchbox.pipelines import (CleanupPipeline, ConvertToItemPipeline, LanguagePipeline,
+                                 SearchboxPipeline)
+
+from .corpus import Page, generate
+
+
+class _Logger:
+    def exception(self, msg: str) -> None:
+        pass
+
+
+class _Spider:
+    name = 'benchmark'
+    logger = _Logger()
+
+
+def make_response(page: Page) -> TextResponse:
+    headers = {'Content-Type': page.content_type}
+    body = page.html.encode('utf-8')
+    request = Request(page.url)
+    if page.content_type.startswith('text/html'):
+        return HtmlResponse(page.url, body=body, headers=headers, request=request)
+    return TextResponse(page.url, body=body, headers=headers, request=request, encoding='utf-8')
+
+
+def make_extractor(page: Page) -> Optional[MicroformatExtractor]:
+    try:
+        return MicroformatExtractor(page.url, page.html)
+    except Exception:
+        return None
+
+
+# A case turns the corpus into a list of inputs (built outside the timed
+# section) and the operation to run on each of them
+class Case(NamedTuple):
+    name: str
+    setup: Callable[[List[Page]], List[Any]]
+    run: Callable[[Any], Any]
+
+
+def _url_pairs(pages: List[Page]) -> List[Any]:
+    pairs = []
+    for page in pages:
+        pairs.append((page.url, page.url + '/'))
+        pairs.append((page.url, page.url.replace('https://', 'http://')))
+        pairs.append((page.url, 'www.example.com/other'))
+    return pairs * 50
+
+
+def _pipeline_items(pages: List[Page]) -> List[Any]:
+    return [CrawlItem(url=page.url, content='text', html=page.html) for page in pages]
+
+
+_PIPELINES: List[Any] = [SearchboxPipeline(), CleanupPipeline(), ConvertToItemPipeline(),
+                        LanguagePipeline(merge=True)]
+
+
+def _run_pipelines(item: CrawlItem) -> Any:
+    result: Any = item
+    for pipeline in _PIPELINES:
+        result = pipeline.process_item(result, _Spider())
+    return result
+
+
+def _extract_metadata(page: Page) -> Any:
+    # Extraction is lazy, this is what the pipeline does with each page
+    extractor = MicroformatExtractor(page.url, page.html)
+    return sorted(set(extractor.get_tags())), extractor.get_published_date()
+
+
+def _safe(fn: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    # The malformed pages make some extractors raise, which is part of the
+    # normal workload, the pipeline catches those too
+    def run(arg: Any) -> Any:
+        try:
+            return fn(arg)
+        except Exception:
+            return None
+    return run
+
+
+CASES = [
+    Case('body_text', lambda pages: [make_response(p) for p in pages], body_text),
+    Case('microformat_extractor', lambda pages: pages, _safe(_extract_metadata)),
+    Case('get_tags', lambda pages: [e for e in map(make_extractor, pages) if e],
+         _safe(lambda e: list(e.get_tags()))),
+    Case('get_published_date', lambda pages: [e for e in map(make_extractor, pages) if e],
+         _safe(lambda e: e.get_published_date())),
+    # On the parsed trees, body_text parses them
+    Case('main_content', lambda pages: [make_response(p).selector.root for p in pages
+                                        if p.content_type.startswith('text/html')], main_content),
+    Case('detect_language', lambda pages: [body_text(make_response(p))[1] or '' for p in pages], detect),
+    Case('compare_urls', _url_pairs, lambda pair: compare_urls(pair[0], pair[1])),
+    Case('pipeline_chain', _pipeline_items, _run_pipelines),
+]
+
+
+def measure(case: Case, pages: List[Page], repeat: int) -> Dict[str, float]:
+    elapsed = 0.0
+    ops = 0
+    for _ in range(repeat):
+        # Fresh inputs for every round, responses cache their parsed selector
+        inputs = case.setup(pages)
+        start = time.perf_counter()
+        for i in inputs:
+            case.run(i)
+        elapsed += time.perf_counter() - start
+        ops += len(inputs)
+
+    # Separate round for memory, tracemalloc slows everything down
+    inputs = case.setup(pages)
+    tracemalloc.start()
+    for i in inputs:
+        case.run(i)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'ops': ops,
+        'seconds': elapsed,
+        'ops_per_sec': ops / elapsed if elapsed else 0.0,
+        'peak_kb': peak / 1024.0,
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> bool:
+    ok = True
+    print('\n{:<24} {:>12} {:>10}'.format('vs baseline', 'ops/sec', 'peak mem'))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        speed = result['ops_per_sec'] / base['ops_per_sec'] - 1.0 if base['ops_per_sec'] else 0.0
+        memory = result['peak_kb'] / base['peak_kb'] - 1.0 if base['peak_kb'] else 0.0
+        regressed = speed < -threshold or memory > threshold
+        ok = ok and not regressed
+        print('{:<24} {:>+11.1f}% {:>+9.1f}%{}'.format(
+            name, speed * 100, memory * 100, '  REGRESSION' if regressed else ''))
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Extractor and pipeline benchmarks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=5, help='Pages of each kind in the corpus')
+    parser.add_argument('--only', action='append', help='Run only this case, can be repeated')
+    parser.add_argument('--save', help='Save the results as a baseline to this file')
+    parser.add_argument('--compare', help='Compare the results against this baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change that counts as a regression')
+    args = parser.parse_args()
+
+    pages = generate(args.pages)
+    print('Corpus: {} pages, {:.1f}MB of HTML'.format(
+        len(pages), sum(len(p.html) for p in pages) / 1024.0 / 1024.0))
+
+    results: Dict[str, Dict[str, float]] = {}
+    print('{:<24} {:>8} {:>10} {:>12} {:>12}'.format('case', 'ops', 'seconds', 'ops/sec', 'peak KB'))
+    for case in CASES:
+        if args.only and case.name not in args.only:
+            continue
+        result = measure(case, pages, args.repeat)
+        results[case.name] = result
+        print('{:<24} {:>8} {:>10.3f} {:>12.1f} {:>12.0f}'.format(
+            case.name, result['ops'], result['seconds'], result['ops_per_sec'], result['peak_kb']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
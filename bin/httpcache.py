@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+from typing import Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scrapy.utils.project import get_project_settings  # noqa: E402
+from searchbox.httpcache import cache_report, compact, get_cache_path, open_cache  # noqa: E402
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.stderr.write('Usage: {} report | compact [MAX_SIZE_MB]\n'.format(sys.argv[0]))
+        sys.exit(1)
+
+    settings = get_project_settings()
+    path = get_cache_path(settings)
+
+    action = sys.argv[1]
+    if action == 'report':
+        run_report(path)
+    elif action == 'compact':
+        max_size = settings.getint('SEARCHBOX_HTTPCACHE_MAX_SIZE')
+        if len(sys.argv) > 2:
+            max_size = int(sys.argv[2]) * 1024 * 1024
+        run_compact(path, max_size, settings.getint('HTTPCACHE_EXPIRATION_SECS'))
+    else:
+        sys.stderr.write('Unknown action {}\n'.format(action))
+        sys.exit(1)
+
+
+def run_report(path: str):
+    connection = open_cache(path)
+    reports = cache_report(connection)
+    connection.close()
+
+    print('Cache file: {} ({})'.format(path, format_size(os.path.getsize(path))))
+    print('{:<16} {:>8} {:>10} {:>10} {:>6} {:>12} {:>12}'.format(
+        'spider', 'entries', 'raw', 'stored', 'ratio', 'oldest', 'last used'))
+    for r in reports:
+        ratio = r.size / r.raw_size if r.raw_size else 1.0
+        print('{:<16} {:>8} {:>10} {:>10} {:>6.2f} {:>12} {:>12}'.format(
+            r.spider, r.entries, format_size(r.raw_size), format_size(r.size), ratio,
+            format_age(r.oldest), format_age(r.last_access)))
+
+
+def run_compact(path: str, max_size: int, max_age: int):
+    before = os.path.getsize(path)
+    connection = open_cache(path)
+    expired, evicted = compact(connection, max_size, max_age)
+    connection.close()
+    after = os.path.getsize(path)
+    print('Removed {} expired and {} least recently used responses, {} -> {}'.format(
+        expired, evicted, format_size(before), format_size(after)))
+
+
+def format_size(size: Optional[int]) -> str:
+    value = float(size or 0)
+    for unit in ['B', 'KB', 'MB']:
+        if value < 1024:
+            return '{:.1f}{}'.format(value, unit)
+        value /= 1024
+    return '{:.1f}GB'.format(value)
+
+
+def format_age(ts: Optional[float]) -> str:
+    if ts is None:
+        return '?'
+    days = (time.time() - ts) / 86400
+    return '{:.1f} days'.format(days)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,51 @@
 #!/usr/bin/env python3
+import argparse
+import os
+from collections import Counter
 import sys
-from elasticsearch import Elasticsearch
+import time
 import dateutil.parser
 from statistics import stdev, mean
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from searchbox.language import CJK, TEXT_SOURCE, language_mappings, unrouted  # noqa: E402
+from searchbox.queries import (DATE_FIELDS, TAG_SOURCES, Filters, facet_counts,  # noqa: E402
+                               facets_search, hybrid_ranking, rerank_query, results_search,
+                               text_query)
+from searchbox.search import INDEX_NAME, SCAN_SIZE, client, msearch  # noqa: E402
 
-INDEX_NAME = "scrapy"
 
 MAX_TITLE_LEN = 54
 
 def main():
     if len(sys.argv) < 2:
-        sys.stderr.write('Usage: {} q QUERY TERMS\n'.format(sys.argv[0]))
+        sys.stderr.write('Usage: {0} q QUERY TERMS\n'
+                         '       {0} filter [--tag TAG]... [--source SOURCE] [--year YEAR] [--facets] [QUERY TERMS]\n'
+                         '       {0} facets [--tag TAG]... [--source SOURCE] [--year YEAR] [--top N] [QUERY TERMS]\n'
+                         '       {0} sim QUERY TERMS\n'
+                         '       {0} build-vectors\n'
+                         '       {0} complete PREFIX\n'
+                         '       {0} build-terms\n'
+                         .format(sys.argv[0]))
         sys.exit(1)
 
     action = sys.argv[1]
     if action == 'q':
         query_terms = sys.argv[2:]
         run_query(query_terms)
+    elif action == 'filter':
+        run_filter(parse_filter_args(action, sys.argv[2:]))
+    elif action == 'facets':
+        run_facets(parse_filter_args(action, sys.argv[2:]))
+    elif action == 'sim':
+        run_similar(sys.argv[2:])
+    elif action == 'build-vectors':
+        run_build_vectors()
+    elif action == 'complete':
+        run_complete(sys.argv[2:])
+    elif action == 'build-terms':
+        run_build_terms()
     elif action == 'reset-index':
         run_reset_index()
     else:
@@ -25,35 +53,217 @@ def main():
         sys.exit(1)
 
 
-def init_elastic() -> Elasticsearch:
-    import os
-    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
-    from searchbox import secrets_loader
-    return Elasticsearch(hosts=[secrets_loader.get_elastic_authenticated_url()])
+def run_query(query_terms):
+    if len(query_terms) == 0:
+        sys.stderr.write('No query provided\n')
+        sys.exit(1)
+
+    query_terms, fuzzy = correct_terms(query_terms)
+    es = client()
+    res = es.search(index=INDEX_NAME, size=30, query=text_query(query_terms, fuzzy))
+    print_hits(res)
+
+
+def parse_filter_args(action, args):
+    parser = argparse.ArgumentParser(prog='{} {}'.format(sys.argv[0], action))
+    parser.add_argument('--tag', action='append', default=[],
+                        help='Only items with this tag, can be repeated')
+    parser.add_argument('--source', choices=sorted(TAG_SOURCES),
+                        help='Only items with tags from this source, and only its tags')
+    parser.add_argument('--year', type=int, help='Only items from this year')
+    parser.add_argument('--top', type=int, default=20, help='How many tags to count')
+    if action == 'filter':
+        parser.add_argument('--facets', action='store_true',
+                            help='Count the tags, sources and years of the results too')
+    parser.add_argument('terms', nargs='*', help='Free text query terms')
+    return parser.parse_args(args)
+
+
+def canonical_tags(tags):
+    # The tags as they're indexed, see searchbox/tags.py
+    from searchbox import settings
+    from searchbox.store import TagVocabularyStore, store_path
+    from searchbox.tags import TagVocabulary, normalise
+
+    tags = [normalise(tag) or tag for tag in tags]
+    path = store_path(settings.SEARCHBOX_TAG_VOCABULARY_FILE)
+    store = TagVocabularyStore(path) if os.path.exists(path) else None
+    vocabulary = TagVocabulary(settings.SEARCHBOX_TAG_ALIASES,
+                               settings.SEARCHBOX_TAG_ALIAS_MIN_COOCCURRENCE, store)
+    try:
+        return vocabulary.canonical_tags(tags)
+    finally:
+        vocabulary.close()
+
+
+def term_dictionary():
+    from searchbox import settings
+    from searchbox.store import TermDictionaryStore, store_path
+    from searchbox.terms import TermDictionary
+
+    if not settings.SEARCHBOX_TERMS_FILE:
+        return None
+    path = store_path(settings.SEARCHBOX_TERMS_FILE)
+    if not os.path.exists(path):
+        return None
+    return TermDictionary(TermDictionaryStore(path), settings.SEARCHBOX_TERMS_MIN_COUNT)
+
+
+def correct_terms(terms):
+    # Exact queries for terms that are all known words once corrected, fuzzy
+    # ones otherwise, or without a term dictionary
+    dictionary = term_dictionary() if terms else None
+    if dictionary is None:
+        return terms, True
+    try:
+        corrected, all_known = dictionary.correct_query(terms)
+    finally:
+        dictionary.close()
+    if corrected != terms:
+        sys.stderr.write('Searching for {}\n'.format(' '.join(corrected)))
+    return corrected, not all_known
+
+
+def make_filters(args):
+    return Filters(tags=canonical_tags(args.tag), source=args.source, year=args.year)
+
+
+def run_filter(args):
+    filters = make_filters(args)
+    terms, fuzzy = correct_terms(args.terms)
+    searches = [results_search(terms, filters, 30, fuzzy)]
+    if args.facets:
+        searches.append(facets_search(terms, filters, args.top, fuzzy))
+    responses = msearch(client(), searches)
+
+    print_hits(responses[0])
+    if args.facets:
+        print()
+        print_facets(responses[1])
+
+
+def run_facets(args):
+    terms, fuzzy = correct_terms(args.terms)
+    res = client().search(index=INDEX_NAME, **facets_search(terms, make_filters(args), args.top, fuzzy))
+    print_facets(res)
+
+
+def print_facets(res):
+    print("%d items" % res['hits']['total']['value'])
+    for title, counts in facet_counts(res).items():
+        if counts:
+            print()
+            print('{}:'.format(title.capitalize()))
+            for key, count in counts:
+                print('  {:<40} {:>6}'.format(key, count))
+
+
+def vectors_path():
+    from searchbox import settings
+    from searchbox.store import store_path
+    return store_path(settings.SEARCHBOX_VECTORS_DIR)
+
+
+def run_build_vectors():
+    from elasticsearch.helpers import scan
+    from searchbox import settings
+    from searchbox.vectors import build_index, embed
+
+    es = client()
+    start = time.perf_counter()
+
+    def documents():
+        hits = scan(es, index=INDEX_NAME, size=settings.SEARCHBOX_VECTOR_BATCH_SIZE,
+                    _source=TEXT_SOURCE, query={'match_all': {}})
+        for hit in hits:
+            yield hit['_id'], embed(unrouted(hit['_source']))
+
+    count = build_index(vectors_path(), documents())
+    print('Indexed {} vectors in {:.1f}s'.format(count, time.perf_counter() - start))
+
+
+def run_complete(args):
+    if len(args) != 1:
+        sys.stderr.write('Usage: {} complete PREFIX\n'.format(sys.argv[0]))
+        sys.exit(1)
+
+    dictionary = term_dictionary()
+    if dictionary is None:
+        sys.stderr.write('No term dictionary, run {} build-terms first\n'.format(sys.argv[0]))
+        sys.exit(1)
+
+    start = time.perf_counter()
+    completions = dictionary.complete(args[0])
+    elapsed = time.perf_counter() - start
+    dictionary.close()
 
+    for word in completions:
+        print(word)
+    sys.stderr.write('Completed in {:.0f}µs\n'.format(elapsed * 1000000))
 
-def run_query(query_terms):
+
+def run_build_terms():
+    from elasticsearch.helpers import scan
+    from searchbox import settings
+    from searchbox.store import TermDictionaryStore, store_path
+    from searchbox.terms import build, words
+
+    es = client()
+    start = time.perf_counter()
+    counts = Counter()
+    for hit in scan(es, index=INDEX_NAME, size=SCAN_SIZE,
+                    _source=TEXT_SOURCE, query={'match_all': {}}):
+        for field, text in hit['_source'].items():
+            # Chinese and Japanese have no spaces between words
+            if text and not field.endswith('_' + CJK):
+                counts.update(words(text))
+
+    store = TermDictionaryStore(store_path(settings.SEARCHBOX_TERMS_FILE))
+    count = build(counts, settings.SEARCHBOX_TERMS_MIN_COUNT, store)
+    store.close()
+    print('Indexed {} terms in {:.1f}s'.format(count, time.perf_counter() - start))
+
+
+def run_similar(query_terms):
     if len(query_terms) == 0:
         sys.stderr.write('No query provided\n')
         sys.exit(1)
-    elif len(query_terms) == 1:
-        query_term = query_terms[0]
-    else:
-        query_term = ' AND '.join('({})'.format(term) for term in query_terms)
 
-    es = init_elastic()
+    from searchbox import settings
+    from searchbox.vectors import VectorIndex, embed
 
-    res = es.search(index=INDEX_NAME, size=30, query={
-        "query_string": {
-            "query": query_term,
-            "fuzziness": "AUTO:2,6",
-            "type": "best_fields"
-        }
-    })
+    path = vectors_path()
+    if not os.path.exists(os.path.join(path, 'index.json')):
+        sys.stderr.write('No vector index, run {} build-vectors first\n'.format(sys.argv[0]))
+        sys.exit(1)
 
+    es = client()
+    index = VectorIndex(path)
+    start = time.perf_counter()
+    neighbours = index.search(embed({'name': ' '.join(query_terms)}),
+                              settings.SEARCHBOX_VECTOR_CANDIDATES, settings.SEARCHBOX_VECTOR_NPROBE)
+    index.close()
+    searched = time.perf_counter()
+
+    similarities = {doc_id: similarity for similarity, doc_id in neighbours}
+    res = es.search(index=INDEX_NAME, size=len(similarities),
+                    query=rerank_query(query_terms, list(similarities)))
+    ranked = hybrid_ranking(similarities, res['hits']['hits'], settings.SEARCHBOX_VECTOR_WEIGHT)
+    done = time.perf_counter()
+
+    hits = []
+    for score, hit in ranked[:30]:
+        hits.append(dict(hit, _score=score))
+    print_hits({'hits': {'total': {'value': len(ranked)}, 'hits': hits}})
+    sys.stderr.write('Nearest neighbours {:.1f}ms, re-ranking {:.1f}ms\n'.format(
+        (searched - start) * 1000, (done - searched) * 1000))
+
+
+def print_hits(res):
     # TODO: There's probably some corpus-wide value we could get from ES instead of doing this
     # for just 30 results.
-    scores = [i['_score'] for i in res['hits']['hits']]
+    # No scores without query terms, the results are sorted by date
+    scores = [i['_score'] or 0.0 for i in res['hits']['hits']]
 
     if scores:
         mu = mean(scores)
@@ -69,8 +279,8 @@ def run_query(query_terms):
 
     print("Got %d Hits:" % res['hits']['total']['value'])
     for hit in reversed(res['hits']['hits']):
-        item = hit['_source']
-        score = hit['_score']
+        item = unrouted(hit['_source'])
+        score = hit['_score'] or 0.0
 
         def get_value(*keys):
             if len(keys) == 0: return ''
@@ -96,7 +306,7 @@ def run_query(query_terms):
 
         name = get_title_value('name', 'description', 'content')
 
-        if score >= good_score:
+        if score and score >= good_score:
             icon = '★'
         else:
             icon = ''
@@ -142,8 +352,30 @@ def year(dt) -> str:
     return str(dateutil.parser.isoparse(dt).year)
 
 
+def field_mappings():
+    # Every source's tags are also copied to a single keyword field, the
+    # canonical tags used for filters and aggregations (see searchbox/tags.py).
+    # Dates are mapped explicitly, the year filters and facets rely on them.
+    # Content and descriptions go to a field per language, with its analyzer
+    # (see searchbox/language.py). The whole text of pages, when it's kept
+    # besides their main content, isn't routed (see searchbox/content.py).
+    from searchbox.items import TAG_FIELDS
+    properties = {"tags": {"type": "keyword"}}
+    properties.update(language_mappings())
+    properties["full_content"] = {"type": "text", "analyzer": "my_analyzer"}
+    for name in DATE_FIELDS:
+        properties[name] = {"type": "date"}
+    for name in TAG_FIELDS:
+        properties[name] = {
+            "type": "text",
+            "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
+            "copy_to": "tags"
+        }
+    return properties
+
+
 def run_reset_index():
-    es: Elasticsearch = init_elastic()
+    es = client()
     es.indices.delete(index=INDEX_NAME, ignore=[404])
     index_settings = {
         "settings": {
@@ -161,10 +393,25 @@ def run_reset_index():
                     }
                 }
             }
+        },
+        "mappings": {
+            "properties": field_mappings()
         }
     }
     es.indices.create(index=INDEX_NAME, body=index_settings)
 
+    # Otherwise the crawler would skip every item it's seen before, and every
+    # page that isn't due
+    from searchbox import settings
+    from searchbox.store import IndexHashStore, PageHistoryStore, store_path
+    store = IndexHashStore(store_path(settings.SEARCHBOX_INDEX_HASHES_FILE))
+    store.clear()
+    store.close()
+    if settings.SEARCHBOX_REFRESH_FILE:
+        history = PageHistoryStore(store_path(settings.SEARCHBOX_REFRESH_FILE))
+        history.clear()
+        history.close()
+
 
 if __name__ == '__main__':
     main()
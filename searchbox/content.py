@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+# The main content of web pages, without the navigation, footers, cookie
+# banners and sidebars around it, which body_text indexes along with the rest
+# of the text under <body>. It's scored on the lxml tree the response has
+# already parsed, like readability does:
+#
+# - Scripts, styles, forms, <nav>, <aside>, <footer> and elements with class
+#   names and ids like cookie, sidebar or menu aren't content.
+# - Paragraphs, and any other element with enough text directly in it, give
+#   their parent a score by their length, and half of it to the grandparent.
+#   The highest scoring element, weighted by how little of its text is in
+#   links, holds the content.
+# - Siblings of that element with content of their own (the intro before an
+#   article, a second column) and headings are added, and lists of links
+#   inside it are left out.
+#
+# Pages where nothing looks like content, short ones mostly, keep the whole
+# text. With SEARCHBOX_KEEP_FULL_TEXT the whole text is also indexed as
+# `full_content`. READMEs from the API are content throughout and are left
+# alone, only HTML responses are processed.
+
+import re
+from typing import Any, Dict, List, Optional, Type
+
+from scrapy import Spider
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.http import HtmlResponse
+
+from .instrumentation import timed
+from .items import CrawlItem
+from .types import SpiderResults
+
+SKIPPED_TAGS = frozenset(['script', 'style', 'noscript', 'template', 'nav', 'aside', 'footer',
+                          'form', 'button', 'select', 'textarea', 'iframe', 'svg', 'head'])
+PARAGRAPH_TAGS = frozenset(['p', 'pre', 'td', 'blockquote', 'li', 'dd'])
+# The title of an article is often next to its body, not in it
+HEADING_TAGS = frozenset(['h1', 'h2', 'h3'])
+# Class names and ids of elements that aren't content, unless they also look
+# like content ("main-menu" isn't, "post-content-sidebar" is)
+_UNLIKELY = re.compile(r'cookie|consent|banner|sidebar|menu|navbar|breadcrumb|footer|social|share|'
+                       r'related|comment|advert|promo|popup|modal|newsletter|subscribe', re.I)
+_LIKELY = re.compile(r'article|content|main|body|post|entry|text|story', re.I)
+
+MIN_PARAGRAPH = 25
+# Links are most of the text of menus and lists of links
+MAX_LINK_DENSITY = 0.5
+MIN_SIBLING_SCORE = 10
+SIBLING_SCORE_SHARE = 0.2
+# Less than this isn't worth picking over the whole text
+MIN_CONTENT = 140
+
+
+class _Stats(object):
+    __slots__ = ('text', 'links', 'score')
+
+    def __init__(self) -> None:
+        # Characters of text outside and inside links
+        self.text = 0
+        self.links = 0
+        self.score = 0.0
+
+    @property
+    def total(self) -> int:
+        return self.text + self.links
+
+    @property
+    def link_density(self) -> float:
+        return self.links / self.total if self.total else 0.0
+
+
+def _skipped(element: Any) -> bool:
+    # Comments and processing instructions have a function as their tag
+    if not isinstance(element.tag, str):
+        return True
+    if element.tag in SKIPPED_TAGS:
+        return True
+    names = '{} {}'.format(element.get('class') or '', element.get('id') or '')
+    return names != ' ' and _UNLIKELY.search(names) is not None and _LIKELY.search(names) is None
+
+
+def _measure(element: Any, in_link: bool, stats: Dict[Any, _Stats], paragraphs: List[Any]) -> _Stats:
+    result = _Stats()
+    in_link = in_link or element.tag == 'a'
+    # The text right in the element, not in its children
+    own = len(element.text.strip()) if element.text else 0
+    for child in element:
+        if child.tail:
+            own += len(child.tail.strip())
+        if _skipped(child):
+            continue
+        child_stats = _measure(child, in_link, stats, paragraphs)
+        result.text += child_stats.text
+        result.links += child_stats.links
+    if in_link:
+        result.links += own
+    else:
+        result.text += own
+    stats[element] = result
+    if result.total >= MIN_PARAGRAPH and (element.tag in PARAGRAPH_TAGS or own >= MIN_PARAGRAPH):
+        paragraphs.append(element)
+    return result
+
+
+def _text(element: Any, stats: Dict[Any, _Stats], parts: List[str]) -> None:
+    if element.text and element.text.strip():
+        parts.append(element.text.strip())
+    for child in element:
+        child_stats = stats.get(child)
+        if child_stats is not None and not (child_stats.total >= MIN_PARAGRAPH and
+                                            child_stats.link_density > MAX_LINK_DENSITY):
+            _text(child, stats, parts)
+        if child.tail and child.tail.strip():
+            parts.append(child.tail.strip())
+
+
+def main_content(root: Any) -> Optional[str]:
+    # The text of the main content of an lxml HTML document, in the same
+    # format as body_text, None if it doesn't seem to have any
+    body = root.find('body') if root.tag == 'html' else None
+    if body is None:
+        return None
+
+    stats: Dict[Any, _Stats] = {}
+    paragraphs: List[Any] = []
+    _measure(body, False, stats, paragraphs)
+
+    candidates = []
+    for paragraph in paragraphs:
+        paragraph_stats = stats[paragraph]
+        if paragraph_stats.link_density > MAX_LINK_DENSITY:
+            continue
+        score = 1 + min(paragraph_stats.total // 100, 3)
+        parent = paragraph.getparent()
+        if parent is None:
+            continue
+        stats[parent].score += score
+        candidates.append(parent)
+        grandparent = parent.getparent()
+        if grandparent is not None and grandparent in stats:
+            stats[grandparent].score += score / 2
+            candidates.append(grandparent)
+    if not candidates:
+        return None
+
+    def weighted(element: Any) -> float:
+        element_stats = stats[element]
+        return element_stats.score * (1 - element_stats.link_density)
+
+    best = max(candidates, key=weighted)
+    if stats[best].text < MIN_CONTENT:
+        return None
+
+    threshold = max(MIN_SIBLING_SCORE, weighted(best) * SIBLING_SCORE_SHARE)
+    parent = best.getparent()
+    siblings = [best] if parent is None else parent
+    parts: List[str] = []
+    for element in siblings:
+        element_stats = stats.get(element)
+        if element_stats is None:
+            continue
+        if element is best or weighted(element) >= threshold or element.tag in HEADING_TAGS or \
+                (element.tag in PARAGRAPH_TAGS and element_stats.total > 80 and
+                 element_stats.link_density < MAX_LINK_DENSITY / 2):
+            _text(element, stats, parts)
+    return '\n'.join(parts)
+
+
+class MainContentSpiderMiddleware(object):
+    def __init__(self, keep_full_text: bool) -> None:
+        self.keep_full_text = keep_full_text
+
+    @classmethod
+    def from_crawler(cls: Type['MainContentSpiderMiddleware'], crawler: Crawler) -> 'MainContentSpiderMiddleware':
+        if not crawler.settings.getbool('SEARCHBOX_MAIN_CONTENT'):
+            raise NotConfigured
+        return cls(crawler.settings.getbool('SEARCHBOX_KEEP_FULL_TEXT'))
+
+    def process_spider_output(
+        self,
+        result: SpiderResults,
+        spider: Spider,
+        response: Any = None,
+    ) -> SpiderResults:
+        for i in result:
+            if isinstance(i, CrawlItem) and i.content and isinstance(response, HtmlResponse):
+                # On the tree body_text parsed
+                with timed('main_content'):
+                    content = main_content(response.selector.root)
+                if content is not None:
+                    if self.keep_full_text:
+                        i.full_content = i.content
+                    i.content = content
+            yield i
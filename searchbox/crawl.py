@@ -1,15 +1,61 @@
 #!/usr/bin/env python3
 
-from scrapy.crawler import CrawlerProcess
+import argparse
+import sys
+
+from scrapy.crawler import Crawler, CrawlerProcess
 from scrapy.utils.project import get_project_settings
 
-settings = get_project_settings()
+SPIDERS = ['github_stars', 'gitlab_stars', 'pocket', 'twitter_favs']
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Crawl all sources into the index')
+    parser.add_argument('--spider', action='append', choices=SPIDERS,
+                        help='Crawl only this spider, can be repeated')
+    parser.add_argument('--workers', action='store_true',
+                        help='Run every spider in its own process')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='With --workers, split every spider over this many processes')
+    parser.add_argument('--restart', action='store_true',
+                        help='Start over, instead of resuming interrupted crawls')
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    spiders = args.spider or SPIDERS
+
+    # Importable only once the project settings have set up the path
+    from searchbox.jobs import discard, job_name, job_path, job_settings
+
+    shards = args.shards if args.workers else 1
+    if args.restart:
+        for spider in spiders:
+            for shard in range(shards):
+                discard(job_path(settings, job_name(spider, shard, shards)))
+
+    if args.workers:
+        from searchbox.workers import WRITER_NAME, Job, run_parallel
+        jobs = [Job(spider, shard, shards) for spider in spiders for shard in range(shards)]
+        result = run_parallel(jobs, settings)
+
+        print('{:<28} {:>8} {:>10}'.format('worker', 'items', 'requests'))
+        for label, stats in sorted(result.workers.items()):
+            if label != WRITER_NAME:
+                print('{:<28} {:>8} {:>10}'.format(label, stats.get('item_scraped_count', 0),
+                                                   stats.get('downloader/request_count', 0)))
+        print('{:<28} {:>8} {:>10}'.format('total', result.total.get('item_scraped_count', 0),
+                                           result.total.get('downloader/request_count', 0)))
+        print('Indexed {} items'.format(result.total.get('item_written_count', 0)))
+        if result.total.get('item_write_errors'):
+            print('Failed to index {} items'.format(result.total['item_write_errors']))
+        sys.exit(result.exit_code)
 
-process = CrawlerProcess(settings)
+    process = CrawlerProcess(settings)
+    for spider in spiders:
+        spidercls = process.spider_loader.load(spider)
+        process.crawl(Crawler(spidercls, job_settings(settings, spider)))
+    process.start()
 
-process.crawl('github_stars')
-process.crawl('gitlab_stars')
-process.crawl('pocket')
-process.crawl('twitter_favs')
 
-process.start()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+
+# Text from the PDFs, Word (.docx) and OpenDocument (.odt) files bookmarks
+# and tweets link to. body_text only reads text responses, so these were
+# downloaded and then indexed with nothing but their URL.
+#
+# - DocumentSpiderMiddleware keeps the body of document responses on the
+#   item the callback yields for them, when it has no content and isn't
+#   larger than SEARCHBOX_DOCUMENT_MAX_SIZE.
+# - DocumentPipeline extracts the text in a pool of SEARCHBOX_DOCUMENT_WORKERS
+#   processes, started with the first document, one document per worker at a
+#   time, and the item waits for it in the pipeline while the reactor goes on
+#   with everything else. The format
+#   is told by the first bytes, not by the Content-Type.
+# - Only the first SEARCHBOX_DOCUMENT_MAX_PAGES pages of PDFs are read, and
+#   extraction gives up after SEARCHBOX_DOCUMENT_TIMEOUT seconds. Documents
+#   that fail, or take too long, are indexed without content like before. A
+#   worker that doesn't even report its timeout is stuck outside Python, the
+#   pool is terminated and the next document gets a new one.
+#
+# PDFs need pypdf, without it only the other formats are extracted.
+
+import io
+import logging
+import multiprocessing
+import signal
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from typing import Any, Dict, List, Optional, Type, Union
+from urllib.parse import urlsplit
+
+from lxml import etree
+from scrapy import Spider
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response, TextResponse
+from scrapy.statscollectors import StatsCollector
+from twisted.internet.defer import Deferred, DeferredSemaphore, succeed
+
+from .extractors import MAX_TEXT_LENGTH
+from .items import CrawlItem
+from .types import SpiderResults
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+PDF = 'pdf'
+DOCX = 'docx'
+ODT = 'odt'
+CONTENT_TYPES = {
+    'application/pdf': PDF,
+    'application/x-pdf': PDF,
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': DOCX,
+    'application/vnd.oasis.opendocument.text': ODT,
+}
+# Servers that don't know better send documents as binary data
+GENERIC_TYPES = frozenset(['', 'application/octet-stream', 'binary/octet-stream', 'application/download'])
+
+# The XML of a document, uncompressed, a bigger one is a zip bomb or not
+# worth the memory
+MAX_XML_SIZE = 64 * 1024 * 1024
+# On top of the timeout, for the worker to report it
+TIMEOUT_GRACE = 5
+
+_WORD = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_ODF_TEXT = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+
+
+class DocumentError(Exception):
+    pass
+
+
+class _Timeout(BaseException):
+    # Not an Exception, which pypdf and the page loop would catch
+    pass
+
+
+def document_format(response: Response) -> Optional[str]:
+    # The format of a downloaded document, None if it's not one
+    if isinstance(response, TextResponse):
+        return None
+    content_type = (response.headers.get('Content-Type') or b'').decode('latin-1')
+    content_type = content_type.split(';')[0].strip().lower()
+    if content_type in CONTENT_TYPES:
+        return CONTENT_TYPES[content_type]
+    if content_type in GENERIC_TYPES:
+        extension = urlsplit(response.url).path.rsplit('.', 1)[-1].lower()
+        if extension in (PDF, DOCX, ODT):
+            return extension
+    return None
+
+
+def _pdf_text(body: bytes, max_pages: int) -> List[str]:
+    if pypdf is None:
+        raise DocumentError('pypdf is not installed')
+    reader = pypdf.PdfReader(io.BytesIO(body))
+    if reader.is_encrypted and not reader.decrypt(''):
+        raise DocumentError('encrypted')
+    parts = []
+    for page in islice(reader.pages, max_pages):
+        try:
+            parts.append(page.extract_text())
+        except Exception:
+            # A broken page doesn't spoil the others
+            continue
+    return parts
+
+
+def _xml(archive: zipfile.ZipFile, name: str) -> Any:
+    if archive.getinfo(name).file_size > MAX_XML_SIZE:
+        raise DocumentError('{} is too large'.format(name))
+    parser = etree.XMLParser(resolve_entities=False, no_network=True)
+    return etree.fromstring(archive.read(name), parser)
+
+
+def _zip_text(body: bytes) -> List[str]:
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        names = set(archive.namelist())
+        if 'word/document.xml' in names:
+            root = _xml(archive, 'word/document.xml')
+            return [''.join(t.text or '' for t in p.iter(_WORD + 't'))
+                    for p in root.iter(_WORD + 'p')]
+        if 'content.xml' in names:
+            root = _xml(archive, 'content.xml')
+            return [''.join(p.itertext()) for p in root.iter(_ODF_TEXT + 'h', _ODF_TEXT + 'p')]
+    raise DocumentError('unknown document')
+
+
+def _alarm(signum: int, frame: Any) -> None:
+    raise _Timeout()
+
+
+def _init_worker() -> None:
+    # Interrupting the crawl is up to the crawl process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGALRM, _alarm)
+
+
+def extract_text(body: bytes, max_pages: int, timeout: float) -> Optional[str]:
+    # Runs in a worker process. Raises TimeoutError, or DocumentError with
+    # what went wrong, every exception can be sent back to the crawl.
+    if hasattr(signal, 'setitimer'):
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if b'%PDF-' in body[:1024]:
+            parts = _pdf_text(body, max_pages)
+        elif body.startswith(b'PK\x03\x04'):
+            parts = _zip_text(body)
+        else:
+            raise DocumentError('unknown document')
+    except _Timeout:
+        raise TimeoutError() from None
+    except DocumentError:
+        raise
+    except Exception as e:
+        raise DocumentError('{}: {}'.format(type(e).__name__, e)) from None
+    finally:
+        if hasattr(signal, 'setitimer'):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    text = '\n'.join(part.strip() for part in parts if part and part.strip())
+    return text[:MAX_TEXT_LENGTH] or None
+
+
+class DocumentSpiderMiddleware(object):
+    def __init__(self, max_size: int, stats: StatsCollector) -> None:
+        self.max_size = max_size
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls: Type['DocumentSpiderMiddleware'], crawler: Crawler) -> 'DocumentSpiderMiddleware':
+        if not crawler.settings.getbool('SEARCHBOX_EXTRACT_DOCUMENTS'):
+            raise NotConfigured
+        if pypdf is None:
+            logger.warning('pypdf is not installed, text won\'t be extracted from PDFs')
+        assert crawler.stats is not None
+        return cls(crawler.settings.getint('SEARCHBOX_DOCUMENT_MAX_SIZE'), crawler.stats)
+
+    def process_spider_output(
+        self,
+        result: SpiderResults,
+        spider: Spider,
+        response: Any = None,
+    ) -> SpiderResults:
+        document = document_format(response) if response is not None else None
+        if document == PDF and pypdf is None:
+            document = None
+        for i in result:
+            if document is not None and isinstance(i, CrawlItem) and not i.content:
+                if len(response.body) > self.max_size:
+                    self.stats.inc_value('documents/too_large', spider=spider)
+                else:
+                    i.document = response.body
+            yield i
+
+
+class DocumentPipeline(object):
+    def __init__(self, workers: int, max_pages: int, timeout: float, stats: StatsCollector,
+                 reactor: Any) -> None:
+        self.workers = workers
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.stats = stats
+        self.reactor = reactor
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.semaphore = DeferredSemaphore(workers)
+
+    @classmethod
+    def from_crawler(cls: Type['DocumentPipeline'], crawler: Crawler) -> 'DocumentPipeline':
+        settings = crawler.settings
+        if not settings.getbool('SEARCHBOX_EXTRACT_DOCUMENTS'):
+            raise NotConfigured
+        from twisted.internet import reactor
+        assert crawler.stats is not None
+        return cls(settings.getint('SEARCHBOX_DOCUMENT_WORKERS'), settings.getint('SEARCHBOX_DOCUMENT_MAX_PAGES'),
+                   settings.getfloat('SEARCHBOX_DOCUMENT_TIMEOUT'), crawler.stats, reactor)
+
+    def _submit(self, body: bytes) -> 'Future[Optional[str]]':
+        if self.executor is None:
+            # Spawned like the crawl workers, forking the reactor's process
+            # isn't safe
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_init_worker)
+        return self.executor.submit(extract_text, body, self.max_pages, self.timeout)
+
+    def process_item(self, item: CrawlItem, spider: Spider) -> Union[CrawlItem, 'Deferred[CrawlItem]']:
+        if item.document is None:
+            return item
+        body = item.document
+        item.document = None
+        # No more documents than workers in the pool, so the deadline starts
+        # when a worker has the document, not while it waits in the queue
+        return self.semaphore.run(self._extract, item, body, spider)
+
+    def _extract(self, item: CrawlItem, body: bytes, spider: Spider) -> 'Deferred[CrawlItem]':
+        try:
+            future = self._submit(body)
+        except BrokenProcessPool:
+            # A worker died, the next document gets a new pool
+            self.executor = None
+            self.stats.inc_value('documents/failed', spider=spider)
+            return succeed(item)
+
+        result: 'Deferred[CrawlItem]' = Deferred()
+        executor = self.executor
+        done = False
+
+        def finish(future: 'Optional[Future[Optional[str]]]') -> None:
+            nonlocal done
+            # Terminating the pool cancels this document's future too
+            if done:
+                return
+            done = True
+            if deadline.active():
+                deadline.cancel()
+            try:
+                if future is None:
+                    self._terminate(executor)
+                self._finish(item, future, spider)
+            finally:
+                result.callback(item)
+
+        # In case the worker can't report the timeout
+        deadline = self.reactor.callLater(self.timeout + TIMEOUT_GRACE, finish, None)
+        future.add_done_callback(lambda f: self.reactor.callFromThread(finish, f))
+        return result
+
+    def _terminate(self, executor: Optional[ProcessPoolExecutor]) -> None:
+        # The documents the pool had are counted as failed
+        if executor is None:
+            return
+        if self.executor is executor:
+            self.executor = None
+        # Not exposed by ProcessPoolExecutor, shutdown would wait for the
+        # stuck worker
+        processes: Dict[int, Any] = getattr(executor, '_processes', None) or {}
+        for process in list(processes.values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finish(self, item: CrawlItem, future: 'Optional[Future[Optional[str]]]', spider: Spider) -> None:
+        if future is None:
+            logger.warning('The worker extracting the text of %s stopped responding', item.url)
+            self.stats.inc_value('documents/deadline', spider=spider)
+            return
+        if future.cancelled():
+            # Its pool was terminated
+            logger.info('Could not extract the text of %s: cancelled', item.url)
+            self.stats.inc_value('documents/failed', spider=spider)
+            return
+        error = future.exception()
+        if error is None:
+            text = future.result()
+            if text:
+                item.content = text
+                self.stats.inc_value('documents/extracted', spider=spider)
+            else:
+                self.stats.inc_value('documents/empty', spider=spider)
+        elif isinstance(error, TimeoutError):
+            logger.info('Took too long to extract the text of %s', item.url)
+            self.stats.inc_value('documents/timeout', spider=spider)
+        else:
+            if isinstance(error, BrokenProcessPool):
+                self.executor = None
+            logger.info('Could not extract the text of %s: %s', item.url, error)
+            self.stats.inc_value('documents/failed', spider=spider)
+
+    def close_spider(self, spider: Spider) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, List
+
+from scrapy import Spider
+from scrapy.crawler import Crawler
+from scrapyelasticsearch.scrapyelasticsearch import ElasticSearchPipeline
+
+from .indexed import AFTER_INDEX, IndexRecorder, Record
+from .instrumentation import activate, timed
+
+
+class TimedElasticSearchPipeline(ElasticSearchPipeline):  # type: ignore
+    # Items are buffered and sent in bulk from send_items, either when the
+    # buffer is full or when the spider closes
+    records: List[Record]
+    recorder: IndexRecorder
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> 'TimedElasticSearchPipeline':
+        pipeline: TimedElasticSearchPipeline = super().from_crawler(crawler)
+        # Those of the buffered items, see searchbox/indexed.py
+        pipeline.records = []
+        pipeline.recorder = IndexRecorder(crawler.settings)
+        return pipeline
+
+    def process_item(self, item: Any, spider: Spider) -> Any:
+        with activate(spider):
+            records = item.pop(AFTER_INDEX, None)
+            if records:
+                self.records.extend(records)
+            return super().process_item(item, spider)
+
+    def close_spider(self, spider: Spider) -> None:
+        with activate(spider):
+            super().close_spider(spider)
+        self.recorder.close()
+
+    def send_items(self) -> None:
+        with timed('es_flush', 'bulk'):
+            super().send_items()
+        # Not reached when the bulk request fails, the records stay with the
+        # buffer, which is sent again with the next items
+        self.recorder.write(self.records)
+        self.records = []
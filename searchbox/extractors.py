@@ -1,9 +1,20 @@
+from collections import OrderedDict
 import datetime
-from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple, TypeVar, Union
+import hashlib
+import itertools
+import json
+import logging
+import re
+import threading
+from typing import (Any, Callable, Dict, FrozenSet, Generator, Iterable, List, NamedTuple,
+                    Optional, Tuple, TypeVar, Union)
 from urllib.parse import urljoin, urlsplit, urlunsplit
 
 import dateutil.parser
-import extruct
+from extruct.opengraph import OpenGraphExtractor
+from extruct.rdfa import RDFaExtractor
+from extruct.utils import parse_xmldom_html
+from extruct.w3cmicrodata import MicrodataExtractor
 import links_from_header
 import markdown
 import parsel
@@ -15,7 +26,21 @@ from mimeparse import parse_mime_type
 from scrapy.http import HtmlResponse, TextResponse
 from w3lib.html import get_base_url
 
+from .instrumentation import timed
+from .tags import normalise_tag
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
 TEXT_XPATH = "//body//text()"
+# 20MB assuming 2 bytes per character, not the worst possible case for
+# UTF-8 since some characters encode as 4 bytes, but pretty safe based
+# on normal text
+MAX_TEXT_LENGTH = 10485760
 
 
 def fix_url(url: Optional[str]) -> Optional[str]:
@@ -55,25 +80,22 @@ def body_text(response: Optional[Response]) -> Tuple[Optional[str], Optional[str
     title = None
     html = None
 
-    if isinstance(response, HtmlResponse) or is_github_html(response):
-        text_data = '\n'.join(
-            x.strip()
-            for x in response.xpath(TEXT_XPATH).extract()).strip()
-        title = ' '.join(
-            x.strip()
-            for x in response.xpath("//head/title//text()").extract()).strip()
-        html = response.text
-    elif isinstance(response, TextResponse):
-        text_data = response.text
-    else:
-        text_data = None
+    with timed('body_text'):
+        if isinstance(response, HtmlResponse) or is_github_html(response):
+            text_data = '\n'.join(
+                x.strip()
+                for x in response.xpath(TEXT_XPATH).extract()).strip()
+            title = ' '.join(
+                x.strip()
+                for x in response.xpath("//head/title//text()").extract()).strip()
+            html = response.text
+        elif isinstance(response, TextResponse):
+            text_data = response.text
+        else:
+            text_data = None
 
-    # 20MB assuming 2 bytes per character, not the worst possible case for
-    # UTF-8 since some characters encode as 4 bytes, but pretty safe based
-    # on normal text
-    max_length = 10485760
-    if text_data and len(text_data) > max_length:
-        text_data = text_data[:max_length]
+    if text_data and len(text_data) > MAX_TEXT_LENGTH:
+        text_data = text_data[:MAX_TEXT_LENGTH]
 
     return (title, text_data, html)
 
@@ -84,33 +106,108 @@ def is_processable(response: Response, process_cached: bool = False) -> bool:
     return status_ok and (process_cached or not is_cached)
 
 
-def normalise_tag(tag_source: str) -> Iterable[str]:
-    if tag_source is None:
-        return
+T = TypeVar('T')
 
-    base_tag = tag_source.strip().lower().replace(' ', '_').replace(
-        '-', '_').replace('[', '').replace(']', '')
-    parts = base_tag.split(':')
-    if parts[0] == 'tag' or parts[0] == 'section' \
-       or parts[0] == 'topic' or parts[0] == 'category' \
-       or parts[0] == 'プラットフォーム' or parts[0] == 'subject':
-        parts = parts[1:]
-
-    # Some sites use tags as general attributes, eg. lite:true, elevated:false,
-    # etc... we'll ignore those
-    if len(parts) > 1:
-        return
 
-    base_tag = parts[0].strip()
-    if base_tag:
-        yield base_tag
+def filter_none(elements: Iterable[T]) -> Generator[T, None, None]:
+    return (x for x in elements if x is not None)
 
 
-T = TypeVar('T')
+# JSON-LD, where most article pages keep their tags and publication date,
+# doesn't need a parsed document: the script blocks are found in the HTML
+# with a regular expression and decoded with orjson if it's installed. A
+# block that doesn't decode is skipped, the others on the page are kept.
+_JSON_LD_SCRIPT = re.compile(
+    r'<script\b[^>]*?\btype\s*=\s*["\']?application/ld\+json\b[^>]*>(.*?)</script\s*>',
+    re.I | re.S)
+_JSON_LD_COMMENT_LINE = re.compile(r'^\s*(?://.*|<!--.*?-->|<!--|-->)\s*$', re.M)
 
 
-def filter_none(elements: Iterable[T]) -> Generator[T, None, None]:
-    return (x for x in elements if x is not None)
+def _loads(text: str) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except ValueError:
+            pass
+    try:
+        # Control characters in strings are common enough
+        return json.loads(text, strict=False)
+    except ValueError:
+        # and so are HTML or JavaScript comments around the data
+        return json.loads(_JSON_LD_COMMENT_LINE.sub('', text), strict=False)
+
+
+def extract_json_ld(html: str) -> List[Any]:
+    items: List[Any] = []
+    for match in _JSON_LD_SCRIPT.finditer(html):
+        try:
+            data = _loads(match.group(1))
+        except ValueError as e:
+            logger.debug('Failed to decode JSON-LD block: %s', e)
+            continue
+        if isinstance(data, list):
+            items.extend(item for item in data if item)
+        elif isinstance(data, dict) and data:
+            items.append(data)
+    return items
+
+
+def _node_url(node: Dict[str, Any]) -> Optional[Any]:
+    # The url a node is about, its url or else its @id
+    if 'url' in node:
+        return node['url']
+    return node.get('@id')
+
+
+class JsonLdIndex(object):
+    # Every dated node of a page's JSON-LD, top level and @graph, indexed by
+    # the key of the URL it's about, so looking up the date of a page is a
+    # dict probe instead of comparing URLs node by node
+    def __init__(self, items: List[Any]) -> None:
+        self.items = [item for item in items if isinstance(item, dict)]
+        self.dated: Dict[Tuple[bool, str], List[Tuple[int, Any]]] = {}
+        # Top level nodes without a URL are about the page they're in
+        self.unaddressed: List[Tuple[int, Any]] = []
+
+        position = 0
+        for item in self.items:
+            nodes = [(item, True)]
+            graph = item.get('@graph')
+            if isinstance(graph, list):
+                nodes.extend((node, False) for node in graph if isinstance(node, dict))
+            for node, top_level in nodes:
+                if 'datePublished' not in node:
+                    continue
+                position += 1
+                url = _node_url(node)
+                if isinstance(url, str):
+                    self.dated.setdefault(url_key(url), []).append((position, node['datePublished']))
+                elif url is None and top_level:
+                    self.unaddressed.append((position, node['datePublished']))
+
+    def published_dates(self, url: str) -> Generator[Any, None, None]:
+        # In document order
+        for _, value in sorted(self.dated.get(url_key(url), []) + self.unaddressed,
+                               key=lambda candidate: candidate[0]):
+            yield from iterate_elements(value)
+
+
+# The other metadata syntaxes go through extruct, extracted one at a time and
+# only when a query reads them: every syntax is a full pass over the parsed
+# document, and RDFa is among the slowest. A syntax whose markup isn't
+# anywhere in the raw HTML isn't extracted at all.
+# Matched against the lowercased HTML, patterns that start with a literal
+# are much quicker to search for than alternatives or case insensitive ones
+SYNTAX_MARKERS = {
+    'rdfa': tuple(re.compile(p) for p in (r'property\s*=', r'typeof\s*=', r'vocab\s*=')),
+    'microdata': (re.compile(r'itemscope'),),
+    'opengraph': (re.compile(r'property\s*=\s*["\']?(?:og|article):'),),
+}
+SYNTAX_EXTRACTORS: Dict[str, Callable[[], Any]] = {
+    'rdfa': RDFaExtractor,
+    'microdata': MicrodataExtractor,
+    'opengraph': OpenGraphExtractor,
+}
 
 
 class MicroformatExtractor:
@@ -120,38 +217,68 @@ class MicroformatExtractor:
                  metadata: Optional[Dict[str, Any]] = None):
         self.url = url
 
-        if metadata is None:
-            if html is None:
-                raise Exception(
-                    "Either a html document or a metadata dictionary must " +
-                    "be provided"
-                )
-            base_url = get_base_url(html, self.url)
-            self.data = extruct.extract(html, base_url=base_url)
-        else:
-            self.data = metadata
+        if metadata is None and html is None:
+            raise Exception(
+                "Either a html document or a metadata dictionary must " +
+                "be provided"
+            )
+        self.html = html
+        # Syntaxes extracted so far, or all of them if given
+        self.data: Dict[str, List[Any]] = dict(metadata) if metadata is not None else {}
+        self._document: Any = None
+        self._base_url: Optional[str] = None
+        self._json_ld_index: Optional[JsonLdIndex] = None
+        self._markup: Optional[FrozenSet[str]] = None
+
+    def _has_markup(self, name: str) -> bool:
+        if self._markup is None:
+            # All at once, the lowercased copy isn't kept around
+            assert self.html is not None
+            lowered = self.html.lower()
+            self._markup = frozenset(syntax for syntax, markers in SYNTAX_MARKERS.items()
+                                     if any(marker.search(lowered) for marker in markers))
+        return name in self._markup
+
+    def json_ld_index(self) -> JsonLdIndex:
+        if self._json_ld_index is None:
+            self._json_ld_index = JsonLdIndex(self.syntax('json-ld'))
+        return self._json_ld_index
+
+    def _parse(self) -> Tuple[Any, str]:
+        if self._document is None:
+            assert self.html is not None
+            with timed('metadata', 'parse'):
+                self._document = parse_xmldom_html(self.html, encoding='UTF-8')
+                self._base_url = get_base_url(self.html, self.url)
+        assert self._base_url is not None
+        return self._document, self._base_url
+
+    def syntax(self, name: str) -> List[Any]:
+        if name in self.data:
+            return self.data[name]
+
+        items: List[Any] = []
+        if self.html is not None and name == 'json-ld':
+            with timed('metadata', name):
+                items = extract_json_ld(self.html)
+        elif self.html is not None and self._has_markup(name):
+            document, base_url = self._parse()
+            with timed('metadata', name):
+                try:
+                    items = list(SYNTAX_EXTRACTORS[name]().extract_items(document, base_url=base_url))
+                except Exception as e:
+                    # Broken markup in one syntax leaves the others usable
+                    logger.debug('Failed to extract %s from %s: %s', name, self.url, e)
+        self.data[name] = items
+        return items
 
     def get_published_date(self) -> Optional[datetime.datetime]:
         def get_attribute_list() -> Generator[str, None, None]:
-            if 'rdfa' in self.data:
-                for element in filter_none(self.data['rdfa']):
-                    yield from iterate_rdfa_tags(
-                        element, 'ogp.me/ns/article#published_time')
-
-            json_ld_elements = self.data.get('json-ld')
-            if json_ld_elements:
-                for element in filter_none(json_ld_elements):
-                    if 'datePublished' in element and json_ld_matches_url(
-                            element, self.url, match_by_default=True):
-                        yield from iterate_elements(element['datePublished'])
-
-                    graph_elements = element.get('@graph')
-                    if graph_elements:
-                        for graph_element in filter_none(graph_elements):
-                            if 'datePublished' in graph_element and \
-                               json_ld_matches_url(graph_element, self.url):
-                                yield from iterate_elements(
-                                    graph_element['datePublished'])
+            for element in filter_none(self.syntax('rdfa')):
+                yield from iterate_rdfa_tags(
+                    element, 'ogp.me/ns/article#published_time')
+
+            yield from self.json_ld_index().published_dates(self.url)
 
         for candidate in filter_none(get_attribute_list()):
             dt = try_parse_date(candidate)
@@ -161,51 +288,34 @@ class MicroformatExtractor:
         return None
 
     def get_tags(self) -> Iterable[str]:
-        if 'json-ld' in self.data:
-            yield from get_json_ld_tags(self.data['json-ld'])
-
-        if 'rdfa' in self.data:
-            yield from get_rdfa_tags(self.data['rdfa'])
-
-        if 'microdata' in self.data:
-            if 'keywords' in self.data['microdata']:
-                keywords = self.data['microdata']['keywords']
-                for tag in filter_none(parse_tag_list(keywords)):
-                    yield tag
-
-        if 'opengraph' in self.data:
-            if 'article:tag' in self.data['opengraph']:
-                for tag in filter_none(parse_tag_list(
-                        self.data['opengraph']['article:tag'])):
-                    yield tag
+        # OpenGraph article:tag is also RDFa, the same tags come from both
+        seen = set()
+        for tag in itertools.chain(get_json_ld_tags(self.syntax('json-ld')),
+                                   get_rdfa_tags(self.syntax('rdfa')),
+                                   get_microdata_tags(self.syntax('microdata')),
+                                   get_opengraph_tags(self.syntax('opengraph'))):
+            if tag not in seen:
+                seen.add(tag)
+                yield tag
+
+
+def url_key(url: str, ignore_protocol: bool = True) -> Tuple[bool, str]:
+    # The same for URLs that only differ in a trailing slash (and the
+    # protocol), strings that aren't URLs are kept as they are
+    fixed = fix_url(url)
+    if fixed is None:
+        return (False, url)
+
+    scheme, netloc, path, query, fragment = urlsplit(fixed)
+    if path.endswith('/'):
+        path = path[:-1]
+    if ignore_protocol:
+        scheme = ''
+    return (True, urlunsplit((scheme, netloc, path, query, fragment)))
 
 
 def compare_urls(a: str, b: str, ignore_protocol: bool = True) -> bool:
-    def fix_path(path: str) -> str:
-        if path.endswith('/'):
-            return path[:-1]
-        return path
-
-    def parse_url(url: str, ignore_protocol: bool) -> Optional[str]:
-        fixed = fix_url(url)
-        if fixed is None:
-            return None
-
-        result = (*urlsplit(fixed),)
-        if ignore_protocol:
-            result = ('', *result[1:])
-
-        result = (result[0], result[1], fix_path(result[2]), *result[3:])
-
-        return urlunsplit(result)
-
-    url_a = parse_url(a, ignore_protocol)
-    url_b = parse_url(b, ignore_protocol)
-
-    if url_a is None or url_b is None:
-        return a == b
-
-    return url_a == url_b
+    return url_key(a, ignore_protocol) == url_key(b, ignore_protocol)
 
 
 def get_json_ld_tags(data: List[Dict[str, Any]]) -> Iterable[str]:
@@ -235,6 +345,20 @@ def get_rdfa_tags(data: List[Dict[str, Any]]) -> Generator[str, None, None]:
                                      preprocess=normalise_tag)
     
 
+def get_microdata_tags(data: List[Dict[str, Any]]) -> Generator[str, None, None]:
+    for item in filter_none(data):
+        keywords = item.get('properties', {}).get('keywords')
+        if keywords:
+            yield from parse_tag_list(keywords)
+
+
+def get_opengraph_tags(data: List[Dict[str, Any]]) -> Generator[str, None, None]:
+    for item in filter_none(data):
+        for key, value in item.get('properties', ()):
+            if key == 'article:tag' and value:
+                yield from parse_tag_list(value)
+
+
 def iterate_rdfa_tags(
         rdfa_element: Dict[str, Any],
         attribute: str,
@@ -251,16 +375,6 @@ def iterate_rdfa_tags(
                         yield tag['@value']
 
 
-def json_ld_matches_url(element: Dict[str, Any], url: str, match_by_default: bool = False) -> bool:
-    if 'url' in element:
-        return compare_urls(element['url'], url, ignore_protocol=True)
-
-    if '@id' in element:
-        return compare_urls(element['@id'], url, ignore_protocol=True)
-
-    return match_by_default
-
-
 def iterate_elements(list_or_obj: Union[List[T], T]) -> Generator[T, None, None]:
     if isinstance(list_or_obj, list):
         for element in list_or_obj:
@@ -271,8 +385,9 @@ def iterate_elements(list_or_obj: Union[List[T], T]) -> Generator[T, None, None]
 
 def parse_tag_list(list_or_str: Union[List[Any], str]) -> Generator[str, None, None]:
     if isinstance(list_or_str, list):
-        for tag in filter_none(list_or_str):
-            yield from normalise_tag(tag)
+        for tag in list_or_str:
+            if isinstance(tag, str):
+                yield from normalise_tag(tag)
     else:
         for tag in filter_none(list_or_str.split(',')):
             yield from normalise_tag(tag)
@@ -297,10 +412,43 @@ def try_parse_date(dt_str: str) -> Optional[datetime.datetime]:
     return None
 
 
+class MarkdownContent(NamedTuple):
+    text: str
+    links: List[str]
+
+
+# Descriptions are usually plain prose, so anything that doesn't contain
+# characters markdown cares about is rendered by hand. The line patterns cover
+# headings, quotes, lists, setext underlines, indented code and hard breaks,
+# tabs and CRs are normalised by markdown, so we let it handle those too.
+_MARKDOWN_INLINE_SYNTAX = re.compile(r'[\\`*_\[\]<>&!\t\r]')
+_MARKDOWN_LINE_SYNTAX = re.compile(r'^( |[#>+\-=]|\d+[.)])|  $', re.MULTILINE)
+_MARKDOWN_PARAGRAPH_BREAK = re.compile(r'\n{2,}')
+
+_MARKDOWN_CACHE_SIZE = 1024
+_markdown_cache: 'OrderedDict[bytes, Tuple[str, Tuple[str, ...]]]' = OrderedDict()
+_markdown_converters = threading.local()
+
+
+def extract_markdown(response: TextResponse, content: Optional[str]) -> MarkdownContent:
+    if not content:
+        return MarkdownContent('', [])
+
+    text, hrefs = _render_markdown(content)
+
+    base_url = scrapy_response.get_base_url(response)
+    links = []
+    for href in hrefs:
+        full_url = urljoin(base_url, href)
+        if full_url.startswith('http:') or full_url.startswith('https:'):
+            links.append(full_url)
+
+    return MarkdownContent(text, links)
+
+
 def get_text_from_markdown(response: TextResponse,
                            content: str) -> str:
-    html = _md_to_html_doc(content)
-    return get_text_from_html(response, html)
+    return extract_markdown(response, content).text
 
 
 def get_text_from_html(response: TextResponse,
@@ -318,8 +466,7 @@ def get_links_from_markdown(response: TextResponse,
     # TODO: Why is this, or its body, null at times?
     if not content:
         return
-    html = _md_to_html_doc(content)
-    yield from get_links_from_html(response, html)
+    yield from extract_markdown(response, content).links
 
 
 def get_links_from_html(response: TextResponse, html: str) -> Iterable[str]:
@@ -332,8 +479,50 @@ def get_links_from_html(response: TextResponse, html: str) -> Iterable[str]:
             yield full_url
 
 
+def is_plain_text_markdown(content: str) -> bool:
+    return _MARKDOWN_INLINE_SYNTAX.search(content) is None and \
+        _MARKDOWN_LINE_SYNTAX.search(content) is None
+
+
+def _render_markdown(content: str) -> Tuple[str, Tuple[str, ...]]:
+    if is_plain_text_markdown(content):
+        # Same text markdown + the xpath extraction would produce: one <p> per
+        # paragraph, with the whitespace nodes between them joined in as ''
+        paragraphs = _MARKDOWN_PARAGRAPH_BREAK.split(content.strip('\n'))
+        return ('  '.join(p.strip() for p in paragraphs).strip(), ())
+
+    key = hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+    cached = _markdown_cache.get(key)
+    if cached is not None:
+        _markdown_cache.move_to_end(key)
+        return cached
+
+    # Links are kept relative, the base URL can differ between responses
+    selector = parsel.Selector(text=_md_to_html_doc(content))
+    text = ' '.join(x.strip() for x in
+                    selector.xpath(TEXT_XPATH).extract()).strip()
+    hrefs = tuple(selector.xpath('//a/@href').extract())
+
+    result = (text, hrefs)
+    _markdown_cache[key] = result
+    if len(_markdown_cache) > _MARKDOWN_CACHE_SIZE:
+        _markdown_cache.popitem(last=False)
+
+    return result
+
+
 def _md_to_html_doc(content: str) -> str:
-    doc_content = markdown.markdown(content, output_format='html')
+    # Building a Markdown instance loads all its extensions and patterns, so
+    # we keep one per thread and reset it between documents
+    converter: Optional[markdown.Markdown] = getattr(_markdown_converters, 'converter', None)
+    if converter is None:
+        converter = markdown.Markdown(output_format='html')
+        _markdown_converters.converter = converter
+
+    try:
+        doc_content = converter.convert(content)
+    finally:
+        converter.reset()
     return '<html>{}</html>'.format(doc_content)
 
 
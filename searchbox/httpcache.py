@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+# HTTP cache storage that keeps compressed responses for all spiders in a
+# single SQLite file, evicting the least recently used ones once the cache
+# grows past a size limit.
+#
+# HTTPCACHE_STORAGE = 'searchbox.httpcache.SqliteCacheStorage'
+#
+# Expiration can be set per spider with a `httpcache_expiration_rules`
+# attribute, a list of (URL regex, seconds) tuples, with the first match
+# winning. URLs that don't match any rule use HTTPCACHE_EXPIRATION_SECS.
+# The expiration of each response is stored with it, for `bin/httpcache
+# compact`, which doesn't know the spiders' rules.
+
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import time
+import zlib
+from typing import Callable, Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+from scrapy import Spider
+from scrapy.http import Headers, Request, Response
+from scrapy.responsetypes import responsetypes
+from scrapy.settings import BaseSettings
+from scrapy.utils.project import data_path
+
+from .store import connect
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILENAME = 'searchbox_cache.sqlite'
+
+# Eviction runs at most once every this many stored responses, plus when the
+# spider closes
+EVICTION_INTERVAL = 200
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=6).compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _identity(data: bytes) -> bytes:
+    return data
+
+
+CODECS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    'none': (_identity, _identity),
+    'gzip': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'zstd': (_zstd_compress, _zstd_decompress),
+}
+
+
+def open_cache(path: str) -> sqlite3.Connection:
+    connection = connect(path)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS responses ('
+        'spider TEXT NOT NULL, fingerprint TEXT NOT NULL, url TEXT NOT NULL, '
+        'status INTEGER NOT NULL, headers BLOB NOT NULL, body BLOB NOT NULL, '
+        'codec TEXT NOT NULL, raw_size INTEGER NOT NULL, size INTEGER NOT NULL, '
+        'stored_at REAL NOT NULL, accessed_at REAL NOT NULL, expiration INTEGER, '
+        'PRIMARY KEY (spider, fingerprint))'
+    )
+    # Caches from before expirations were stored, theirs are unknown
+    columns = {row[1] for row in connection.execute('PRAGMA table_info(responses)')}
+    if 'expiration' not in columns:
+        connection.execute('ALTER TABLE responses ADD COLUMN expiration INTEGER')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)'
+    )
+    connection.commit()
+    return connection
+
+
+def get_cache_path(settings: BaseSettings) -> str:
+    return os.path.join(data_path(settings['HTTPCACHE_DIR'], createdir=True), CACHE_FILENAME)
+
+
+def choose_codec(name: str) -> str:
+    if name == 'zstd' and zstandard is None:
+        logger.warning('zstandard is not installed, compressing the HTTP cache with gzip')
+        return 'gzip'
+    if name not in CODECS:
+        raise ValueError('Unknown HTTP cache compression: {}'.format(name))
+    return name
+
+
+def evict(connection: sqlite3.Connection, max_size: int) -> int:
+    if max_size <= 0:
+        return 0
+
+    total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+    excess = total - max_size
+    if excess <= 0:
+        return 0
+
+    # Walk from the least recently used entry until enough space is freed
+    to_delete: List[Tuple[str, str]] = []
+    for spider, fingerprint, size in connection.execute(
+            'SELECT spider, fingerprint, size FROM responses ORDER BY accessed_at'):
+        to_delete.append((spider, fingerprint))
+        excess -= size
+        if excess <= 0:
+            break
+
+    connection.executemany('DELETE FROM responses WHERE spider = ? AND fingerprint = ?', to_delete)
+    connection.commit()
+    return len(to_delete)
+
+
+class SpiderCacheReport(NamedTuple):
+    spider: str
+    entries: int
+    raw_size: int
+    size: int
+    oldest: Optional[float]
+    last_access: Optional[float]
+
+
+def cache_report(connection: sqlite3.Connection) -> List[SpiderCacheReport]:
+    rows = connection.execute(
+        'SELECT spider, COUNT(*), SUM(raw_size), SUM(size), MIN(stored_at), MAX(accessed_at) '
+        'FROM responses GROUP BY spider ORDER BY spider'
+    ).fetchall()
+    return [SpiderCacheReport(*row) for row in rows]
+
+
+def compact(connection: sqlite3.Connection, max_size: int, max_age: int) -> Tuple[int, int]:
+    # Responses expire after the expiration stored with them, 0 for never,
+    # or max_age when it's not known
+    now = time.time()
+    cursor = connection.execute(
+        'DELETE FROM responses WHERE (expiration > 0 AND stored_at + expiration < ?) '
+        'OR (expiration IS NULL AND ? > 0 AND stored_at < ?)',
+        (now, max_age, now - max_age)
+    )
+    expired = cursor.rowcount
+    connection.commit()
+
+    evicted = evict(connection, max_size)
+    connection.execute('VACUUM')
+    return (expired, evicted)
+
+
+class SqliteCacheStorage(object):
+    def __init__(self, settings: BaseSettings):
+        self.path = get_cache_path(settings)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.codec = choose_codec(settings.get('SEARCHBOX_HTTPCACHE_COMPRESSION', 'zstd'))
+        self.max_size = settings.getint('SEARCHBOX_HTTPCACHE_MAX_SIZE')
+        self.connection: Optional[sqlite3.Connection] = None
+        self.expiration_rules: List[Tuple[Pattern[str], int]] = []
+        self.stored_since_eviction = 0
+
+    def open_spider(self, spider: Spider) -> None:
+        self.connection = open_cache(self.path)
+        self.expiration_rules = [(re.compile(pattern), seconds) for pattern, seconds
+                                 in getattr(spider, 'httpcache_expiration_rules', [])]
+        self._fingerprinter = spider.crawler.request_fingerprinter
+
+        logger.debug('Using SQLite cache storage in %(cachepath)s',
+                     {'cachepath': self.path}, extra={'spider': spider})
+
+    def close_spider(self, spider: Spider) -> None:
+        assert self.connection is not None
+        evict(self.connection, self.max_size)
+        self.connection.close()
+        self.connection = None
+
+    def _get_expiration(self, url: str) -> int:
+        for pattern, seconds in self.expiration_rules:
+            if pattern.search(url):
+                return seconds
+        return self.expiration_secs
+
+    def retrieve_response(self, spider: Spider, request: Request) -> Optional[Response]:
+        assert self.connection is not None
+        fingerprint = self._fingerprinter.fingerprint(request).hex()
+        row = self.connection.execute(
+            'SELECT url, status, headers, body, codec, stored_at FROM responses '
+            'WHERE spider = ? AND fingerprint = ?', (spider.name, fingerprint)
+        ).fetchone()
+        if row is None:
+            return None  # not cached
+
+        url, status, raw_headers, compressed_body, codec, stored_at = row
+        now = time.time()
+        expiration = self._get_expiration(request.url)
+        if 0 < expiration < now - stored_at:
+            return None  # expired
+
+        # Committed straight away, all the crawlers in the process share the
+        # file and run on the same thread, so an open write transaction here
+        # would block the others
+        self.connection.execute(
+            'UPDATE responses SET accessed_at = ? WHERE spider = ? AND fingerprint = ?',
+            (now, spider.name, fingerprint)
+        )
+        self.connection.commit()
+
+        body = CODECS[codec][1](compressed_body)
+        headers = Headers(pickle.loads(raw_headers))
+        request.meta['cache_timestamp'] = stored_at
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        response: Response = respcls(url=url, headers=headers, status=status, body=body)
+        return response
+
+    def store_response(self, spider: Spider, request: Request, response: Response) -> None:
+        assert self.connection is not None
+        fingerprint = self._fingerprinter.fingerprint(request).hex()
+        raw_headers = pickle.dumps(dict(response.headers), protocol=4)
+        body = CODECS[self.codec][0](response.body)
+        now = time.time()
+        self.connection.execute(
+            'INSERT OR REPLACE INTO responses (spider, fingerprint, url, status, headers, body, '
+            'codec, raw_size, size, stored_at, accessed_at, expiration) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (spider.name, fingerprint, response.url, response.status, raw_headers, body,
+             self.codec, len(response.body), len(body) + len(raw_headers), now, now,
+             self._get_expiration(request.url))
+        )
+        self.connection.commit()
+
+        self.stored_since_eviction += 1
+        if self.stored_since_eviction >= EVICTION_INTERVAL:
+            self.stored_since_eviction = 0
+            evict(self.connection, self.max_size)
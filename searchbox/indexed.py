@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# What the crawl records about an item once it's in the index: the hash
+# SkipUnchangedPipeline compares items with, and the page history of the
+# adaptive refresh (see searchbox/refresh.py). Recorded any earlier, an item
+# lost on the way (dropped by a pipeline, in a bulk request that failed, still
+# buffered when the crawl was killed) would count as indexed, and wouldn't be
+# sent or fetched again for weeks.
+#
+# The records travel with the item, in CrawlItem.after_index and then under
+# AFTER_INDEX in the fields sent to elasticsearch (across the writer queue of
+# a parallel crawl too), and TimedElasticSearchPipeline writes them once the
+# bulk request with the item has succeeded. Items skipped as unchanged are in
+# the index already, theirs are written right away.
+
+from typing import Any, Iterable, Optional, Tuple
+
+from scrapy.settings import BaseSettings
+
+from .store import IndexHashStore, PageHistory, PageHistoryStore, store_path
+
+AFTER_INDEX = '_after_index'
+
+INDEX_HASH = 'index_hash'
+PAGE_HISTORY = 'page_history'
+
+# Kind, key and value
+Record = Tuple[str, str, Any]
+
+
+def index_hash_record(key: str, content_hash: str, indexed_at: float) -> Record:
+    return (INDEX_HASH, key, (content_hash, indexed_at))
+
+
+def page_history_record(url: str, history: PageHistory) -> Record:
+    return (PAGE_HISTORY, url, tuple(history))
+
+
+class IndexRecorder(object):
+    # Writes records to the stores in the settings, opened when first needed
+    def __init__(self, settings: BaseSettings) -> None:
+        self.settings = settings
+        self.hashes: Optional[IndexHashStore] = None
+        self.history: Optional[PageHistoryStore] = None
+
+    def write(self, records: Iterable[Record]) -> None:
+        for kind, key, value in records:
+            if kind == INDEX_HASH:
+                if self.hashes is None:
+                    self.hashes = IndexHashStore(store_path(self.settings.get('SEARCHBOX_INDEX_HASHES_FILE')))
+                self.hashes.put(key, *value)
+            elif kind == PAGE_HISTORY:
+                if self.history is None:
+                    self.history = PageHistoryStore(store_path(self.settings.get('SEARCHBOX_REFRESH_FILE')))
+                self.history.put(key, PageHistory(*value))
+
+    def close(self) -> None:
+        if self.hashes is not None:
+            self.hashes.close()
+            self.hashes = None
+        if self.history is not None:
+            self.history.close()
+            self.history = None
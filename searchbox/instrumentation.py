@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+# Per-stage timing histograms for a crawl: download latency per host, spider
+# callback CPU time per method, and the time spent in the extractors, pipelines
+# and the elasticsearch sink. At spider close they're added to the crawl stats
+# and written as JSON and Prometheus text files.
+#
+# Code that wants to be measured uses `timed(stage, key)`, which records into
+# the spider currently active (see `activate`) and does nothing when timings
+# are disabled. Everything runs on the reactor thread, so a plain global is
+# enough to track the active spider.
+
+import bisect
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Type
+from urllib.parse import urlsplit
+
+from scrapy import Request, Spider, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response
+from scrapy.utils.project import data_path
+
+from .types import SpiderResults
+
+# Upper bounds in seconds, the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram(object):
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket the quantile falls in, which is as precise
+        # as we can get without keeping every value
+        target = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target and bucket_count:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': self.counts,
+        }
+
+
+class Timings(object):
+    def __init__(self) -> None:
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+
+    def observe(self, stage: str, key: str, value: float) -> None:
+        histogram = self.histograms.get((stage, key))
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[(stage, key)] = histogram
+        histogram.observe(value)
+
+    def to_dict(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (stage, key), histogram in sorted(self.histograms.items()):
+            result.setdefault(stage, {})[key] = histogram.to_dict()
+        return result
+
+    def to_prometheus(self, spider_name: str) -> str:
+        lines = [
+            '# HELP searchbox_stage_seconds Time spent in each crawl stage',
+            '# TYPE searchbox_stage_seconds histogram',
+        ]
+        for (stage, key), histogram in sorted(self.histograms.items()):
+            labels = 'spider="{}",stage="{}",key="{}"'.format(
+                _escape_label(spider_name), _escape_label(stage), _escape_label(key))
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('searchbox_stage_seconds_bucket{{{},le="{}"}} {}'.format(
+                    labels, le, cumulative))
+            lines.append('searchbox_stage_seconds_sum{{{}}} {}'.format(labels, histogram.total))
+            lines.append('searchbox_stage_seconds_count{{{}}} {}'.format(labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Spider name -> timings, only for spiders with timings enabled
+_TIMINGS: Dict[str, Timings] = {}
+_active: Optional[Timings] = None
+
+
+@contextmanager
+def activate(spider: Spider) -> Iterator[None]:
+    global _active
+    previous = _active
+    _active = _TIMINGS.get(spider.name)
+    try:
+        yield
+    finally:
+        _active = previous
+
+
+@contextmanager
+def timed(stage: str, key: str = '',
+          clock: Callable[[], float] = time.perf_counter) -> Iterator[None]:
+    timings = _active
+    if timings is None:
+        yield
+        return
+
+    start = clock()
+    try:
+        yield
+    finally:
+        timings.observe(stage, key, clock() - start)
+
+
+class StageTimingExtension(object):
+    def __init__(self, crawler: Crawler) -> None:
+        self.crawler = crawler
+        self.timings = Timings()
+        self.output_dir = crawler.settings.get('SEARCHBOX_TIMINGS_DIR')
+
+    @classmethod
+    def from_crawler(cls: Type['StageTimingExtension'], crawler: Crawler) -> 'StageTimingExtension':
+        if not crawler.settings.getbool('SEARCHBOX_TIMINGS_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_downloaded, signal=signals.response_downloaded)
+        return ext
+
+    def spider_opened(self, spider: Spider) -> None:
+        _TIMINGS[spider.name] = self.timings
+
+    def response_downloaded(self, response: Response, request: Request, spider: Spider) -> None:
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.timings.observe('download_latency', urlsplit(request.url).hostname or '', latency)
+
+    def spider_closed(self, spider: Spider) -> None:
+        _TIMINGS.pop(spider.name, None)
+
+        stats = self.crawler.stats
+        assert stats is not None
+        summary = self.timings.to_dict()
+        for stage, keys in summary.items():
+            for key, values in keys.items():
+                prefix = 'timings/{}/{}'.format(stage, key) if key else 'timings/{}'.format(stage)
+                for name in ['count', 'total', 'p50', 'p95', 'max']:
+                    stats.set_value('{}/{}'.format(prefix, name), values[name])
+
+        if self.output_dir:
+            output_dir = data_path(self.output_dir, createdir=True)
+            with open(os.path.join(output_dir, '{}.json'.format(spider.name)), 'w') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+            with open(os.path.join(output_dir, '{}.prom'.format(spider.name)), 'w') as f:
+                f.write(self.timings.to_prometheus(spider.name))
+
+
+class CallbackTimingSpiderMiddleware(object):
+    @classmethod
+    def from_crawler(
+        cls: Type['CallbackTimingSpiderMiddleware'], crawler: Crawler
+    ) -> 'CallbackTimingSpiderMiddleware':
+        if not crawler.settings.getbool('SEARCHBOX_TIMINGS_ENABLED'):
+            raise NotConfigured
+        return cls()
+
+    def process_spider_output(
+        self,
+        result: SpiderResults,
+        spider: Spider,
+        response: Any = None,
+    ) -> SpiderResults:
+        # Callbacks are generators, so their work happens while we iterate
+        # over them. Only the time inside next() counts, the rest is spent
+        # by whatever consumes the results.
+        callback = response.request.callback if response is not None and response.request else None
+        name = getattr(callback, '__name__', None) or 'parse'
+
+        timings = _TIMINGS.get(spider.name)
+        total = 0.0
+        iterator = iter(result)
+        while True:
+            with activate(spider):
+                start = time.process_time()
+                try:
+                    i = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    total += time.process_time() - start
+            yield i
+
+        if timings is not None:
+            timings.observe('callback_cpu', name, total)
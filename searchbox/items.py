@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
 
-from typing import List, Optional, Set
-from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field, fields
 
 
-@dataclass
+# Slotted, since there can be thousands of these in flight between the
+# scheduler and the pipelines
+@dataclass(slots=True)
 class CrawlItem:
     name: Optional[str] = field(default=None)
     description: Optional[str] = field(default=None)
     url: Optional[str] = field(default=None)
     last_update: Optional[str] = field(default=None)
     content: Optional[str] = field(default=None)
+    # The whole text of pages when content is only their main content, with
+    # SEARCHBOX_KEEP_FULL_TEXT
+    full_content: Optional[str] = field(default=None)
     repository_backlink: Optional[str] = field(default=None)
     twitter_backlink: Optional[str] = field(default=None)
     alt_url: Optional[str] = field(default=None)
@@ -20,10 +25,34 @@ class CrawlItem:
     article_tags: List[str] = field(default_factory=list)
     article_published_date: Optional[str] = field(default=None)
     html: Optional[str] = field(default=None)
+    # The body of a PDF or other document, until DocumentPipeline extracts
+    # its text
+    document: Optional[bytes] = field(default=None)
+    # Records to write once the item is in the index, not indexed (see
+    # searchbox/indexed.py)
+    after_index: List[Tuple[str, str, Any]] = field(default_factory=list)
 
     def get_all_tags(self) -> List[str]:
+        # Canonical once the item has been through TagPipeline
         all_tags: Set[str] = set()
+        all_tags.update(self.repository_tags)
         all_tags.update(self.twitter_tags)
         all_tags.update(self.article_tags)
         all_tags.update(self.pocket_tags)
         return sorted(all_tags)
+
+    def to_index_dict(self) -> Dict[str, Any]:
+        # Unset (empty) fields are skipped, otherwise the elasticsearch sink
+        # would overwrite fields populated by other items for the same URL
+        # with nulls. Values are not copied, unlike dataclasses.asdict.
+        result = {}
+        for name in _INDEX_FIELDS:
+            value = getattr(self, name)
+            if value:
+                result[name] = value
+        return result
+
+
+_FIELD_NAMES: Tuple[str, ...] = tuple(f.name for f in fields(CrawlItem))
+_INDEX_FIELDS: Tuple[str, ...] = tuple(name for name in _FIELD_NAMES if name != 'after_index')
+TAG_FIELDS: Tuple[str, ...] = tuple(name for name in _FIELD_NAMES if name.endswith('_tags'))
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# Resumable crawls. Every spider (every shard, with crawl.py --workers) gets
+# its own Scrapy JOBDIR under SEARCHBOX_JOBS_DIR, where the scheduler keeps
+# its queue on disk and the dupefilter the fingerprints of the requests made
+# so far. A crawl that's stopped (Ctrl-C, a kill, a CloseSpider when an API
+# runs out of quota) continues from there the next time it runs.
+#
+# The API listings (the pages of stars, bookmarks and likes) are not kept in
+# the queue, their requests carry credentials and signatures that expire (the
+# twitter OAuth ones). They're made again by the spider's start requests, and
+# moved forward to where they got to:
+#
+# - Spiders name each listing in meta['listing'], and give every page after
+#   the first its position in meta['cursor']: the URL of the page, an offset,
+#   a tweet id.
+# - The cursor is saved as each page's request is made, and the listing
+#   marked as done once its last page has been processed.
+# - On a restart, the first page of a listing is replaced with the page it
+#   got to, made by the spider's resume_listing(request, cursor), or by taking
+#   the cursor as the URL. Finished listings are not fetched again.
+#
+# A crawl that finishes drops its state, so the next one starts over.
+
+import os
+import shutil
+from typing import Any, Iterable, Optional, Type
+
+from scrapy import Request, Spider, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.settings import BaseSettings, Settings
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.job import job_dir
+
+from .scheduling import LISTING, request_kind
+from .store import CursorStore, store_path
+from .types import SpiderRequests, SpiderResults
+
+# Written by Scrapy's RFPDupeFilter in the JOBDIR
+REQUESTS_SEEN = 'requests.seen'
+CURSORS = 'cursors.sqlite'
+
+
+def job_name(spider: str, shard: int = 0, shards: int = 1) -> str:
+    if shards == 1:
+        return spider
+    return '{}-{}-of-{}'.format(spider, shard, shards)
+
+
+def job_path(settings: BaseSettings, name: str) -> Optional[str]:
+    jobs_dir = settings.get('SEARCHBOX_JOBS_DIR')
+    if not jobs_dir:
+        return None
+    return store_path(os.path.join(jobs_dir, name))
+
+
+def job_settings(settings: Settings, name: str) -> Settings:
+    # The settings for one spider, each needs a JOBDIR of its own
+    settings = settings.copy()
+    path = job_path(settings, name)
+    if path is not None and not settings.get('JOBDIR'):
+        settings.set('JOBDIR', path, priority='cmdline')
+    return settings
+
+
+def is_pending(path: Optional[str]) -> bool:
+    # Whether the last crawl of this job was interrupted
+    if path is None:
+        return False
+    seen = os.path.join(path, REQUESTS_SEEN)
+    return os.path.exists(seen) and os.path.getsize(seen) > 0
+
+
+def discard(path: Optional[str]) -> None:
+    if path is not None:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class ResumeSpiderMiddleware(object):
+    def __init__(self, path: str, cursors: CursorStore, stats: StatsCollector) -> None:
+        self.path = path
+        self.cursors = cursors
+        self.stats = stats
+        self.resuming = is_pending(path) or not cursors.is_empty()
+
+    @classmethod
+    def from_crawler(cls: Type['ResumeSpiderMiddleware'], crawler: Crawler) -> 'ResumeSpiderMiddleware':
+        path = job_dir(crawler.settings)
+        if not path:
+            raise NotConfigured
+        assert crawler.stats is not None
+        middleware = cls(path, CursorStore(os.path.join(path, CURSORS)), crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def _resume(self, request: Request, spider: Spider) -> Optional[Request]:
+        # Only first pages, None for listings that are done
+        if 'cursor' in request.meta:
+            return request
+        listing = request.meta.get('listing')
+        state = self.cursors.get(listing) if listing is not None else None
+        if state is None:
+            # The interrupted crawl made this request too, and its
+            # dupefilter would drop it
+            return request.replace(dont_filter=True) if self.resuming else request
+
+        cursor, done = state
+        if done:
+            self.stats.inc_value('resume/listings_done', spider=spider)
+            return None
+
+        resume_listing = getattr(spider, 'resume_listing', None)
+        if resume_listing is not None:
+            resumed: Request = resume_listing(request, cursor)
+        else:
+            resumed = request.replace(url=cursor)
+        resumed.meta['listing'] = listing
+        resumed.meta['cursor'] = cursor
+        self.stats.inc_value('resume/listings_resumed', spider=spider)
+        return resumed.replace(dont_filter=True)
+
+    def process_spider_output(
+        self,
+        result: SpiderResults,
+        spider: Spider,
+        response: Any = None,
+    ) -> SpiderResults:
+        listing = response.meta.get('listing') if response is not None else None
+        continued = False
+        for i in result:
+            if isinstance(i, Request) and request_kind(i) == LISTING:
+                if listing is not None and i.meta.get('listing') == listing and 'cursor' in i.meta:
+                    self.cursors.put(listing, i.meta['cursor'])
+                    continued = True
+                else:
+                    resumed = self._resume(i, spider)
+                    if resumed is None:
+                        continue
+                    i = resumed
+            yield i
+
+        # Errors (eg. rate limits) leave the listing where it was, to be
+        # tried again
+        if listing is not None and not continued and response.status == 200:
+            self.cursors.finish(listing)
+
+    def process_start_requests(
+        self, start_requests: Iterable[Request], spider: Spider
+    ) -> SpiderRequests:
+        for r in start_requests:
+            resumed = self._resume(r, spider) if request_kind(r) == LISTING else r
+            if resumed is not None:
+                yield resumed
+
+    def spider_closed(self, spider: Spider, reason: str) -> None:
+        if reason == 'finished':
+            self.cursors.clear()
+            # The dupefilter has closed the file by now
+            open(os.path.join(self.path, REQUESTS_SEEN), 'w').close()
+        self.cursors.close()
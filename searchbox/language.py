@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+# The language of the text fields, so each is indexed with the right
+# analysis. English, and text too short to tell, stays in `content` and
+# `description`, analyzed with the English stemmer. Text in the other
+# languages we recognise goes to a field of its own, `content_fr`,
+# `description_cjk`, with elasticsearch's analyzer for the language: Chinese,
+# Japanese and Korean, which aren't written with spaces, are indexed as
+# character bigrams (the `cjk` analyzer). The detected language is kept in
+# `language`, from the content when the item has any.
+#
+# Detection is offline and takes microseconds: the script of the letters
+# tells CJK and Cyrillic text apart, and the most frequent short words
+# (articles, prepositions) the languages written in latin letters. Only the
+# beginning of long texts is looked at, and text without letters from other
+# scripts isn't scanned for them.
+#
+# With ELASTICSEARCH_MERGE the update is merged into the document already in
+# the index, so the other language fields of the text an item has are sent
+# as null, or the text it had before in another language would stay.
+#
+# Queries need no changes, the query_string searches every field, each with
+# its own analyzer. The mappings are created by `bin/query reset-index`.
+
+import re
+from typing import Any, Dict, Optional
+
+# Fields detected and routed
+TEXT_FIELDS = ('content', 'description')
+
+CJK = 'cjk'
+# Where each language goes, and the analyzer of that field
+LANGUAGE_FIELDS = {
+    'de': 'de', 'es': 'es', 'fr': 'fr', 'it': 'it', 'nl': 'nl', 'pt': 'pt', 'ru': 'ru',
+    'zh': CJK, 'ja': CJK, 'ko': CJK,
+}
+ANALYZERS = {
+    'de': 'german', 'es': 'spanish', 'fr': 'french', 'it': 'italian', 'nl': 'dutch',
+    'pt': 'portuguese', 'ru': 'russian', CJK: 'cjk',
+}
+# The text of a document, in whichever fields it is, to read from _source
+TEXT_SOURCE = ['name'] + ['{}*'.format(name) for name in TEXT_FIELDS]
+DEFAULT_LANGUAGE = 'en'
+
+SAMPLE_CHARS = 2000
+MIN_CHARS = 20
+# Each CJK character is a word, or most of one
+MIN_CJK = 4
+MIN_CJK_SHARE = 0.2
+MIN_STOPWORDS = 3
+
+# Frequent in one language and rare in the others, words shared by several
+# (de, la, que, en...) are left out
+STOPWORDS = {
+    'en': 'the and of to is that for with this are you it on be was not have by from',
+    'de': 'der die das und ist nicht ein eine mit auf den dem sich auch wird für von zu werden',
+    'fr': 'le les des est et une du pour dans qui pas sur avec ce sont au aux cette mais ou',
+    'es': 'el los las y del por para con una su al como más pero está son lo también esta hay',
+    'it': 'il di che è sono della gli nel alla questo anche più come ma perché delle dei degli essere hanno',
+    'pt': 'não uma os ao da das dos em é são mais mas também isso você pelo pela nos foi',
+    'nl': 'het een van en niet dat zijn voor met op te ook wordt naar bij deze maar heeft kan',
+}
+_STOPWORD_LANGUAGES = {word: language for language, words in STOPWORDS.items() for word in words.split()}
+
+_KANA = re.compile('[\u3040-\u30ff\u31f0-\u31ff\uff66-\uff9f]+')
+_HANGUL = re.compile('[\u1100-\u11ff\u3130-\u318f\uac00-\ud7af]+')
+_CJK = re.compile('[\u1100-\u11ff\u3040-\u30ff\u3130-\u318f\u31f0-\u31ff\u3400-\u4dbf\u4e00-\u9fff'
+                  '\uac00-\ud7af\uf900-\ufaff\uff66-\uff9f]+')
+_CYRILLIC = re.compile('[\u0400-\u04ff]+')
+
+
+def _count(script: 're.Pattern[str]', text: str) -> int:
+    # Matched in runs, a match per character is a lot slower
+    return sum(map(len, script.findall(text)))
+
+
+def detect(text: str) -> Optional[str]:
+    # A language code, None when there's not enough text to tell
+    sample = text[:SAMPLE_CHARS]
+    # Close enough to the number of letters, and a lot cheaper
+    chars = len(sample) - sample.count(' ')
+    if chars == 0:
+        return None
+
+    # Most text has no letters beyond the latin ones
+    top = max(sample)
+    if top >= '\u1100':
+        cjk = _count(_CJK, sample)
+        if cjk >= MIN_CJK and cjk >= MIN_CJK_SHARE * chars:
+            kana = _count(_KANA, sample)
+            if _count(_HANGUL, sample) * 2 >= cjk:
+                return 'ko'
+            # Japanese mixes kana with its kanji, Chinese has none
+            return 'ja' if kana * 10 >= cjk else 'zh'
+    if top >= '\u0400' and chars >= MIN_CHARS and _count(_CYRILLIC, sample) * 2 >= chars:
+        return 'ru'
+
+    if chars < MIN_CHARS:
+        return None
+    counts: Dict[str, int] = {}
+    for word in sample.lower().split():
+        language = _STOPWORD_LANGUAGES.get(word)
+        if language is not None:
+            counts[language] = counts.get(language, 0) + 1
+    if not counts:
+        return None
+    count, language = max((count, language) for language, count in counts.items())
+    return language if count >= MIN_STOPWORDS else None
+
+
+def language_field(name: str, language: Optional[str]) -> str:
+    suffix = LANGUAGE_FIELDS.get(language) if language is not None else None
+    return name if suffix is None else '{}_{}'.format(name, suffix)
+
+
+def route(fields: Dict[str, Any], merge: bool = False) -> Dict[str, Any]:
+    # The fields of an item to index, with the text moved to the field of
+    # its language
+    routed = dict(fields)
+    content_language = None
+    languages = []
+    for name in TEXT_FIELDS:
+        text = routed.get(name)
+        if not text:
+            continue
+        language = detect(text)
+        target = name if language is None else language_field(name, language)
+        if merge:
+            for suffix in ANALYZERS:
+                routed['{}_{}'.format(name, suffix)] = None
+            routed[name] = None
+        elif target != name:
+            del routed[name]
+        routed[target] = text
+        if language is None:
+            continue
+        languages.append(language)
+        if name == 'content':
+            content_language = language
+    if languages:
+        routed['language'] = content_language or languages[0]
+    elif merge and any(fields.get(name) for name in TEXT_FIELDS):
+        routed['language'] = None
+    return routed
+
+
+def unrouted(source: Dict[str, Any]) -> Dict[str, Any]:
+    # A document's text back under the usual field names, for reading
+    result = dict(source)
+    for name in TEXT_FIELDS:
+        for suffix in ANALYZERS:
+            routed = '{}_{}'.format(name, suffix)
+            if routed in result:
+                value = result.pop(routed)
+                if value and not result.get(name):
+                    result[name] = value
+    return result
+
+
+def language_mappings() -> Dict[str, Any]:
+    mappings: Dict[str, Any] = {'language': {'type': 'keyword'}}
+    for name in TEXT_FIELDS:
+        mappings[name] = {'type': 'text', 'analyzer': 'my_analyzer'}
+        for suffix, analyzer in ANALYZERS.items():
+            mappings['{}_{}'.format(name, suffix)] = {'type': 'text', 'analyzer': analyzer}
+    return mappings
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from typing import Any, Dict, Union
+
+from scrapy import Spider
+from scrapy.http import Response
+from scrapy.logformatter import LogFormatter
+from twisted.python.failure import Failure
+
+from .pipelines import UnchangedItem
+
+
+class SearchboxLogFormatter(LogFormatter):
+    def dropped(self, item: Any, exception: BaseException,
+                response: Union[Response, Failure, None], spider: Spider) -> Any:
+        result: Dict[str, Any] = dict(super().dropped(item, exception, response, spider))
+        # Skipping unchanged items is the normal case on repeated crawls, and
+        # it's already counted in the stats
+        if isinstance(exception, UnchangedItem):
+            result['level'] = logging.DEBUG
+        return result
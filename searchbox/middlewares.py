@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 
 from collections.abc import Iterable
-from typing import Any, Callable, Type
+from typing import Any, Callable, Optional, Type
 
 from scrapy import Request, Spider, signals
 from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.settings import BaseSettings
+from scrapy.spiderloader import SpiderLoader
 
+from .items import CrawlItem
+from .pipelines import SearchboxPipeline
 from .types import SpiderRequests, SpiderResults
 from .router import Router
 
@@ -30,16 +35,25 @@ from .router import Router
 _ROUTER = Router()
 
 
+def routed_spider(name: str) -> Optional[Spider]:
+    # The spider with that name requests can be routed to
+    return _ROUTER.spider(name)
+
+
 class URLRouterSpiderMiddleware(object):
-    def __init__(self, router: Router) -> None:
+    def __init__(self, router: Router, all_spiders_from: Optional[BaseSettings] = None) -> None:
         self.router = router
+        self.all_spiders_from = all_spiders_from
 
     @classmethod
     def from_crawler(
         cls: Type["URLRouterSpiderMiddleware"], crawler: Crawler
     ) -> "URLRouterSpiderMiddleware":        
 
-        s = cls(_ROUTER)
+        # Worker processes of a parallel crawl run a single spider, but URLs
+        # still have to be routed to the others
+        all_spiders_from = crawler.settings if crawler.settings.getbool('SEARCHBOX_ROUTE_ALL_SPIDERS') else None
+        s = cls(_ROUTER, all_spiders_from)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
@@ -72,6 +86,47 @@ class URLRouterSpiderMiddleware(object):
     def spider_opened(self, spider: Spider) -> None:
         # TOOD: I have no idea is we can be sure this will be executed for all crawlers,
         # before any of them start crawling. 
+        self._register(spider)
+
+        if self.all_spiders_from is not None:
+            loader = SpiderLoader.from_settings(self.all_spiders_from)
+            registered = {s.name for s, _ in self.router.matchers}
+            for name in loader.list():
+                if name != spider.name and name not in registered:
+                    # Not crawling, only used for its URL matcher, the
+                    # requests it makes are scheduled by the spider that
+                    # found the URL, like in a single process crawl
+                    self._register(loader.load(name)())
+
+    def _register(self, spider: Spider) -> None:
         if hasattr(spider, "get_url_matcher"):
             match_fn: Callable[[Request], SpiderRequests] = getattr(spider, 'get_url_matcher')()
             self.router.matchers.append((spider, match_fn))
+
+
+# Runs the microformat extraction as soon as the spider callback yields an
+# item and drops its HTML, so the item waits in the scraper and pipeline queues
+# without a full copy of the page.
+class MetadataExtractionSpiderMiddleware(object):
+    def __init__(self) -> None:
+        self.pipeline = SearchboxPipeline()
+
+    @classmethod
+    def from_crawler(
+        cls: Type["MetadataExtractionSpiderMiddleware"], crawler: Crawler
+    ) -> "MetadataExtractionSpiderMiddleware":
+        if not crawler.settings.getbool('SEARCHBOX_EXTRACT_METADATA_IN_CALLBACK'):
+            raise NotConfigured
+        return cls()
+
+    def process_spider_output(
+        self,
+        result: SpiderResults,
+        spider: Spider,
+        response: Any = None,
+    ) -> SpiderResults:
+        for i in result:
+            if isinstance(i, CrawlItem) and i.html:
+                self.pipeline.process_item(i, spider)
+                i.html = None
+            yield i
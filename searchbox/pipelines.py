@@ -5,12 +5,23 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
-from dataclasses import asdict
+import hashlib
+import json
+import time
+from typing import Any, Dict
 import itemadapter
 from w3lib.html import get_base_url
-from .items import CrawlItem
+from .items import TAG_FIELDS, CrawlItem
 from scrapy import Spider
+from scrapy.crawler import Crawler
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.statscollectors import StatsCollector
 from .extractors import MicroformatExtractor
+from .indexed import AFTER_INDEX, IndexRecorder, index_hash_record
+from .instrumentation import activate, timed
+from .language import route
+from .store import IndexHashStore, TagVocabularyStore, store_path
+from .tags import TagVocabulary, normalise
 
 
 class SearchboxPipeline(object):
@@ -18,48 +29,159 @@ class SearchboxPipeline(object):
         url = item.url
 
         if url and item.html:
-            try:
-                html = item.html
-                base_url = get_base_url(html, url)
-                # TODO: Fix 2021-05-15 12:55:25 [pocket] ERROR: to_unicode must receive a bytes, str or unicode object, got NoneType
-                # Traceback (most recent call last):
-                #   File "/home/d/code/projects/searchbox/searchbox/pipelines.py", line 23, in process_item
-                #     base_url = get_base_url(html, url)
-                #   File "/home/d/code/projects/searchbox/venv/lib/python3.9/site-packages/w3lib/html.py", line 284, in get_base_url
-                #     text = to_unicode(text, encoding)
-                #   File "/home/d/code/projects/searchbox/venv/lib/python3.9/site-packages/w3lib/util.py", line 23, in to_unicode
-                #     raise TypeError('to_unicode must receive a bytes, str or unicode '
-                # TypeError: to_unicode must receive a bytes, str or unicode object, got NoneType
-
-                extractor = MicroformatExtractor(base_url, html)
+            with activate(spider), timed('pipeline_extraction', 'SearchboxPipeline'):
                 try:
-                    tags = sorted(set(extractor.get_tags()))
-                    item.article_tags = tags
+                    html = item.html
+                    base_url = get_base_url(html, url)
+                    # TODO: Fix 2021-05-15 12:55:25 [pocket] ERROR: to_unicode must receive a bytes, str or unicode object, got NoneType
+                    # Traceback (most recent call last):
+                    #   File "/home/d/code/projects/searchbox/searchbox/pipelines.py", line 23, in process_item
+                    #     base_url = get_base_url(html, url)
+                    #   File "/home/d/code/projects/searchbox/venv/lib/python3.9/site-packages/w3lib/html.py", line 284, in get_base_url
+                    #     text = to_unicode(text, encoding)
+                    #   File "/home/d/code/projects/searchbox/venv/lib/python3.9/site-packages/w3lib/util.py", line 23, in to_unicode
+                    #     raise TypeError('to_unicode must receive a bytes, str or unicode '
+                    # TypeError: to_unicode must receive a bytes, str or unicode object, got NoneType
+
+                    extractor = MicroformatExtractor(base_url, html)
+                    try:
+                        tags = sorted(set(extractor.get_tags()))
+                        item.article_tags = tags
+                    except Exception as e:
+                        spider.logger.exception(str(e))
+
+                    date_published = extractor.get_published_date()
+                    if date_published is not None:
+                        item.article_published_date = date_published.isoformat()
                 except Exception as e:
                     spider.logger.exception(str(e))
 
-                date_published = extractor.get_published_date()
-                if date_published is not None:
-                    item.article_published_date = date_published.isoformat()
-            except Exception as e:
-                spider.logger.exception(str(e))
+        return item
+
+
+class TagPipeline(object):
+    def __init__(self, vocabulary: TagVocabulary) -> None:
+        self.vocabulary = vocabulary
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> 'TagPipeline':
+        settings = crawler.settings
+        filename = settings.get('SEARCHBOX_TAG_VOCABULARY_FILE')
+        store = TagVocabularyStore(store_path(filename)) if filename else None
+        return cls(TagVocabulary(settings.getdict('SEARCHBOX_TAG_ALIASES'),
+                                 settings.getint('SEARCHBOX_TAG_ALIAS_MIN_COOCCURRENCE'), store))
+
+    def process_item(self, item: CrawlItem, spider: Spider) -> CrawlItem:
+        with activate(spider), timed('pipeline_tags', 'TagPipeline'):
+            normalised = {}
+            for name in TAG_FIELDS:
+                values = getattr(item, name)
+                if values:
+                    normalised[name] = [t for t in map(normalise, values) if t is not None]
+            if not normalised:
+                return item
 
+            self.vocabulary.observe(item.url, (t for tags in normalised.values() for t in tags))
+            for name, tags in normalised.items():
+                setattr(item, name, self.vocabulary.canonical_tags(tags))
         return item
 
+    def close_spider(self, _: Spider) -> None:
+        self.vocabulary.close()
+
 
 class CleanupPipeline(object):
     def process_item(self, item: CrawlItem, _: Spider) -> CrawlItem:
         if item.html:
             item.html = None
+        if item.document:
+            item.document = None
 
         return item
 
 
+class UnchangedItem(DropItem):
+    pass
+
+
+def index_hash(fields: Dict[str, Any]) -> str:
+    encoded = json.dumps(fields, sort_keys=True, ensure_ascii=False,
+                         separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class SkipUnchangedPipeline(object):
+    def __init__(self, store: IndexHashStore, stats: StatsCollector, max_age: float,
+                 recorder: IndexRecorder) -> None:
+        self.store = store
+        self.stats = stats
+        self.max_age = max_age
+        self.recorder = recorder
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> 'SkipUnchangedPipeline':
+        settings = crawler.settings
+        if not settings.getbool('SEARCHBOX_SKIP_UNCHANGED'):
+            raise NotConfigured
+        store = IndexHashStore(store_path(settings.get('SEARCHBOX_INDEX_HASHES_FILE')))
+        assert crawler.stats is not None
+        return cls(store, crawler.stats, settings.getfloat('SEARCHBOX_SKIP_UNCHANGED_MAX_AGE'),
+                   IndexRecorder(settings))
+
+    def process_item(self, item: CrawlItem, spider: Spider) -> CrawlItem:
+        if not item.url:
+            return item
+
+        fields = item.to_index_dict()
+        # Items for the same URL come from different callbacks with different
+        # fields (API metadata, README, homepage...) and are merged in the
+        # index, so each combination of fields is tracked separately
+        key = '{} {}'.format(item.url, ','.join(fields.keys()))
+        content_hash = index_hash(fields)
+        now = time.time()
+
+        previous = self.store.get(key)
+        # Unchanged items are still re-sent once they're old enough, in case
+        # the index lost them
+        if previous is not None and previous[0] == content_hash and \
+           now - previous[1] < self.max_age:
+            self.stats.inc_value('searchbox/index/unchanged_skipped')
+            # It's in the index already
+            self.recorder.write(item.after_index)
+            raise UnchangedItem('Unchanged since last indexed: {}'.format(item.url))
+
+        # Once it's in the index, see searchbox/indexed.py
+        item.after_index.append(index_hash_record(key, content_hash, now))
+        self.stats.inc_value('searchbox/index/changed')
+        return item
+
+    def close_spider(self, _: Spider) -> None:
+        self.store.close()
+        self.recorder.close()
+
+
 class ConvertToItemPipeline(object):
     def process_item(self, item: CrawlItem, _: Spider) -> itemadapter.ItemAdapter:
         # ItemAdapter accepts a dataclass directly, but it will keep all None attributes,
         # which causes the elasticsearch sink to overwrite unpopulated fields with nulls.
-        # TODO: Find a way to filter out None attributes when using CrawlItem directly,
-        # or add the option to the Elastic sink.
-        # return itemadapter.ItemAdapter(item)
-        return itemadapter.ItemAdapter({k:v for k, v in asdict(item).items() if v})
+        fields = item.to_index_dict()
+        if item.after_index:
+            fields[AFTER_INDEX] = item.after_index
+        return itemadapter.ItemAdapter(fields)
+
+
+class LanguagePipeline(object):
+    # After ConvertToItemPipeline, the text goes to the fields of its
+    # language (see searchbox/language.py)
+    def __init__(self, merge: bool) -> None:
+        self.merge = merge
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> 'LanguagePipeline':
+        if not crawler.settings.getbool('SEARCHBOX_DETECT_LANGUAGE'):
+            raise NotConfigured
+        return cls(crawler.settings.getbool('ELASTICSEARCH_MERGE'))
+
+    def process_item(self, item: itemadapter.ItemAdapter, spider: Spider) -> itemadapter.ItemAdapter:
+        with activate(spider), timed('pipeline_language', 'LanguagePipeline'):
+            return itemadapter.ItemAdapter(route(item.item, self.merge))
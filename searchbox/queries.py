@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Elasticsearch request bodies for bin/query.py. Free text goes through a
+# query_string, fuzzy unless the terms were corrected with the local term
+# dictionary (see searchbox/terms.py), browsing by tag, tag source and year are filters on
+# keyword and date fields: they don't score, and elasticsearch caches them,
+# so they cost little next to the full text query. Facets are aggregations
+# over the same filters, the counts of every tag, source and year.
+#
+# Similarity search (`bin/query sim`) finds candidates in the vector index
+# (see searchbox/vectors.py), and re-ranks them with their BM25 scores for
+# the same terms, restricted to the candidates.
+#
+# The fields need the mappings created by `bin/query reset-index`. Searches
+# are sent by searchbox/search.py.
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# Where each source's tags are, the canonical tags of all of them are
+# copied to 'tags' (see searchbox/tags.py)
+TAG_SOURCES = {
+    'repository': 'repository_tags',
+    'pocket': 'pocket_tags',
+    'twitter': 'twitter_tags',
+    'article': 'article_tags',
+}
+ALL_TAGS = 'tags'
+
+# An item's year is that of the first of these it has, the same the results
+# show
+DATE_FIELDS = ('last_update', 'article_published_date')
+
+YEAR_SCRIPT = '''
+for (field in params.fields) {
+    if (doc.containsKey(field) && doc[field].size() > 0) {
+        emit(doc[field].value.getYear());
+        return;
+    }
+}
+'''
+
+
+class Filters(NamedTuple):
+    tags: List[str] = []
+    source: Optional[str] = None
+    year: Optional[int] = None
+
+
+def tag_field(source: Optional[str]) -> str:
+    if source is None:
+        return ALL_TAGS
+    return TAG_SOURCES[source] + '.keyword'
+
+
+def text_query(terms: List[str], fuzzy: bool = True) -> Optional[Dict[str, Any]]:
+    # Terms corrected with the term dictionary (see searchbox/terms.py) don't
+    # need to be fuzzy
+    if not terms:
+        return None
+    query_term = terms[0] if len(terms) == 1 else ' AND '.join('({})'.format(term) for term in terms)
+    query: Dict[str, Any] = {'query': query_term, 'type': 'best_fields'}
+    if fuzzy:
+        query['fuzziness'] = 'AUTO:2,6'
+    return {'query_string': query}
+
+
+def filter_clauses(filters: Filters) -> List[Dict[str, Any]]:
+    field = tag_field(filters.source)
+    clauses: List[Dict[str, Any]] = [{'term': {field: tag}} for tag in filters.tags]
+    if filters.source is not None:
+        clauses.append({'exists': {'field': TAG_SOURCES[filters.source]}})
+    if filters.year is not None:
+        year_range = {'gte': '{}-01-01'.format(filters.year), 'lt': '{}-01-01'.format(filters.year + 1)}
+        clauses.append({'bool': {
+            'should': [{'range': {date_field: year_range}} for date_field in DATE_FIELDS],
+            'minimum_should_match': 1,
+        }})
+    return clauses
+
+
+def search_query(terms: List[str], filters: Filters, fuzzy: bool = True) -> Dict[str, Any]:
+    query: Dict[str, Any] = {'filter': filter_clauses(filters)}
+    text = text_query(terms, fuzzy)
+    if text is not None:
+        query['must'] = [text]
+    return {'bool': query}
+
+
+def search_sort(terms: List[str]) -> Optional[List[Dict[str, Any]]]:
+    # Without text there's no score to sort by, newest first instead
+    if terms:
+        return None
+    return [{field: {'order': 'desc', 'missing': '_last', 'unmapped_type': 'date'}}
+            for field in DATE_FIELDS]
+
+
+def results_search(terms: List[str], filters: Filters, size: int, fuzzy: bool = True) -> Dict[str, Any]:
+    body: Dict[str, Any] = {'size': size, 'query': search_query(terms, filters, fuzzy)}
+    sort = search_sort(terms)
+    if sort is not None:
+        body['sort'] = sort
+    return body
+
+
+def facets_search(terms: List[str], filters: Filters, size: int, fuzzy: bool = True) -> Dict[str, Any]:
+    # Counts only, no hits
+    return {
+        'size': 0,
+        'query': search_query(terms, filters, fuzzy),
+        'aggs': facet_aggregations(filters, size),
+        'runtime_mappings': year_runtime_mapping(),
+    }
+
+
+def facet_aggregations(filters: Filters, size: int) -> Dict[str, Any]:
+    return {
+        'tags': {'terms': {'field': tag_field(filters.source), 'size': size}},
+        'sources': {'filters': {'filters': {
+            source: {'exists': {'field': field}} for source, field in TAG_SOURCES.items()
+        }}},
+        'years': {'terms': {'field': 'year', 'size': 100, 'order': {'_key': 'desc'}}},
+    }
+
+
+def year_runtime_mapping() -> Dict[str, Any]:
+    return {
+        'year': {
+            'type': 'long',
+            'script': {'source': YEAR_SCRIPT, 'params': {'fields': list(DATE_FIELDS)}},
+        }
+    }
+
+
+def facet_counts(response: Dict[str, Any]) -> Dict[str, List[Any]]:
+    aggregations = response['aggregations']
+    sources = aggregations['sources']['buckets']
+    return {
+        'tags': [(b['key'], b['doc_count']) for b in aggregations['tags']['buckets']],
+        'sources': [(source, sources[source]['doc_count']) for source in TAG_SOURCES
+                    if sources[source]['doc_count'] > 0],
+        'years': [(b['key'], b['doc_count']) for b in aggregations['years']['buckets']],
+    }
+
+
+def rerank_query(terms: List[str], ids: List[str]) -> Dict[str, Any]:
+    # Every candidate is returned, the text only adds to the score of those
+    # that match it
+    query: Dict[str, Any] = {'filter': [{'ids': {'values': ids}}]}
+    text = text_query(terms)
+    if text is not None:
+        query['should'] = [text]
+    return {'bool': query}
+
+
+def hybrid_ranking(similarities: Dict[str, float], hits: List[Dict[str, Any]],
+                   weight: float) -> List[Tuple[float, Dict[str, Any]]]:
+    # BM25 scores are unbounded, they're scaled to the best of the hits
+    best = max((hit['_score'] or 0.0 for hit in hits), default=0.0) or 1.0
+    ranked = [(weight * similarities.get(hit['_id'], 0.0) + (1 - weight) * (hit['_score'] or 0.0) / best, hit)
+              for hit in hits]
+    ranked.sort(key=lambda r: r[0], reverse=True)
+    return ranked
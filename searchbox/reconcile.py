@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Deletes from the index what's been unstarred, unbookmarked or unliked. The
+# APIs only list what's there now, so every crawl keeps track of what it found
+# (see LiveURLStore in searchbox/store.py):
+#
+# - Every item's URL is recorded with its source: the star, bookmark or like
+#   it came from. That's the item itself for the listed ones, and the
+#   backlink for homepages and linked pages.
+# - A source is live while a crawl finds it. Homepages, READMEs and pages are
+#   kept while their source is, they aren't fetched on every crawl (see
+#   searchbox/refresh.py).
+# - Once a spider's crawl has gone through every one of its listings, the
+#   sources it didn't find are gone. Their documents are deleted from
+#   elasticsearch in bulk, unless another source or spider still has them,
+#   along with their index hashes and page history, so they're indexed again
+#   if they come back.
+#
+# Only a crawl that finished with every listing read to the end (no errors,
+# no rate limits, nothing served from the HTTP cache, which the callbacks may
+# skip) deletes anything, and none does if it would delete more than
+# SEARCHBOX_RECONCILE_MAX_DELETE_RATIO of the spider's sources. An
+# interrupted crawl continues its generation when it's resumed. With
+# `crawl.py --workers --shards N` the last shard of a spider to finish
+# deletes for all of them.
+
+import hashlib
+import logging
+from collections.abc import Iterable
+from typing import Any, Callable, List, Tuple, Type
+
+from scrapy import Request, Spider, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.settings import BaseSettings
+from scrapy.statscollectors import StatsCollector
+
+from .items import CrawlItem
+from .scheduling import LISTING, request_kind
+from .store import IndexHashStore, LiveURLStore, PageHistoryStore, store_path
+from .types import SpiderRequests, SpiderResults
+from .workers import parse_shard
+
+logger = logging.getLogger(__name__)
+
+
+def source_of(item: CrawlItem, url: str) -> str:
+    return item.repository_backlink or item.twitter_backlink or url
+
+
+def document_id(url: str) -> str:
+    # The _id ElasticSearchPipeline gives items, with the URL as
+    # ELASTICSEARCH_UNIQ_KEY
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def delete_documents(settings: BaseSettings, urls: List[str]) -> int:
+    # Returns how many were in the index
+    from elasticsearch import helpers
+
+    from .elastic import TimedElasticSearchPipeline
+
+    es = TimedElasticSearchPipeline.init_es_client(settings)
+    index = settings.get('ELASTICSEARCH_INDEX')
+    actions = ({'_op_type': 'delete', '_index': index, '_id': document_id(url)} for url in urls)
+    # Those that weren't there are errors too, and don't count
+    deleted, _ = helpers.bulk(es, actions, raise_on_error=False, stats_only=True)
+
+    hashes = IndexHashStore(store_path(settings.get('SEARCHBOX_INDEX_HASHES_FILE')))
+    history_file = settings.get('SEARCHBOX_REFRESH_FILE')
+    history = PageHistoryStore(store_path(history_file)) if history_file else None
+    for url in urls:
+        hashes.forget(url)
+        if history is not None:
+            history.forget(url)
+    hashes.close()
+    if history is not None:
+        history.close()
+    return int(deleted)
+
+
+class ReconcileSpiderMiddleware(object):
+    def __init__(self, store: LiveURLStore, spider_name: str, shard: int, shards: int,
+                 max_delete_ratio: float, delete: Callable[[List[str]], int],
+                 stats: StatsCollector) -> None:
+        self.store = store
+        self.spider_name = spider_name
+        self.shard = shard
+        self.shards = shards
+        self.max_delete_ratio = max_delete_ratio
+        self.delete = delete
+        self.stats = stats
+        self.generation = store.begin(spider_name, shards)
+
+    @classmethod
+    def from_crawler(cls: Type['ReconcileSpiderMiddleware'], crawler: Crawler) -> 'ReconcileSpiderMiddleware':
+        settings = crawler.settings
+        filename = settings.get('SEARCHBOX_LIVE_URLS_FILE')
+        if not filename:
+            raise NotConfigured
+
+        shard, shards = 0, 1
+        if settings.get('SEARCHBOX_SHARD'):
+            shard, shards = parse_shard(settings.get('SEARCHBOX_SHARD'))
+
+        def delete(urls: List[str]) -> int:
+            return delete_documents(settings, urls)
+
+        assert crawler.stats is not None
+        middleware = cls(LiveURLStore(store_path(filename)), crawler.spidercls.name, shard, shards,
+                         settings.getfloat('SEARCHBOX_RECONCILE_MAX_DELETE_RATIO'), delete, crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def _start(self, request: Request) -> None:
+        listing = request.meta.get('listing')
+        if listing is not None and request_kind(request) == LISTING:
+            self.store.start_listing(self.spider_name, self.generation, self.shard, listing)
+
+    def process_spider_output(
+        self,
+        result: SpiderResults,
+        spider: Spider,
+        response: Any = None,
+    ) -> SpiderResults:
+        listing = response.meta.get('listing') if response is not None else None
+        continued = False
+        found: List[Tuple[str, str]] = []
+        for i in result:
+            if isinstance(i, Request):
+                self._start(i)
+                if listing is not None and request_kind(i) == LISTING and i.meta.get('listing') == listing:
+                    continued = True
+            elif isinstance(i, CrawlItem) and i.url:
+                found.append((i.url, source_of(i, i.url)))
+            yield i
+
+        if found:
+            self.store.mark(self.spider_name, self.generation, found)
+        if listing is not None and not continued and response.status == 200 and \
+                'cached' not in response.flags:
+            self.store.finish_listing(self.spider_name, self.generation, self.shard, listing)
+
+    def process_start_requests(
+        self, start_requests: Iterable[Request], spider: Spider
+    ) -> SpiderRequests:
+        for r in start_requests:
+            self._start(r)
+            yield r
+
+    def reconcile(self, spider: Spider) -> None:
+        if not self.store.is_complete(self.spider_name, self.generation):
+            logger.info('Not every listing was read to the end, nothing deleted')
+            self.stats.set_value('reconcile/incomplete', 1, spider=spider)
+            return
+
+        stale = self.store.stale_sources(self.spider_name, self.generation)
+        if not stale:
+            return
+        self.stats.set_value('reconcile/stale_sources', len(stale), spider=spider)
+        total = self.store.sources(self.spider_name)
+        if len(stale) > self.max_delete_ratio * total:
+            logger.warning('%d of %d sources are gone, too many to be right, nothing deleted',
+                           len(stale), total)
+            self.stats.set_value('reconcile/too_many', 1, spider=spider)
+            return
+
+        orphans = self.store.orphans(self.spider_name, stale)
+        # The records go only once the documents have, a failure leaves them
+        # for the next crawl
+        deleted = self.delete(orphans) if orphans else 0
+        self.store.remove(self.spider_name, stale)
+        self.stats.set_value('reconcile/deleted', deleted, spider=spider)
+        logger.info('%d sources gone, deleted %d documents', len(stale), deleted)
+
+    def spider_closed(self, spider: Spider, reason: str) -> None:
+        # Interrupted crawls keep their generation open, to be resumed
+        try:
+            if reason == 'finished' and \
+                    self.store.finish_shard(self.spider_name, self.generation, self.shard) >= self.shards:
+                self.reconcile(spider)
+                self.store.end(self.spider_name, self.generation)
+        finally:
+            self.store.close()
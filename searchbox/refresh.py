@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+# Adaptive refresh of READMEs and web pages. Most of them never change after
+# being starred, so they aren't fetched again on every crawl. The history of
+# each URL (a hash of its content, when it was last checked and last changed)
+# is kept in .scrapy/searchbox, and the URL is next due after an interval
+# that's multiplied by SEARCHBOX_REFRESH_BACKOFF every time the page is found
+# unchanged, and divided by it when it has changed, so it follows how often
+# the page actually changes. Requests for URLs that aren't due are dropped as
+# the spider makes them.
+#
+# SEARCHBOX_CRAWL_BUDGET caps how many README and page requests a spider
+# makes in a crawl. Those over the budget are still due on the next crawl,
+# and the ones fetched this time aren't, so the budget works its way through
+# all of them.
+#
+# Listings and API requests are always made, they find new stars and keep
+# names, descriptions and tags up to date.
+
+import hashlib
+import time
+from collections.abc import Iterable
+from typing import Any, Callable, FrozenSet, List, NamedTuple, Set, Type, Union
+
+from scrapy import Request, Spider, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.statscollectors import StatsCollector
+
+from .extractors import is_processable
+from .indexed import page_history_record
+from .items import CrawlItem
+from .scheduling import request_kind
+from .store import PageHistory, PageHistoryStore, store_path
+from .types import SpiderRequests, SpiderResults
+from .workers import parse_shard
+
+# The URL a content request was let through for, kept through redirects
+REFRESH_URL = 'refresh_url'
+
+
+class RefreshPolicy(NamedTuple):
+    min_interval: float
+    max_interval: float
+    backoff: float
+
+    def next_interval(self, interval: float, changed: bool) -> float:
+        interval = interval / self.backoff if changed else interval * self.backoff
+        return min(max(interval, self.min_interval), self.max_interval)
+
+
+def content_hash(parts: List[Union[str, bytes]]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode('utf-8') if isinstance(part, str) else part)
+    return digest.hexdigest()
+
+
+class RefreshSpiderMiddleware(object):
+    def __init__(self, store: PageHistoryStore, kinds: FrozenSet[str], policy: RefreshPolicy,
+                 budget: int, stats: StatsCollector, clock: Callable[[], float] = time.time) -> None:
+        self.store = store
+        self.kinds = kinds
+        self.policy = policy
+        self.budget = budget
+        self.stats = stats
+        self.clock = clock
+        # Let through in this crawl
+        self.allowed: Set[str] = set()
+
+    @classmethod
+    def from_crawler(cls: Type['RefreshSpiderMiddleware'], crawler: Crawler) -> 'RefreshSpiderMiddleware':
+        settings = crawler.settings
+        filename = settings.get('SEARCHBOX_REFRESH_FILE')
+        if not filename:
+            raise NotConfigured
+
+        budget = settings.getint('SEARCHBOX_CRAWL_BUDGET')
+        shard = settings.get('SEARCHBOX_SHARD')
+        if budget and shard:
+            # Split between the shards of a parallel crawl
+            _, shards = parse_shard(shard)
+            budget = -(-budget // shards)
+
+        policy = RefreshPolicy(settings.getfloat('SEARCHBOX_REFRESH_MIN_INTERVAL'),
+                               settings.getfloat('SEARCHBOX_REFRESH_MAX_INTERVAL'),
+                               settings.getfloat('SEARCHBOX_REFRESH_BACKOFF'))
+        assert crawler.stats is not None
+        middleware = cls(PageHistoryStore(store_path(filename)),
+                         frozenset(settings.getlist('SEARCHBOX_REFRESH_KINDS')),
+                         policy, budget, crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def _allow(self, request: Request, spider: Spider) -> bool:
+        if request_kind(request) not in self.kinds:
+            return True
+
+        url = request.url
+        # Requested again in the same crawl, that's for the dupefilter
+        if url in self.allowed:
+            return True
+
+        history = self.store.get(url)
+        if history is not None and history.due_at > self.clock():
+            self.stats.inc_value('refresh/not_due', spider=spider)
+            return False
+        if self.budget and len(self.allowed) >= self.budget:
+            self.stats.inc_value('refresh/over_budget', spider=spider)
+            return False
+
+        self.allowed.add(url)
+        request.meta[REFRESH_URL] = url
+        self.stats.inc_value('refresh/new' if history is None else 'refresh/due', spider=spider)
+        return True
+
+    def _observe(self, url: str, parts: List[Union[str, bytes]], spider: Spider) -> PageHistory:
+        digest = content_hash(parts)
+        now = self.clock()
+        previous = self.store.get(url)
+        if previous is None:
+            interval = self.policy.min_interval
+            changed_at = now
+        else:
+            changed = previous.content_hash != digest
+            interval = self.policy.next_interval(previous.interval, changed)
+            changed_at = now if changed else previous.changed_at
+            self.stats.inc_value('refresh/changed' if changed else 'refresh/unchanged', spider=spider)
+        return PageHistory(digest, interval, now, changed_at, now + interval)
+
+    def process_spider_output(
+        self,
+        result: SpiderResults,
+        spider: Spider,
+        response: Any = None,
+    ) -> SpiderResults:
+        url = response.meta.get(REFRESH_URL) if response is not None else None
+        # The text of the items is what matters, pages have timestamps,
+        # tokens and such in their HTML
+        contents: List[Union[str, bytes]] = []
+        items: List[CrawlItem] = []
+        for i in result:
+            if isinstance(i, Request):
+                if self._allow(i, spider):
+                    yield i
+                continue
+            if url is not None and isinstance(i, CrawlItem):
+                # Held back until the page's history is known, it's recorded
+                # once they're in the index (see searchbox/indexed.py)
+                items.append(i)
+                if i.content:
+                    contents.append(i.content)
+                continue
+            yield i
+
+        # Errors leave the page due
+        if url is not None and is_processable(response, process_cached=True):
+            history = self._observe(url, contents or [response.body], spider)
+            if items:
+                for item in items:
+                    item.after_index.append(page_history_record(url, history))
+            else:
+                # Nothing to index
+                self.store.put(url, history)
+        yield from items
+
+    def process_start_requests(
+        self, start_requests: Iterable[Request], spider: Spider
+    ) -> SpiderRequests:
+        for r in start_requests:
+            if self._allow(r, spider):
+                yield r
+
+    def spider_closed(self, spider: Spider) -> None:
+        self.store.close()
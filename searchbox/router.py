@@ -1,4 +1,4 @@
-from typing import Callable, List, Tuple
+from typing import Callable, List, Optional, Tuple
 from scrapy import Spider
 from scrapy.http import Request
 
@@ -9,6 +9,12 @@ class Router(object):
     def __init__(self) -> None:
         self.matchers: List[Tuple[Spider, Callable[[Request], SpiderRequests]]] = []
 
+    def spider(self, name: str) -> Optional[Spider]:
+        for s, _ in self.matchers:
+            if s.name == name:
+                return s
+        return None
+
     @staticmethod
     def _merge_metadata(target: Request, existing: Request) -> Request:
         for k in existing.meta.keys():
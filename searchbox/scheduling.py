@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+# Request kinds, and the scheduling that goes with them. Spiders tag their
+# requests with a kind in meta['request_kind']: API listings (the pages of
+# stars, bookmarks and likes), other API metadata, README content, or
+# arbitrary web pages (homepages, bookmarks, linked articles). Each kind has
+# a priority, so the cheap API calls that fill the index with names,
+# descriptions and tags go first, and optionally a limit on how many of its
+# requests can be downloading at once, so slow third-party pages can't take
+# every download slot and leave the API calls waiting behind them.
+#
+# Both are settings (SEARCHBOX_REQUEST_PRIORITIES and
+# SEARCHBOX_REQUEST_KIND_CONCURRENCY), and can be changed per spider with
+# custom_settings.
+
+import logging
+from collections import deque
+from collections.abc import Iterable
+from typing import Any, Deque, Dict, Optional, Type
+
+from scrapy import Request, Spider
+from scrapy.core.scheduler import Scheduler
+from scrapy.crawler import Crawler
+
+from .middlewares import routed_spider
+from .types import SpiderRequests, SpiderResults
+
+logger = logging.getLogger(__name__)
+
+LISTING = 'listing'
+API = 'api'
+README = 'readme'
+PAGE = 'page'
+
+# Requests the spiders don't tag are treated as web pages
+DEFAULT_KIND = PAGE
+
+# The spider and method names of the callbacks of a request another spider
+# took over, in a saved queue
+ROUTED = '_routed'
+
+
+def request_kind(request: Request) -> str:
+    kind: str = request.meta.get('request_kind', DEFAULT_KIND)
+    return kind
+
+
+class RequestKindSpiderMiddleware(object):
+    def __init__(self, priorities: Dict[str, int]) -> None:
+        self.priorities = priorities
+
+    @classmethod
+    def from_crawler(
+        cls: Type["RequestKindSpiderMiddleware"], crawler: Crawler
+    ) -> "RequestKindSpiderMiddleware":
+        return cls(crawler.settings.getdict('SEARCHBOX_REQUEST_PRIORITIES'))
+
+    def _prioritise(self, request: Request) -> Request:
+        # Requests with an explicit priority keep it. This runs when the
+        # request is created, so later adjustments (eg. on redirects) are
+        # relative to the kind's priority.
+        if request.priority == 0:
+            request.priority = int(self.priorities.get(request_kind(request), 0))
+        return request
+
+    def process_spider_output(
+        self,
+        result: SpiderResults,
+        spider: Spider,
+        response: Any = None,
+    ) -> SpiderResults:
+        for i in result:
+            yield self._prioritise(i) if isinstance(i, Request) else i
+
+    def process_start_requests(
+        self, start_requests: Iterable[Request], spider: Spider
+    ) -> SpiderRequests:
+        for r in start_requests:
+            yield self._prioritise(r)
+
+
+# Scrapy's scheduler, plus the per-kind concurrency limits. A request whose
+# kind is at its limit is set aside, and handed out once one of its kind
+# leaves the downloader. Requests come out of the queue in priority order,
+# so at most a few are set aside at any time.
+#
+# Listings are also set aside while too much work is outstanding (see
+# SEARCHBOX_BACKPRESSURE_HIGH): every page of stars or bookmarks queues a
+# request for each of them, and with the listings' priority the pages would
+# all be fetched long before what they list, with every request waiting in
+# the queue. Held back, a listing only gets ahead of the downloads by a
+# watermark's worth of requests, whatever its length.
+#
+# Requests another spider took over (see searchbox/router.py) have that
+# spider's callbacks, which Scrapy can't save to the JOBDIR queues since
+# they're not methods of the crawling spider. They're saved with the names
+# of the spider and its methods instead, and get their callbacks back when
+# they're read.
+class KindAwareScheduler(Scheduler):
+    # More than this set aside and we stop taking requests from the queue
+    # until some are handed out
+    MAX_DEFERRED = 100
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.kind_limits: Dict[str, int] = {}
+        self.deferred: Dict[str, Deque[Request]] = {}
+        self.backpressure_high = 0
+        self.backpressure_low = 0
+        self.backpressure = False
+        # Requests other than listings in the queues, including those set
+        # aside
+        self.queued = 0
+
+    @classmethod
+    def from_crawler(cls: Type["KindAwareScheduler"], crawler: Crawler) -> "KindAwareScheduler":
+        scheduler = super().from_crawler(crawler)
+        limits = crawler.settings.getdict('SEARCHBOX_REQUEST_KIND_CONCURRENCY')
+        scheduler.kind_limits = {kind: int(limit) for kind, limit in limits.items()}
+        scheduler.backpressure_high = crawler.settings.getint('SEARCHBOX_BACKPRESSURE_HIGH')
+        scheduler.backpressure_low = crawler.settings.getint('SEARCHBOX_BACKPRESSURE_LOW')
+        return scheduler
+
+    def open(self, spider: Spider) -> Any:
+        result = super().open(spider)
+        # Resumed from a JOBDIR, listings are never saved
+        self.queued = super().__len__()
+        return result
+
+    def _outstanding(self) -> int:
+        assert self.crawler is not None and self.crawler.engine is not None
+        engine = self.crawler.engine
+        outstanding = self.queued + len(engine.downloader.active)
+        slot = getattr(engine.scraper, 'slot', None)
+        if slot is not None:
+            outstanding += slot.itemproc_size
+        return outstanding
+
+    def _listings_held(self) -> bool:
+        if not self.backpressure_high:
+            return False
+        outstanding = self._outstanding()
+        if self.backpressure:
+            self.backpressure = outstanding > self.backpressure_low
+        elif outstanding >= self.backpressure_high:
+            self.backpressure = True
+            if self.stats:
+                self.stats.inc_value('scheduler/backpressure', spider=self.spider)
+        return self.backpressure
+
+    def _in_flight(self, kind: str) -> int:
+        assert self.crawler is not None and self.crawler.engine is not None
+        return sum(1 for r in self.crawler.engine.downloader.active if request_kind(r) == kind)
+
+    def _has_capacity(self, kind: str) -> bool:
+        if kind == LISTING and self._listings_held():
+            return False
+        limit = self.kind_limits.get(kind)
+        return limit is None or self._in_flight(kind) < limit
+
+    def _next_deferred(self) -> Optional[Request]:
+        ready = [(queue[0].priority, kind) for kind, queue in self.deferred.items()
+                 if queue and self._has_capacity(kind)]
+        if not ready:
+            return None
+        _, kind = max(ready)
+        return self.deferred[kind].popleft()
+
+    def _deferred_count(self) -> int:
+        return sum(len(queue) for queue in self.deferred.values())
+
+    def has_pending_requests(self) -> bool:
+        return super().has_pending_requests() or self._deferred_count() > 0
+
+    def enqueue_request(self, request: Request) -> bool:
+        added: bool = super().enqueue_request(request)
+        if added and request_kind(request) != LISTING:
+            self.queued += 1
+        return added
+
+    def next_request(self) -> Optional[Request]:
+        request = self._next_request()
+        if request is not None and request_kind(request) != LISTING:
+            self.queued -= 1
+        return request
+
+    def _next_request(self) -> Optional[Request]:
+        request = self._next_deferred()
+        if request is not None:
+            return request
+
+        # None ends the engine's loop until the next tick, so requests at
+        # their limit are set aside until one with room is found
+        while self._deferred_count() < self.MAX_DEFERRED:
+            request = super().next_request()
+            if request is None:
+                return None
+
+            kind = request_kind(request)
+            if self._has_capacity(kind):
+                return request
+
+            self.deferred.setdefault(kind, deque()).append(request)
+            if self.stats:
+                self.stats.inc_value('scheduler/deferred/{}'.format(kind), spider=self.spider)
+        return None
+
+    def __len__(self) -> int:
+        return super().__len__() + self._deferred_count()
+
+    def _dqpush(self, request: Request) -> bool:
+        # Listings stay in memory, a resumed crawl makes them again from its
+        # cursors (see searchbox/jobs.py)
+        if request_kind(request) == LISTING:
+            return False
+        return super()._dqpush(self._serializable(request))
+
+    def _serializable(self, request: Request) -> Request:
+        routed = {}
+        for attribute in ('callback', 'errback'):
+            method = getattr(request, attribute)
+            owner = getattr(method, '__self__', None)
+            if isinstance(owner, Spider) and owner is not self.spider:
+                routed[attribute] = (owner.name, method.__name__)
+        if not routed:
+            return request
+        replaced: Request = request.replace(meta=dict(request.meta, **{ROUTED: routed}),
+                                            **{attribute: None for attribute in routed})
+        return replaced
+
+    def _dqpop(self) -> Optional[Request]:
+        while True:
+            request: Optional[Request] = super()._dqpop()
+            if request is None or ROUTED not in request.meta:
+                return request
+            routed = request.meta.pop(ROUTED)
+            spiders = {attribute: routed_spider(name) for attribute, (name, _) in routed.items()}
+            if all(spider is not None for spider in spiders.values()):
+                for attribute, (_, method) in routed.items():
+                    setattr(request, attribute, getattr(spiders[attribute], method))
+                return request
+            # Not routed to this time
+            logger.warning('No spider to take over %s from the saved queue', request.url)
+            if self.stats:
+                self.stats.inc_value('scheduler/unroutable', spider=self.spider)
+
+    def close(self, reason: str) -> Any:
+        # Back to the queues, so they're saved with the rest when there's a
+        # JOBDIR. They've already been through the dupefilter, so they can't
+        # go through enqueue_request again.
+        for queue in self.deferred.values():
+            while queue:
+                request = queue.popleft()
+                if not self._dqpush(request):
+                    self._mqpush(request)
+        return super().close(reason)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+# Elasticsearch access for bin/query.py. There's one client per process,
+# created the first time it's needed, and its connection pool keeps the
+# connections alive between requests (build-vectors scrolls through the whole
+# index with it). Searches that don't depend on each other, like a query's
+# results and its facet counts, are sent together in a single _msearch
+# request: one round trip, and elasticsearch runs them in parallel.
+#
+# The request bodies are built in searchbox/queries.py.
+
+from typing import Any, Dict, List, Optional, Sequence
+
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import TransportError
+
+INDEX_NAME = 'scrapy'
+
+# Connections kept open to the cluster
+POOL_SIZE = 4
+# Documents per request when reading the whole index
+SCAN_SIZE = 500
+
+_client: Optional[Elasticsearch] = None
+
+
+def client() -> Elasticsearch:
+    global _client
+    if _client is None:
+        # Reads the secrets file
+        from . import secrets_loader
+        _client = Elasticsearch(hosts=[secrets_loader.get_elastic_authenticated_url()],
+                                maxsize=POOL_SIZE)
+    return _client
+
+
+def msearch_body(searches: Sequence[Dict[str, Any]], index: str) -> List[Dict[str, Any]]:
+    body: List[Dict[str, Any]] = []
+    for search in searches:
+        body.append({'index': index})
+        body.append(search)
+    return body
+
+
+def msearch(es: Elasticsearch, searches: Sequence[Dict[str, Any]],
+            index: str = INDEX_NAME) -> List[Dict[str, Any]]:
+    # The responses in the same order, an error in any of them raises like
+    # it would have from a single search
+    responses: List[Dict[str, Any]] = es.msearch(body=msearch_body(searches, index))['responses']
+    for response in responses:
+        if 'error' in response:
+            error = response['error']
+            raise TransportError(response.get('status', 500),
+                                 error.get('type', 'unknown') if isinstance(error, dict) else error,
+                                 response)
+    return responses
@@ -5,7 +5,10 @@ import importlib.util
 from importlib.abc import Loader
 
 home = expanduser("~")
-secrets_path = os.path.abspath(os.path.join(home, '.config/searchbox/secrets.py'))
+# SEARCHBOX_SECRETS points to a different secrets file, eg. for the offline
+# replay benchmark
+secrets_path = os.path.abspath(os.environ.get('SEARCHBOX_SECRETS') or
+                               os.path.join(home, '.config/searchbox/secrets.py'))
 spec = importlib.util.spec_from_file_location(secrets_path, secrets_path)
 if spec is None:
     raise Exception('Can\'t find module at path {}'.format(secrets_path))
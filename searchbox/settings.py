@@ -22,15 +22,18 @@ USER_AGENT = 'searchbox (+http://diegoveralli.net)'
 ROBOTSTXT_OBEY = True
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-CONCURRENT_REQUESTS = 12
+# Concurrency per host is adjusted by searchbox.throttle (see below), this only
+# caps the total
+CONCURRENT_REQUESTS = 24
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
 #DOWNLOAD_DELAY = 3
 # The download delay setting will honor only one of:
-CONCURRENT_REQUESTS_PER_DOMAIN = 2
 #CONCURRENT_REQUESTS_PER_IP = 16
+# Starting concurrency for hosts without a profile in SEARCHBOX_DOMAIN_PROFILES
+CONCURRENT_REQUESTS_PER_DOMAIN = 2
 
 # Disable cookies (enabled by default)
 #COOKIES_ENABLED = False
@@ -47,9 +50,89 @@ TELNETCONSOLE_ENABLED = False
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 SPIDER_MIDDLEWARES = {
+    # After the router, so requests taken over by another spider get that
+    # spider's request kind
+    'searchbox.scheduling.RequestKindSpiderMiddleware': -5,
+    # Only with a JOBDIR, saves and restores where the API listings got to
+    'searchbox.jobs.ResumeSpiderMiddleware': -4,
+    # Only in the shards of a parallel crawl (crawl.py --workers --shards N)
+    'searchbox.workers.ShardSpiderMiddleware': -3,
     'searchbox.middlewares.URLRouterSpiderMiddleware': -1,
+    # After the shards, so only requests a shard makes count towards its
+    # budget
+    'searchbox.refresh.RefreshSpiderMiddleware': -6,
+    # After the shards and the resumed listings, it records what the spider
+    # found
+    'searchbox.reconcile.ReconcileSpiderMiddleware': -7,
+    # Only with SEARCHBOX_EXTRACT_DOCUMENTS
+    'searchbox.documents.DocumentSpiderMiddleware': 890,
+    # Only with SEARCHBOX_MAIN_CONTENT
+    'searchbox.content.MainContentSpiderMiddleware': 900,
+    'searchbox.middlewares.MetadataExtractionSpiderMiddleware': 950,
+    'searchbox.instrumentation.CallbackTimingSpiderMiddleware': 1000,
 }
 
+# Priority of each kind of request (see searchbox/scheduling.py): API
+# metadata first, so the index fills with names, descriptions and tags
+# quickly, then README content, then arbitrary web pages
+SEARCHBOX_REQUEST_PRIORITIES = {'listing': 100, 'api': 100, 'readme': 50, 'page': 0}
+
+# Most requests of a kind downloading at once, kinds not listed have no limit
+# besides CONCURRENT_REQUESTS. Slow third-party pages can't take every slot,
+# so there's always room for API calls.
+SEARCHBOX_REQUEST_KIND_CONCURRENCY = {'page': 16}
+
+# Backpressure on the API listings: the next page of a listing waits while
+# this many other requests are queued or downloading and items are in the
+# pipelines, until they're down to the low watermark, so the queue doesn't
+# grow with the size of the library. 0 to fetch listings as fast as they come.
+SEARCHBOX_BACKPRESSURE_HIGH = 500
+SEARCHBOX_BACKPRESSURE_LOW = 250
+
+SCHEDULER = 'searchbox.scheduling.KindAwareScheduler'
+
+# Adaptive refresh of READMEs and web pages, see searchbox/refresh.py. When
+# each page was fetched and changed is kept in this file in the project data
+# directory, empty to fetch every page on every crawl.
+SEARCHBOX_REFRESH_FILE = 'page_history.sqlite'
+# Request kinds that are refreshed adaptively, the rest are always made
+SEARCHBOX_REFRESH_KINDS = ['readme', 'page']
+# Seconds until a page is due again: from the minimum, multiplied by the
+# backoff every time it's found unchanged, divided by it when it's changed
+SEARCHBOX_REFRESH_MIN_INTERVAL = 24 * 3600
+SEARCHBOX_REFRESH_MAX_INTERVAL = 90 * 24 * 3600
+SEARCHBOX_REFRESH_BACKOFF = 2.0
+# Most README and page requests a spider makes in a crawl, 0 for no limit
+SEARCHBOX_CRAWL_BUDGET = 0
+
+# Deleting what's been unstarred, unbookmarked or unliked, see
+# searchbox/reconcile.py. What each spider found in its crawls is kept in this
+# file in the project data directory, empty to never delete anything.
+SEARCHBOX_LIVE_URLS_FILE = 'live_urls.sqlite'
+# A crawl that finds more than this share of a spider's sources gone deletes
+# nothing, that's more likely a problem with the API
+SEARCHBOX_RECONCILE_MAX_DELETE_RATIO = 0.5
+
+# Resumable crawls, see searchbox/jobs.py. crawl.py gives every spider a
+# JOBDIR under this directory of the project data directory, with its queue,
+# seen requests and listing cursors, so an interrupted crawl continues where
+# it stopped. Empty to always start from scratch.
+SEARCHBOX_JOBS_DIR = 'jobs'
+
+# Parallel crawls (crawl.py --workers), see searchbox/workers.py. Request
+# fingerprints shared by the worker processes, in the project data directory
+SEARCHBOX_SEEN_REQUESTS_FILE = 'seen_requests.sqlite'
+# Items waiting for the elasticsearch writer process, workers wait when it's
+# full
+SEARCHBOX_WRITER_QUEUE_SIZE = 1000
+# Stats of the last parallel crawl, added up over the workers
+SEARCHBOX_STATS_FILE = 'crawl_stats.json'
+
+# Extract the page metadata (tags, published date) right when the spider
+# yields the item, and drop the page HTML there, instead of carrying the HTML
+# through the pipeline queues until CleanupPipeline
+SEARCHBOX_EXTRACT_METADATA_IN_CALLBACK = False
+
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #DOWNLOADER_MIDDLEWARES = {
@@ -62,6 +145,37 @@ SPIDER_MIDDLEWARES = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
 #}
 
+EXTENSIONS = {
+    'searchbox.instrumentation.StageTimingExtension': 0,
+    'searchbox.throttle.AdaptiveConcurrencyExtension': 0,
+}
+
+# Adjust concurrency and delays per host (see searchbox/throttle.py): more
+# requests in parallel for hosts that answer fast, fewer and slower on errors.
+# Replaces AutoThrottle.
+SEARCHBOX_ADAPTIVE_CONCURRENCY = True
+# Starting concurrency, the most the controller can raise it to, and the
+# minimum delay between requests, for hosts and their subdomains. Hosts not
+# listed start at CONCURRENT_REQUESTS_PER_DOMAIN and DOWNLOAD_DELAY.
+SEARCHBOX_DOMAIN_PROFILES = {
+    'api.github.com': {'concurrency': 4, 'max_concurrency': 12},
+    'gitlab.com': {'concurrency': 2, 'max_concurrency': 6},
+    # Rate limited per 15 minute window
+    'api.twitter.com': {'concurrency': 1, 'max_concurrency': 2},
+}
+# Maximum for hosts without a profile
+SEARCHBOX_ADAPTIVE_MAX_CONCURRENCY = 4
+# Responses slower than this don't count towards raising concurrency
+SEARCHBOX_ADAPTIVE_TARGET_LATENCY = 1.0
+# Most we back off a host that keeps failing, in seconds
+SEARCHBOX_ADAPTIVE_MAX_DELAY = 60
+
+# Timing histograms for downloads per host, spider callbacks, body_text, the
+# pipelines and elasticsearch flushes. They're added to the crawl stats, and
+# written to .scrapy/timings/<spider>.json and .prom when the spider closes
+SEARCHBOX_TIMINGS_ENABLED = True
+SEARCHBOX_TIMINGS_DIR = 'timings'
+
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 #ITEM_PIPELINES = {
@@ -72,11 +186,90 @@ DEFAULT_ITEM_CLASS = 'searchbox.items.CrawlItem'
 
 ITEM_PIPELINES = {
     'searchbox.pipelines.SearchboxPipeline': 0,
+    'searchbox.pipelines.TagPipeline': 5,
+    # Before the hashes of SkipUnchangedPipeline, which include the text
+    'searchbox.documents.DocumentPipeline': 7,
     'searchbox.pipelines.CleanupPipeline': 10,
+    'searchbox.pipelines.SkipUnchangedPipeline': 15,
     'searchbox.pipelines.ConvertToItemPipeline': 20,
-    'scrapyelasticsearch.scrapyelasticsearch.ElasticSearchPipeline': 30
+    'searchbox.pipelines.LanguagePipeline': 25,
+    'searchbox.elastic.TimedElasticSearchPipeline': 30
+}
+
+# Index content and descriptions in languages other than English in fields of
+# their own, with the analysis for the language (see searchbox/language.py).
+# The mappings are created by `bin/query reset-index`.
+SEARCHBOX_DETECT_LANGUAGE = True
+
+# Index only the main content of web pages, without their navigation,
+# footers, banners and sidebars (see searchbox/content.py). Off by default,
+# the heuristic can leave out some of the text. With SEARCHBOX_KEEP_FULL_TEXT
+# the whole text is also indexed, as `full_content`.
+SEARCHBOX_MAIN_CONTENT = False
+SEARCHBOX_KEEP_FULL_TEXT = False
+
+# Index the text of the PDFs, Word and OpenDocument files pages link to (see
+# searchbox/documents.py). It's extracted in a pool of worker processes, from
+# documents up to the size in bytes, and from the first pages of PDFs. An
+# extraction taking longer than the timeout in seconds is given up.
+SEARCHBOX_EXTRACT_DOCUMENTS = True
+SEARCHBOX_DOCUMENT_WORKERS = 2
+SEARCHBOX_DOCUMENT_MAX_SIZE = 20 * 1024 * 1024
+SEARCHBOX_DOCUMENT_MAX_PAGES = 50
+SEARCHBOX_DOCUMENT_TIMEOUT = 30
+
+# Don't send items to elasticsearch if they haven't changed since the last time
+# they were indexed. Hashes are kept in .scrapy/searchbox, and are cleared by
+# `bin/query reset-index`
+SEARCHBOX_SKIP_UNCHANGED = True
+SEARCHBOX_INDEX_HASHES_FILE = 'index_hashes.db'
+# Unchanged items are re-sent anyway after this many seconds
+SEARCHBOX_SKIP_UNCHANGED_MAX_AGE = 30 * 24 * 3600
+
+# Tags from every source are mapped to canonical ones (see searchbox/tags.py)
+# by a vocabulary learned from the crawled items, kept in .scrapy/searchbox.
+# Empty to start from nothing on every crawl.
+SEARCHBOX_TAG_VOCABULARY_FILE = 'tag_vocabulary.sqlite'
+# Acronyms become aliases of their expansion after appearing next to it on
+# this many items, eg. 'ml' and 'machine_learning'
+SEARCHBOX_TAG_ALIAS_MIN_COOCCURRENCE = 3
+# Aliases that don't need to be learned, normalised tag to canonical tag
+SEARCHBOX_TAG_ALIASES = {
+    'ml': 'machine_learning',
+    'ai': 'artificial_intelligence',
+    'js': 'javascript',
+    'ts': 'typescript',
+    'k8s': 'kubernetes',
+    'golang': 'go',
+    'py': 'python',
+    'postgresql': 'postgres',
 }
 
+# Similarity search (`bin/query sim`, see searchbox/vectors.py). The vector
+# index is built by `bin/query build-vectors`, in this directory of the
+# project data directory
+SEARCHBOX_VECTORS_DIR = 'vectors'
+# Clusters of the index searched for every query, more is slower but misses
+# fewer neighbours
+SEARCHBOX_VECTOR_NPROBE = 8
+# Nearest neighbours re-ranked with their elasticsearch (BM25) scores
+SEARCHBOX_VECTOR_CANDIDATES = 100
+# Weight of the vector similarity against the BM25 score when re-ranking
+SEARCHBOX_VECTOR_WEIGHT = 0.7
+# Documents read from elasticsearch, and embedded, at a time
+SEARCHBOX_VECTOR_BATCH_SIZE = 500
+
+# Dictionary of the indexed words for `bin/query complete` and to correct
+# query terms (see searchbox/terms.py), built by `bin/query build-terms` in
+# the project data directory. Empty to always use fuzzy queries.
+SEARCHBOX_TERMS_FILE = 'terms.sqlite'
+# Words that appear fewer times, most of them typos, aren't completions or
+# corrections, but they're still left alone in queries
+SEARCHBOX_TERMS_MIN_COUNT = 2
+
+# Log unchanged items at DEBUG level instead of as dropped items
+LOG_FORMATTER = 'searchbox.logformatter.SearchboxLogFormatter'
+
 def get_elastic_url() -> str:
     from .secrets_loader import get_elastic_authenticated_url
     return get_elastic_authenticated_url()
@@ -92,7 +285,9 @@ ELASTICSEARCH_BUFFER_LENGTH = 20
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-AUTOTHROTTLE_ENABLED = True
+# Disabled in favour of SEARCHBOX_ADAPTIVE_CONCURRENCY, enable it only if
+# that's disabled, they would both be adjusting the same delays
+AUTOTHROTTLE_ENABLED = False
 # The initial download delay
 AUTOTHROTTLE_START_DELAY = 0.1
 # The maximum download delay to be set in case of high latencies
@@ -107,9 +302,17 @@ AUTOTHROTTLE_DEBUG = True
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 HTTPCACHE_ENABLED = True
 HTTPCACHE_POLICY = 'scrapy.extensions.httpcache.RFC2616Policy'
-#HTTPCACHE_EXPIRATION_SECS = 0
+# Default for pages, spiders set shorter ones for API responses with
+# `httpcache_expiration_rules`
+HTTPCACHE_EXPIRATION_SECS = 30 * 24 * 3600
 #HTTPCACHE_DIR = 'httpcache'
 #HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+# Compressed responses in a single SQLite file, see `bin/httpcache` to inspect
+# and compact it
+HTTPCACHE_STORAGE = 'searchbox.httpcache.SqliteCacheStorage'
+# zstd (if zstandard is installed, otherwise gzip), gzip or none
+SEARCHBOX_HTTPCACHE_COMPRESSION = 'zstd'
+# Least recently used responses are evicted above this size, in bytes
+SEARCHBOX_HTTPCACHE_MAX_SIZE = 2 * 1024 * 1024 * 1024
 
 LOG_LEVEL = 'WARNING'
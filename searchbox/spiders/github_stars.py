@@ -12,6 +12,7 @@ from ..types import SpiderItems, SpiderRequests, SpiderResults
 from ..extractors import (body_text, extract_next_page_link, fix_url,
                           is_processable)
 from ..items import CrawlItem
+from ..scheduling import API, LISTING, PAGE, README
 from ..secrets_loader import SECRETS
 
 usernames = SECRETS.github['users_to_crawl']
@@ -53,25 +54,37 @@ class GithubStarsSpider(scrapy.Spider):  # type: ignore
 
     handle_httpstatus_list = [x for x in range(400, 600)]
 
+    # READMEs change less often than the rest of the API data
+    httpcache_expiration_rules = [
+        (r'^https://api\.github\.com/repos/[^/]+/[^/]+/readme$', 7 * 24 * 3600),
+        (r'^https://api\.github\.com/', 6 * 3600),
+    ]
+
     def get_url_matcher(self) -> Callable[[Request], SpiderRequests]:
         return GithubURLMatcher(self)
 
     def start_requests(self) -> SpiderRequests:
         # Starred gists are only provided for the authenticated in user
-        yield self._api_request('https://api.github.com/gists/starred', self.parse_gist_stars)
+        req = self._api_request('https://api.github.com/gists/starred', self.parse_gist_stars, kind=LISTING)
+        req.meta['listing'] = 'gists'
+        yield req
 
-        urls = ['https://api.github.com/users/{}/starred'.format(name) for name in usernames]
-        for url in urls:
-            yield self._api_request(url, self.parse_stars)
+        for name in usernames:
+            url = 'https://api.github.com/users/{}/starred'.format(name)
+            req = self._api_request(url, self.parse_stars, kind=LISTING)
+            # Named for resumed crawls, see searchbox/jobs.py
+            req.meta['listing'] = 'stars:{}'.format(name)
+            yield req
 
     def _api_request(self, url: str, callback: Callable[[Response], SpiderResults],
-                      item: Optional[CrawlItem] = None) -> JsonRequest:
+                      item: Optional[CrawlItem] = None, kind: str = API) -> JsonRequest:
         req = JsonRequest(url=url, callback=callback)
         req.headers['Accept'] = 'application/vnd.github+json'
         req.headers['X-GitHub-Api-Version'] = "2022-11-28"
 
         # API call, don't need to check robots
         req.meta['dont_obey_robotstxt'] = True
+        req.meta['request_kind'] = kind
         if item is not None:
             req.meta['item'] = item
         return req
@@ -98,7 +111,10 @@ class GithubStarsSpider(scrapy.Spider):  # type: ignore
 
         next_page_url = extract_next_page_link(response.headers)
         if next_page_url is not None:
-            yield self._api_request(next_page_url, self.parse_stars)
+            req = self._api_request(next_page_url, self.parse_stars, kind=LISTING)
+            req.meta['listing'] = response.meta.get('listing')
+            req.meta['cursor'] = next_page_url
+            yield req
 
     def parse_readme(self, response: Response) -> SpiderItems:
         if is_processable(response):
@@ -134,6 +150,7 @@ class GithubStarsSpider(scrapy.Spider):  # type: ignore
         readme_req = scrapy.Request(url=readme_url, callback=self.parse_readme, headers={"Accept": "application/vnd.github.v3.html"})
 
         readme_req.meta['url'] = star_item.url
+        readme_req.meta['request_kind'] = README
         yield readme_req
         
         if 'homepage' in item:
@@ -141,6 +158,7 @@ class GithubStarsSpider(scrapy.Spider):  # type: ignore
             if homepage_url:
                 req = scrapy.Request(url=homepage_url, callback=self.parse_homepage)
                 req.meta['github_url'] = star_item.url
+                req.meta['request_kind'] = PAGE
                 yield req
 
     def parse_gist_stars(self, response: Response) -> SpiderResults:
@@ -157,7 +175,10 @@ class GithubStarsSpider(scrapy.Spider):  # type: ignore
 
         next_page_url = extract_next_page_link(response.headers)
         if next_page_url is not None:
-            yield self._api_request(next_page_url, self.parse_gist_stars)
+            req = self._api_request(next_page_url, self.parse_gist_stars, kind=LISTING)
+            req.meta['listing'] = response.meta.get('listing')
+            req.meta['cursor'] = next_page_url
+            yield req
 
     def parse_gist(self, response: Response) -> SpiderResults:
         star_item: CrawlItem = response.meta['item']
@@ -184,6 +205,7 @@ class GithubStarsSpider(scrapy.Spider):  # type: ignore
         if html_url:
             html_req = scrapy.Request(url=html_url, callback=self.parse_gist_html)
             html_req.meta['url'] = star_item.url
+            html_req.meta['request_kind'] = README
             yield html_req
 
     def parse_gist_html(self, response: Response) -> SpiderItems:
@@ -11,10 +11,10 @@ from scrapy.http import JsonRequest, TextResponse
 
 from ..types import SpiderItems, SpiderRequests, SpiderResults
 
-from ..extractors import (body_text, extract_next_page_link, fix_url,
-                          get_links_from_markdown, get_text_from_html,
-                          get_text_from_markdown, is_processable)
+from ..extractors import (body_text, extract_markdown, extract_next_page_link,
+                          fix_url, get_text_from_html, is_processable)
 from ..items import CrawlItem
+from ..scheduling import API, LISTING, PAGE, README
 from ..secrets_loader import SECRETS
 
 usernames = SECRETS.gitlab['users_to_crawl']
@@ -43,6 +43,10 @@ class GitlabStarsSpider(scrapy.Spider):  # type: ignore
     name = 'gitlab_stars'
     handle_httpstatus_list = [x for x in range(400, 600)]
 
+    httpcache_expiration_rules = [
+        (r'^https://gitlab\.com/api/', 6 * 3600),
+    ]
+
     def get_url_matcher(self) -> Callable[[scrapy.Request], SpiderRequests]:
         return GitlabURLMatcher(self)
 
@@ -51,6 +55,7 @@ class GitlabStarsSpider(scrapy.Spider):  # type: ignore
         req.headers['PRIVATE-TOKEN'] = token
         # API call, don't need to check robots
         req.meta['dont_obey_robotstxt'] = True
+        req.meta['request_kind'] = API
 
         for k, v in meta.items():
             req.meta[k] = v
@@ -61,7 +66,7 @@ class GitlabStarsSpider(scrapy.Spider):  # type: ignore
         for username in usernames:
             template = 'https://gitlab.com/api/v4/users?username={}'
             url = template.format(username)
-            yield self._prepare_json_request(url, self.parse_user)
+            yield self._prepare_json_request(url, self.parse_user, meta={'request_kind': LISTING})
 
     def parse_user(self, response: Response) -> SpiderRequests:
         if not is_processable(response, process_cached=True):
@@ -71,7 +76,10 @@ class GitlabStarsSpider(scrapy.Spider):  # type: ignore
         for user in users:
             template = 'https://gitlab.com/api/v4/users/{}/starred_projects?per_page=1'
             url = template.format(user['id'])
-            yield self._prepare_json_request(url, self.parse_stars)
+            # Named for resumed crawls, see searchbox/jobs.py
+            yield self._prepare_json_request(url, self.parse_stars,
+                                             meta={'request_kind': LISTING,
+                                                   'listing': 'stars:{}'.format(user['id'])})
 
     def parse_stars(self, response: TextResponse) -> SpiderResults:
         if not is_processable(response, process_cached=True):
@@ -81,7 +89,10 @@ class GitlabStarsSpider(scrapy.Spider):  # type: ignore
             next_page_url = extract_next_page_link(response.headers)
             if next_page_url is not None:
                 yield self._prepare_json_request(next_page_url,
-                                                 self.parse_stars)
+                                                 self.parse_stars,
+                                                 meta={'request_kind': LISTING,
+                                                       'listing': response.meta.get('listing'),
+                                                       'cursor': next_page_url})
         except Exception as e:
             logging.log(logging.ERROR, 'Failed to get next page url', e)
 
@@ -105,12 +116,8 @@ class GitlabStarsSpider(scrapy.Spider):  # type: ignore
     def _parse_repo_details(self, response: TextResponse, starred: Dict[str, Any]) -> SpiderResults:
         web_url = response.meta.get('url') or starred['web_url']
         name = starred['name']
-        description_md = starred['description']
-        if description_md:
-            description = get_text_from_markdown(response, description_md)
-        else:
-            description = ''
-        star_item = CrawlItem(name=name, description=description,
+        description_md = extract_markdown(response, starred['description'])
+        star_item = CrawlItem(name=name, description=description_md.text,
                               url=web_url)
 
         if 'last_activity_at' in starred:
@@ -126,14 +133,16 @@ class GitlabStarsSpider(scrapy.Spider):  # type: ignore
             readme_req = scrapy.Request(url=url,
                                         callback=self.parse_readme)
             readme_req.meta['url'] = star_item.url
+            readme_req.meta['request_kind'] = README
             yield readme_req
 
-        for homepage in get_links_from_markdown(response, description_md):
+        for homepage in description_md.links:
             homepage_url = fix_url(homepage)
             if homepage_url:
                 req = scrapy.Request(url=homepage_url,
                                      callback=self.parse_homepage)
                 req.meta['gitlab_url'] = star_item.url
+                req.meta['request_kind'] = PAGE
                 yield req
 
     def parse_readme(self, response: TextResponse) -> SpiderItems:
@@ -1,8 +1,7 @@
 # -*- coding: utf-8 -*-
 import json
-import re
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict
 from urllib.parse import urlencode
 
 import scrapy
@@ -13,6 +12,7 @@ from ..types import SpiderItems, SpiderRequests, SpiderResults
 
 from ..extractors import body_text, is_processable
 from ..items import CrawlItem
+from ..scheduling import LISTING, PAGE
 from ..secrets_loader import SECRETS
 
 RESULTS_PER_REQUEST = 50
@@ -24,6 +24,10 @@ class PocketSpider(scrapy.Spider):  # type: ignore
     consumer_key = SECRETS.pocket['consumer_key']
     access_token = SECRETS.pocket['access_token']
 
+    httpcache_expiration_rules = [
+        (r'^https://getpocket\.com/v3/', 3600),
+    ]
+
     def start_requests(self) -> SpiderRequests:
         yield self.make_pocket_request()
 
@@ -45,7 +49,10 @@ class PocketSpider(scrapy.Spider):  # type: ignore
         items = result['list']
         for key in sorted(items.keys()):
             item = items[key]
-            
+            # Deleted, there until the API stops returning it
+            if item.get('status') == '2':
+                continue
+
             name = item.get('resolved_title') or item.get('given_title')
             description = item.get('excerpt')
             last_update = datetime.fromtimestamp(int(item['time_added'])).isoformat()
@@ -59,23 +66,23 @@ class PocketSpider(scrapy.Spider):  # type: ignore
             if alt_url == url:
                 alt_url = None
                 
-            if 'tags' in item:
-                tags = [' '.join(re.split('_|-', item)) for item in list(item['tags'].keys())]
-            else:
-                tags = None
+            # Normalised with the rest by TagPipeline
+            tags = list(item['tags'].keys()) if 'tags' in item else None
 
             yield CrawlItem(name=name, description=description, last_update=last_update, url=url, alt_url=alt_url, pocket_tags=tags or list())
             req = scrapy.Request(url=url, callback=self.parse_webpage)
             # Save original URL, in case of redirects, since it's the key of the item
             req.meta['url'] = url
+            req.meta['request_kind'] = PAGE
             yield req
             
         if len(items) > 0:
-            yield self.make_pocket_request(response)
+            yield self.make_pocket_request(response.meta['next_offset'])
+
+    def resume_listing(self, request: Request, cursor: Any) -> Request:
+        return self.make_pocket_request(int(cursor))
 
-    def make_pocket_request(self, previous_page: Optional[Response] = None) -> Request:
-        offset = 0 if previous_page is None else previous_page.meta['next_offset']
-        
+    def make_pocket_request(self, offset: int = 0) -> Request:
         post_data = {'consumer_key': PocketSpider.consumer_key,
                      'access_token': PocketSpider.access_token,
                      'count': RESULTS_PER_REQUEST,
@@ -92,6 +99,11 @@ class PocketSpider(scrapy.Spider):  # type: ignore
         req.meta['next_offset'] = offset + RESULTS_PER_REQUEST
         # The pocket API is not crawlable, but we're not really crawling
         req.meta['dont_obey_robotstxt'] = True
+        req.meta['request_kind'] = LISTING
+        # Named for resumed crawls, see searchbox/jobs.py
+        req.meta['listing'] = 'bookmarks'
+        if offset > 0:
+            req.meta['cursor'] = offset
         return req
 
 
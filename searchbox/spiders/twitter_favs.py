@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import Optional
+from typing import Any, Optional
 import scrapy
 from scrapy.core.engine import Response
 from scrapy.http import Request
@@ -11,6 +11,7 @@ from ..types import SpiderItems, SpiderRequests, SpiderResults
 from ..secrets_loader import SECRETS
 from ..extractors import body_text, is_processable, try_parse_date
 from ..items import CrawlItem
+from ..scheduling import LISTING, PAGE
 
 RESULTS_PER_REQUEST = 100
 
@@ -23,6 +24,10 @@ class TwitterFavsSpider(scrapy.Spider):  # type: ignore
     access_token_key = SECRETS.twitter['access_token_key']
     access_token_secret = SECRETS.twitter['access_token_secret']
 
+    httpcache_expiration_rules = [
+        (r'^https://api\.twitter\.com/', 3600),
+    ]
+
     def start_requests(self) -> SpiderRequests:
         yield self.make_favourites_request()
 
@@ -43,8 +48,17 @@ class TwitterFavsSpider(scrapy.Spider):  # type: ignore
         req = Request(url=final_url, callback=self.parse_favourites)
         # This is an authorised API call we don't need to check robots.txt
         req.meta['dont_obey_robotstxt'] = True
+        req.meta['request_kind'] = LISTING
+        # Named for resumed crawls, see searchbox/jobs.py. Requests are
+        # signed when they're made, resumed ones get a new signature.
+        req.meta['listing'] = 'favourites'
+        if max_id is not None:
+            req.meta['cursor'] = max_id
         return req
 
+    def resume_listing(self, request: Request, cursor: Any) -> Request:
+        return self.make_favourites_request(max_id=int(cursor))
+
     def parse_favourites(self, response: Response) -> SpiderResults:
         if not is_processable(response):
             return
@@ -75,6 +89,7 @@ class TwitterFavsSpider(scrapy.Spider):  # type: ignore
                 # Tracked in case we follow redirects
                 req.meta['url'] = final_url
                 req.meta['twitter_url'] = url
+                req.meta['request_kind'] = PAGE
                 yield req
 
 
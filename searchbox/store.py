@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+
+# Local state that has to survive between crawls. Everything lives in SQLite
+# files under the Scrapy project data directory (.scrapy/searchbox), in WAL
+# mode so separate crawl processes can share them.
+
+import json
+import os
+import sqlite3
+from typing import Any, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from scrapy.utils.project import data_path
+
+
+def store_path(filename: str) -> str:
+    if os.path.isabs(filename):
+        return filename
+    return os.path.join(data_path('searchbox', createdir=True), filename)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+# Every write is committed right away. An open transaction holds the
+# database's write lock, and with batched commits the worker processes of a
+# parallel crawl spend their time waiting for each other. In WAL mode with
+# synchronous=NORMAL a commit doesn't sync to disk, and takes microseconds.
+class _Store(object):
+    def __init__(self, path: str) -> None:
+        self.connection = connect(path)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class IndexHashStore(_Store):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS index_hashes ('
+            'key TEXT PRIMARY KEY, hash TEXT NOT NULL, indexed_at REAL NOT NULL)'
+        )
+        self.connection.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        row = self.connection.execute(
+            'SELECT hash, indexed_at FROM index_hashes WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return (row[0], row[1])
+
+    def put(self, key: str, content_hash: str, indexed_at: float) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO index_hashes (key, hash, indexed_at) VALUES (?, ?, ?)',
+            (key, content_hash, indexed_at)
+        )
+        self.connection.commit()
+
+    def forget(self, url: str) -> None:
+        # Keys are the URL and the item's fields, see SkipUnchangedPipeline
+        self.connection.execute(
+            'DELETE FROM index_hashes WHERE key >= ? AND key < ?', (url + ' ', url + '!')
+        )
+        self.connection.commit()
+
+    def clear(self) -> None:
+        self.connection.execute('DELETE FROM index_hashes')
+        self.connection.commit()
+
+
+# Fingerprints of the requests made during a crawl, shared by the worker
+# processes of a parallel crawl (see searchbox/workers.py). Fingerprints are
+# kept per namespace, the spider name, since the same URL requested by two
+# spiders gives two different items (eg. with a different backlink).
+class SeenRequestStore(_Store):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS seen_requests ('
+            'namespace TEXT NOT NULL, fingerprint TEXT NOT NULL, '
+            'PRIMARY KEY (namespace, fingerprint)) WITHOUT ROWID'
+        )
+        self.connection.commit()
+
+    def add(self, namespace: str, fingerprint: str) -> bool:
+        # False if it was already there
+        cursor = self.connection.execute(
+            'INSERT OR IGNORE INTO seen_requests (namespace, fingerprint) VALUES (?, ?)',
+            (namespace, fingerprint)
+        )
+        self.connection.commit()
+        return cursor.rowcount > 0
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        if namespace is None:
+            self.connection.execute('DELETE FROM seen_requests')
+        else:
+            self.connection.execute('DELETE FROM seen_requests WHERE namespace = ?', (namespace,))
+        self.connection.commit()
+
+
+# Where each listing of a resumable crawl (see searchbox/jobs.py) got to: the
+# cursor of the next page to fetch (a URL, an offset, a tweet id), or done
+# once its last page has been processed.
+class CursorStore(_Store):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS cursors ('
+            'listing TEXT PRIMARY KEY, cursor TEXT, done INTEGER NOT NULL DEFAULT 0)'
+        )
+        self.connection.commit()
+
+    def get(self, listing: str) -> Optional[Tuple[Any, bool]]:
+        row = self.connection.execute(
+            'SELECT cursor, done FROM cursors WHERE listing = ?', (listing,)
+        ).fetchone()
+        if row is None:
+            return None
+        return (json.loads(row[0]) if row[0] is not None else None, bool(row[1]))
+
+    def put(self, listing: str, cursor: Any) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO cursors (listing, cursor, done) VALUES (?, ?, 0)',
+            (listing, json.dumps(cursor))
+        )
+        self.connection.commit()
+
+    def finish(self, listing: str) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO cursors (listing, cursor, done) VALUES (?, NULL, 1)', (listing,)
+        )
+        self.connection.commit()
+
+    def is_empty(self) -> bool:
+        return self.connection.execute('SELECT 1 FROM cursors LIMIT 1').fetchone() is None
+
+    def clear(self) -> None:
+        self.connection.execute('DELETE FROM cursors')
+        self.connection.commit()
+
+
+class PageHistory(NamedTuple):
+    content_hash: str
+    # Seconds between checks, and when the page was last checked, last found
+    # changed and is due again
+    interval: float
+    checked_at: float
+    changed_at: float
+    due_at: float
+
+
+# When each README and web page was fetched and changed, for the adaptive
+# refresh in searchbox/refresh.py
+class PageHistoryStore(_Store):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS page_history ('
+            'url TEXT PRIMARY KEY, hash TEXT NOT NULL, interval REAL NOT NULL, '
+            'checked_at REAL NOT NULL, changed_at REAL NOT NULL, due_at REAL NOT NULL)'
+        )
+        self.connection.commit()
+
+    def get(self, url: str) -> Optional[PageHistory]:
+        row = self.connection.execute(
+            'SELECT hash, interval, checked_at, changed_at, due_at FROM page_history WHERE url = ?',
+            (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        return PageHistory(*row)
+
+    def put(self, url: str, history: PageHistory) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO page_history '
+            '(url, hash, interval, checked_at, changed_at, due_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (url, *history)
+        )
+        self.connection.commit()
+
+    def forget(self, url: str) -> None:
+        self.connection.execute('DELETE FROM page_history WHERE url = ?', (url,))
+        self.connection.commit()
+
+    def clear(self) -> None:
+        self.connection.execute('DELETE FROM page_history')
+        self.connection.commit()
+
+
+# What each spider found in its crawls, for deleting what's been unstarred,
+# unbookmarked or unliked (see searchbox/reconcile.py). Every URL a spider
+# gave an item for is kept with its source, the star, bookmark or like it came
+# from, and the last crawl (a generation, counted per spider) that found it.
+# Each generation also tracks which shards finished, and the listings each of
+# them started and got to the end of.
+class LiveURLStore(_Store):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS generations ('
+            'spider TEXT PRIMARY KEY, generation INTEGER NOT NULL, shards INTEGER NOT NULL, '
+            'open INTEGER NOT NULL)'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS finished_shards ('
+            'spider TEXT NOT NULL, generation INTEGER NOT NULL, shard INTEGER NOT NULL, '
+            'PRIMARY KEY (spider, generation, shard)) WITHOUT ROWID'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS listings ('
+            'spider TEXT NOT NULL, generation INTEGER NOT NULL, shard INTEGER NOT NULL, '
+            'listing TEXT NOT NULL, done INTEGER NOT NULL, '
+            'PRIMARY KEY (spider, generation, shard, listing)) WITHOUT ROWID'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS live_urls ('
+            'spider TEXT NOT NULL, url TEXT NOT NULL, source TEXT NOT NULL, seen INTEGER NOT NULL, '
+            'PRIMARY KEY (spider, source, url)) WITHOUT ROWID'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS live_urls_url ON live_urls (url)')
+        self.connection.commit()
+
+    def begin(self, spider: str, shards: int) -> int:
+        # The generation of a crawl: the open one, when the last crawl with
+        # the same shards didn't finish (or this is another of its shards),
+        # a new one otherwise
+        row = self.connection.execute(
+            'SELECT generation, shards, open FROM generations WHERE spider = ?', (spider,)
+        ).fetchone()
+        if row is not None and row[1] == shards and row[2]:
+            return int(row[0])
+        generation = row[0] + 1 if row is not None else 1
+        self.connection.execute(
+            'INSERT OR REPLACE INTO generations (spider, generation, shards, open) VALUES (?, ?, ?, 1)',
+            (spider, generation, shards)
+        )
+        self.connection.commit()
+        return int(generation)
+
+    def start_listing(self, spider: str, generation: int, shard: int, listing: str) -> None:
+        self.connection.execute(
+            'INSERT OR IGNORE INTO listings (spider, generation, shard, listing, done) VALUES (?, ?, ?, ?, 0)',
+            (spider, generation, shard, listing)
+        )
+        self.connection.commit()
+
+    def finish_listing(self, spider: str, generation: int, shard: int, listing: str) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO listings (spider, generation, shard, listing, done) VALUES (?, ?, ?, ?, 1)',
+            (spider, generation, shard, listing)
+        )
+        self.connection.commit()
+
+    def mark(self, spider: str, generation: int, urls: Iterable[Tuple[str, str]]) -> None:
+        # (url, source) pairs found in this generation
+        self.connection.executemany(
+            'INSERT INTO live_urls (spider, url, source, seen) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (spider, source, url) DO UPDATE SET seen = excluded.seen',
+            ((spider, url, source, generation) for url, source in urls)
+        )
+        self.connection.commit()
+
+    def finish_shard(self, spider: str, generation: int, shard: int) -> int:
+        # How many shards have finished now
+        self.connection.execute(
+            'INSERT OR IGNORE INTO finished_shards (spider, generation, shard) VALUES (?, ?, ?)',
+            (spider, generation, shard)
+        )
+        self.connection.commit()
+        row = self.connection.execute(
+            'SELECT COUNT(*) FROM finished_shards WHERE spider = ? AND generation = ?', (spider, generation)
+        ).fetchone()
+        return int(row[0])
+
+    def is_complete(self, spider: str, generation: int) -> bool:
+        # Whether every listing started got to its end
+        row = self.connection.execute(
+            'SELECT 1 FROM listings WHERE spider = ? AND generation = ? AND done = 0 LIMIT 1',
+            (spider, generation)
+        ).fetchone()
+        return row is None
+
+    def end(self, spider: str, generation: int) -> None:
+        with self.connection:
+            self.connection.execute(
+                'UPDATE generations SET open = 0 WHERE spider = ? AND generation = ?', (spider, generation))
+            for table in ('finished_shards', 'listings'):
+                self.connection.execute(
+                    'DELETE FROM {} WHERE spider = ? AND generation <= ?'.format(table), (spider, generation))
+
+    def sources(self, spider: str) -> int:
+        row = self.connection.execute(
+            'SELECT COUNT(*) FROM live_urls WHERE spider = ? AND url = source', (spider,)
+        ).fetchone()
+        return int(row[0])
+
+    def stale_sources(self, spider: str, generation: int) -> List[str]:
+        # Sources (the URLs that are their own source) not found since before
+        # this generation
+        rows = self.connection.execute(
+            'SELECT source FROM live_urls WHERE spider = ? AND url = source AND seen < ? ORDER BY source',
+            (spider, generation)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def orphans(self, spider: str, sources: List[str]) -> List[str]:
+        # The URLs of these sources that nothing else has
+        rows = self.connection.execute(
+            'SELECT DISTINCT d.url FROM live_urls d '
+            'WHERE d.spider = ? AND d.source IN (SELECT value FROM json_each(?)) '
+            'AND NOT EXISTS (SELECT 1 FROM live_urls o WHERE o.url = d.url '
+            'AND NOT (o.spider = d.spider AND o.source IN (SELECT value FROM json_each(?)))) '
+            'ORDER BY d.url',
+            (spider, json.dumps(sources), json.dumps(sources))
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def remove(self, spider: str, sources: List[str]) -> None:
+        self.connection.execute(
+            'DELETE FROM live_urls WHERE spider = ? AND source IN (SELECT value FROM json_each(?))',
+            (spider, json.dumps(sources))
+        )
+        self.connection.commit()
+
+
+# The tag vocabulary, see searchbox/tags.py: how many items had each tag, and
+# each acronym alongside its expansion
+class TagVocabularyStore(_Store):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS tags (tag TEXT PRIMARY KEY, count INTEGER NOT NULL)'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS tag_pairs ('
+            'short TEXT NOT NULL, expansion TEXT NOT NULL, count INTEGER NOT NULL, '
+            'PRIMARY KEY (short, expansion)) WITHOUT ROWID'
+        )
+        # The tags counted for each URL
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS item_tags ('
+            'url TEXT NOT NULL, tag TEXT NOT NULL, PRIMARY KEY (url, tag)) WITHOUT ROWID'
+        )
+        self.connection.commit()
+
+    def tags(self) -> List[Tuple[str, int]]:
+        return self.connection.execute('SELECT tag, count FROM tags').fetchall()
+
+    def pairs(self) -> List[Tuple[str, str, int]]:
+        return self.connection.execute('SELECT short, expansion, count FROM tag_pairs').fetchall()
+
+    def item_tags(self, url: str) -> Set[str]:
+        rows = self.connection.execute('SELECT tag FROM item_tags WHERE url = ?', (url,))
+        return {tag for tag, in rows}
+
+    def add(self, url: Optional[str], tags: Iterable[str], pairs: Iterable[Tuple[str, str]]) -> None:
+        tags = list(tags)
+        if url is not None:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO item_tags (url, tag) VALUES (?, ?)',
+                ((url, tag) for tag in tags)
+            )
+        self.connection.executemany(
+            'INSERT INTO tags (tag, count) VALUES (?, 1) '
+            'ON CONFLICT (tag) DO UPDATE SET count = count + 1',
+            ((tag,) for tag in tags)
+        )
+        self.connection.executemany(
+            'INSERT INTO tag_pairs (short, expansion, count) VALUES (?, ?, 1) '
+            'ON CONFLICT (short, expansion) DO UPDATE SET count = count + 1',
+            pairs
+        )
+        self.connection.commit()
+
+
+# The term dictionary of bin/query, see searchbox/terms.py: every word with
+# its frequency, the variants of each word with a character deleted, and the
+# best completions of short prefixes. It's rebuilt from scratch, not updated.
+class TermDictionaryStore(_Store):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        # Read by a short lived process, memory mapping skips copying pages
+        # into SQLite's own cache
+        self.connection.execute('PRAGMA mmap_size=268435456')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS term_deletes ('
+            'variant TEXT NOT NULL, term TEXT NOT NULL, PRIMARY KEY (variant, term)) WITHOUT ROWID'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS completions (prefix TEXT PRIMARY KEY, terms TEXT NOT NULL) WITHOUT ROWID'
+        )
+        self.connection.commit()
+
+    def replace(self, terms: Iterable[Tuple[str, int]], deletes: Iterable[Tuple[str, str]],
+                completions: Iterable[Tuple[str, List[str]]]) -> None:
+        with self.connection:
+            for table in ('terms', 'term_deletes', 'completions'):
+                self.connection.execute('DELETE FROM {}'.format(table))
+            self.connection.executemany('INSERT INTO terms (term, count) VALUES (?, ?)', terms)
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO term_deletes (variant, term) VALUES (?, ?)', deletes)
+            self.connection.executemany(
+                'INSERT INTO completions (prefix, terms) VALUES (?, ?)',
+                ((prefix, json.dumps(words)) for prefix, words in completions))
+
+    def count(self, term: str) -> Optional[int]:
+        row = self.connection.execute('SELECT count FROM terms WHERE term = ?', (term,)).fetchone()
+        return None if row is None else int(row[0])
+
+    def candidates(self, variants: List[str], min_count: int) -> List[Tuple[str, int]]:
+        # Words that are one of the variants, or have one of them as a delete
+        marks = ','.join('?' * len(variants))
+        return self.connection.execute(
+            'SELECT term, count FROM terms WHERE term IN ({0}) AND count >= ? UNION '
+            'SELECT t.term, t.count FROM term_deletes d JOIN terms t ON t.term = d.term '
+            'WHERE d.variant IN ({0}) AND t.count >= ?'.format(marks),
+            variants + [min_count] + variants + [min_count]
+        ).fetchall()
+
+    def completions(self, prefix: str) -> Optional[List[str]]:
+        row = self.connection.execute('SELECT terms FROM completions WHERE prefix = ?', (prefix,)).fetchone()
+        return None if row is None else list(json.loads(row[0]))
+
+    def starting_with(self, prefix: str, size: int, min_count: int) -> List[str]:
+        # The most frequent words in the range of those with the prefix
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self.connection.execute(
+            'SELECT term FROM terms WHERE term >= ? AND term < ? AND count >= ? ORDER BY count DESC, term LIMIT ?',
+            (prefix, end, min_count, size)
+        ).fetchall()
+        return [row[0] for row in rows]
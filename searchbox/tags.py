@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+# Tags come from everywhere: JSON-LD, RDFa, microdata and OpenGraph metadata
+# in pages, Pocket, Twitter hashtags and repository topics, each with its own
+# spelling of the same thing ('Machine Learning', 'machine-learning',
+# 'MachineLearning', 'ml'). They're reconciled in two steps:
+#
+# - normalise_tag: lowercase, separators to underscores and brackets dropped
+#   in a single str.translate pass, minus the prefixes some sites put in
+#   front of tags ('topic:python').
+# - TagVocabulary: a vocabulary of the tags seen so far, built as items go
+#   through TagPipeline, that maps every normalised tag to a canonical one:
+#   * spellings that only differ in separators or dots ('node.js', 'nodejs')
+#     share a key, and the most common of them is the canonical tag. A
+#     leading dot is kept, '.net' isn't 'net';
+#   * a plural 's' shares the key of the singular once both spellings have
+#     been seen, so 'redis' doesn't become 'redi'. NOT_PLURALS are words
+#     ending in 's' that are tags of their own, 'news' isn't 'new';
+#   * acronyms seen alongside their expansion on enough items ('ml' and
+#     'machine_learning') become aliases of the expansion;
+#   * SEARCHBOX_TAG_ALIASES adds aliases by hand.
+#
+# Counts are the number of items with a tag, each URL's tags are counted
+# once however many times it's crawled again.
+#
+# Items are indexed with canonical tags, and every *_tags field is copied to
+# a single keyword field in the index (see bin/query.py reset-index), so
+# filters and aggregations see one vocabulary. Tags indexed before the
+# vocabulary learned an alias keep the old spelling until they're indexed
+# again.
+
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .store import TagVocabularyStore
+
+# Prefixes some sites use to namespace their tags, 'topic:python'
+TAG_PREFIXES = ('tag', 'section', 'topic', 'category', 'プラットフォーム', 'subject')
+
+_PREFIX = re.compile('^(?:{}):'.format('|'.join(re.escape(p) for p in TAG_PREFIXES)))
+_TRANSLATION = str.maketrans({' ': '_', '-': '_', '[': None, ']': None})
+_KEY_TRANSLATION = str.maketrans({'_': None, '.': None})
+
+# Tags that end in 's' without being the plural of another tag
+NOT_PLURALS = frozenset([
+    'analytics', 'economics', 'ethics', 'graphics', 'ios', 'kubernetes', 'linguistics', 'macos',
+    'mathematics', 'news', 'physics', 'politics', 'redis', 'robotics', 'series', 'statistics', 'windows',
+])
+
+
+@lru_cache(maxsize=16384)
+def normalise(tag: str) -> Optional[str]:
+    base_tag = _PREFIX.sub('', tag.strip().lower().translate(_TRANSLATION), count=1)
+    # Some sites use tags as general attributes, eg. lite:true, elevated:false,
+    # etc... we'll ignore those
+    if ':' in base_tag:
+        return None
+    return base_tag.strip('_') or None
+
+
+def normalise_tag(tag_source: Optional[str]) -> Iterable[str]:
+    if tag_source is None:
+        return
+    tag = normalise(tag_source)
+    if tag is not None:
+        yield tag
+
+
+@lru_cache(maxsize=16384)
+def tag_key(tag: str) -> str:
+    # The same for spellings that only differ in separators or dots
+    key = tag.translate(_KEY_TRANSLATION)
+    if tag.startswith('.'):
+        key = '.' + key
+    return key
+
+
+def singular_key(key: str) -> Optional[str]:
+    # The key of the singular, if the key could be a plural
+    if len(key) > 3 and key.endswith('s') and not key.endswith('ss') and key not in NOT_PLURALS:
+        return key[:-1]
+    return None
+
+
+def acronym(tag: str) -> Optional[str]:
+    words = [w for w in tag.split('_') if w]
+    if len(words) < 2:
+        return None
+    return ''.join(w[0] for w in words)
+
+
+class TagVocabulary(object):
+    def __init__(self, aliases: Dict[str, str], min_cooccurrence: int,
+                 store: Optional[TagVocabularyStore] = None) -> None:
+        self.manual_aliases = {normalise(k) or k: normalise(v) or v for k, v in aliases.items()}
+        self.min_cooccurrence = min_cooccurrence
+        self.store = store
+        self.counts: Dict[str, int] = {}
+        # Canonical spelling of each key
+        self.spellings: Dict[str, str] = {}
+        self.pairs: Dict[Tuple[str, str], int] = {}
+        self.learned_aliases: Dict[str, str] = {}
+        # The tags counted for each URL, when there's no store to keep them
+        self.item_tags: Dict[str, Set[str]] = {}
+
+        if store is not None:
+            for tag, count in store.tags():
+                self._count(tag, count)
+            for short, expansion, count in store.pairs():
+                self._pair(short, expansion, count)
+
+    def _key(self, tag: str) -> str:
+        key = tag_key(tag)
+        if key in self.spellings:
+            return key
+        singular = singular_key(key)
+        if singular is not None and singular in self.spellings:
+            return singular
+        if singular_key(key + 's') == key and key + 's' in self.spellings:
+            return key + 's'
+        return key
+
+    def _count(self, tag: str, increment: int) -> None:
+        count = self.counts.get(tag, 0) + increment
+        self.counts[tag] = count
+        key = self._key(tag)
+        current = self.spellings.get(key)
+        if current is None or count > self.counts.get(current, 0):
+            self.spellings[key] = tag
+
+    def _pair(self, short: str, expansion: str, increment: int) -> None:
+        count = self.pairs.get((short, expansion), 0) + increment
+        self.pairs[(short, expansion)] = count
+        if count >= self.min_cooccurrence and short not in self.learned_aliases:
+            self.learned_aliases[short] = expansion
+
+    def observe(self, url: Optional[str], tags: Iterable[str]) -> None:
+        # The normalised tags of one item, only those not counted for its
+        # URL already
+        unique = set(tags)
+        if url is None:
+            counted: Set[str] = set()
+        elif self.store is not None:
+            counted = self.store.item_tags(url)
+        else:
+            counted = self.item_tags.setdefault(url, set())
+        new = unique - counted
+        if not new:
+            return
+        for tag in new:
+            self._count(tag, 1)
+        pairs = [(short, tag) for tag in unique for short in [acronym(tag)]
+                 if short is not None and short in unique and (short in new or tag in new)]
+        for short, expansion in pairs:
+            self._pair(short, expansion, 1)
+
+        if self.store is not None:
+            self.store.add(url, new, pairs)
+        else:
+            counted.update(new)
+
+    def canonical(self, tag: str) -> str:
+        tag = self.manual_aliases.get(tag) or self.learned_aliases.get(tag) or tag
+        return self.spellings.get(self._key(tag), tag)
+
+    def canonical_tags(self, tags: Iterable[str]) -> List[str]:
+        result: List[str] = []
+        seen = set()
+        for tag in tags:
+            canonical = self.canonical(tag)
+            if canonical not in seen:
+                seen.add(canonical)
+                result.append(canonical)
+        return result
+
+    def close(self) -> None:
+        if self.store is not None:
+            self.store.close()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# A local dictionary of the words in the index, for bin/query. Query terms are
+# corrected before the query is sent, so it can be an exact query instead of
+# a fuzzy one, for which elasticsearch expands every term into all the indexed
+# terms within two edits of it. `bin/query complete PREFIX` completes words
+# from it.
+#
+# - The completions of prefixes of up to COMPLETION_PREFIX characters, the
+#   most frequent words that start with them, are computed when it's built.
+#   Fewer words start with longer prefixes, and those are read in order
+#   from the sorted words.
+# - Corrections use a SymSpell style index of deletes: every word is stored
+#   under each of its variants with one character less. A word that's not in
+#   the dictionary is looked up with its own variants, with up to two
+#   characters less for longer words. That finds every word within one edit
+#   (a transposition counts as one) and most within two, which are then
+#   ranked by edit distance and frequency.
+# - Every indexed word is known, and left as it is in queries. Words that
+#   appear fewer than SEARCHBOX_TERMS_MIN_COUNT times, most of them typos,
+#   are never offered as completions or corrections.
+#
+# The dictionary is kept in SQLite in .scrapy/searchbox, nothing is loaded
+# up front. It's built by `bin/query build-terms` from what's in
+# elasticsearch, run it again after crawling.
+
+import heapq
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .store import TermDictionaryStore
+
+COMPLETION_PREFIX = 3
+COMPLETIONS = 10
+# Longer tokens are identifiers, hashes and such
+MAX_WORD = 32
+
+_WORD = re.compile(r'[^\W\d_]\w*')
+# query_string operators are left as they are
+OPERATORS = frozenset(['AND', 'OR', 'NOT', 'TO'])
+
+
+def words(text: str) -> Iterator[str]:
+    for word in _WORD.findall(text.lower()):
+        if 1 < len(word) <= MAX_WORD:
+            yield word
+
+
+def max_distance(word: str) -> int:
+    # Stricter than the AUTO:2,6 fuzziness of the queries: a wrong correction
+    # replaces the word, and words that aren't corrected keep the fuzzy query
+    if len(word) < 3:
+        return 0
+    if len(word) < 8:
+        return 1
+    return 2
+
+
+def deletes(word: str, distance: int) -> Set[str]:
+    result: Set[str] = set()
+    current = {word}
+    for _ in range(distance):
+        current = {w[:i] + w[i + 1:] for w in current for i in range(len(w))}
+        result.update(current)
+    return result
+
+
+def edit_distance(a: str, b: str) -> int:
+    # Optimal string alignment: insertions, deletions, substitutions and
+    # transpositions of adjacent characters
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def build(counts: Dict[str, int], min_count: int, store: TermDictionaryStore) -> int:
+    # Returns how many words are in the dictionary
+    terms = sorted(counts.items())
+    frequent = [(word, count) for word, count in terms if count >= min_count]
+
+    # Most frequent first, then alphabetically
+    by_prefix: Dict[str, List[Tuple[int, str]]] = {}
+    for word, count in frequent:
+        for length in range(1, min(COMPLETION_PREFIX, len(word)) + 1):
+            by_prefix.setdefault(word[:length], []).append((-count, word))
+
+    def delete_rows() -> Iterable[Tuple[str, str]]:
+        for word, _ in frequent:
+            if max_distance(word) > 0:
+                for variant in deletes(word, 1):
+                    yield variant, word
+
+    store.replace(terms, delete_rows(),
+                  ((prefix, [word for _, word in heapq.nsmallest(COMPLETIONS, entries)])
+                   for prefix, entries in by_prefix.items()))
+    return len(terms)
+
+
+class TermDictionary(object):
+    def __init__(self, store: TermDictionaryStore, min_count: int = 1) -> None:
+        self.store = store
+        self.min_count = min_count
+
+    def complete(self, prefix: str, size: int = COMPLETIONS) -> List[str]:
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        if len(prefix) <= COMPLETION_PREFIX:
+            return (self.store.completions(prefix) or [])[:size]
+        return self.store.starting_with(prefix, size, self.min_count)
+
+    def correct(self, word: str) -> Optional[str]:
+        # The word if it's known, the closest known word otherwise, None if
+        # there's none close enough
+        word = word.lower()
+        if self.store.count(word) is not None:
+            return word
+        distance = max_distance(word)
+        if distance == 0:
+            return None
+
+        variants = [word] + sorted(deletes(word, distance))
+        best: Optional[Tuple[int, int, str]] = None
+        for candidate, count in self.store.candidates(variants, self.min_count):
+            candidate_distance = edit_distance(word, candidate)
+            if candidate_distance <= distance:
+                ranking = (candidate_distance, -count, candidate)
+                if best is None or ranking < best:
+                    best = ranking
+        return None if best is None else best[2]
+
+    def correct_query(self, terms: List[str]) -> Tuple[List[str], bool]:
+        # The terms with every word corrected, and whether they're all known
+        # words now. Field names, operators and words with wildcards are
+        # left alone.
+        all_known = True
+
+        def fix(match: 're.Match[str]') -> str:
+            nonlocal all_known
+            text = match.group(0)
+            following = match.string[match.end():match.end() + 1]
+            if text in OPERATORS or following in (':', '*', '?', '~'):
+                return text
+            corrected = self.correct(text)
+            if corrected is None:
+                all_known = False
+                return text
+            return text if corrected == text.lower() else corrected
+
+        corrected = [_WORD.sub(fix, term) for term in terms]
+        return corrected, all_known
+
+    def close(self) -> None:
+        self.store.close()
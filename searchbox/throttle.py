@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+# Per-host download concurrency and delays, instead of the same
+# CONCURRENT_REQUESTS_PER_DOMAIN for everything. Every download slot (one per
+# host) starts from the profile of its domain in SEARCHBOX_DOMAIN_PROFILES, or
+# the defaults, and is then adjusted as responses come in: concurrency goes up
+# by one for hosts that keep answering fast while they have requests waiting,
+# and is halved on errors (connection failures, 429s and 5xx), when the delay
+# between requests is also doubled. Further fast responses bring the delay
+# back down before concurrency grows again.
+#
+# This replaces AutoThrottle, which adjusts the delay only, and with it keeps
+# every host at around AUTOTHROTTLE_TARGET_CONCURRENCY requests in flight.
+
+import logging
+from typing import Any, Dict, NamedTuple, Optional, Set, Type
+
+from scrapy import Request, Spider, signals
+from scrapy.core.downloader import Slot
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response
+
+logger = logging.getLogger(__name__)
+
+# Responses with these statuses mean the host wants us to slow down
+BACKOFF_STATUSES = {429, 500, 502, 503, 504, 520, 521, 522, 524}
+
+# Smallest delay we back off to, below it we go back to the profile's delay
+MIN_BACKOFF_DELAY = 0.25
+
+
+class DomainProfile(NamedTuple):
+    concurrency: int
+    max_concurrency: int
+    delay: float
+
+
+def find_profile(host: str, profiles: Dict[str, Dict[str, Any]], default: DomainProfile) -> DomainProfile:
+    # The host's own profile, or the closest parent domain's
+    labels = host.split('.')
+    for i in range(len(labels)):
+        overrides = profiles.get('.'.join(labels[i:]))
+        if overrides is not None:
+            concurrency = int(overrides.get('concurrency', default.concurrency))
+            return DomainProfile(
+                concurrency=concurrency,
+                max_concurrency=max(concurrency, int(overrides.get('max_concurrency', default.max_concurrency))),
+                delay=float(overrides.get('delay', default.delay)),
+            )
+    return default
+
+
+class SlotState(object):
+    def __init__(self, slot: Slot, profile: DomainProfile) -> None:
+        self.slot = slot
+        self.profile = profile
+        self.fast_responses = 0
+
+
+class AdaptiveConcurrency(object):
+    def __init__(self, target_latency: float, max_delay: float) -> None:
+        self.target_latency = target_latency
+        self.max_delay = max_delay
+
+    def success(self, state: SlotState, latency: float) -> bool:
+        # True if the slot was changed
+        slot = state.slot
+        if latency > self.target_latency:
+            state.fast_responses = 0
+            return False
+
+        state.fast_responses += 1
+        # Roughly one round of requests at the current concurrency
+        if state.fast_responses < slot.concurrency:
+            return False
+        state.fast_responses = 0
+
+        if slot.delay > state.profile.delay:
+            delay = slot.delay / 2
+            slot.delay = max(state.profile.delay, delay if delay >= MIN_BACKOFF_DELAY else 0.0)
+            return True
+        # Only when there are requests waiting for this host, the long tail
+        # of one-off domains stays where it started
+        if slot.queue and slot.concurrency < state.profile.max_concurrency:
+            slot.concurrency += 1
+            return True
+        return False
+
+    def error(self, state: SlotState) -> None:
+        slot = state.slot
+        state.fast_responses = 0
+        slot.concurrency = max(1, slot.concurrency // 2)
+        slot.delay = min(self.max_delay, max(slot.delay * 2, state.profile.delay, MIN_BACKOFF_DELAY))
+
+
+class AdaptiveConcurrencyExtension(object):
+    def __init__(self, crawler: Crawler, profiles: Dict[str, Dict[str, Any]],
+                 default: DomainProfile, controller: AdaptiveConcurrency) -> None:
+        self.crawler = crawler
+        self.profiles = profiles
+        self.default = default
+        self.controller = controller
+        self.states: Dict[str, SlotState] = {}
+        # Requests that got a response, the rest leave the downloader with
+        # an error
+        self.responded: Set[Request] = set()
+
+    @classmethod
+    def from_crawler(cls: Type['AdaptiveConcurrencyExtension'], crawler: Crawler) -> 'AdaptiveConcurrencyExtension':
+        settings = crawler.settings
+        if not settings.getbool('SEARCHBOX_ADAPTIVE_CONCURRENCY'):
+            raise NotConfigured
+        concurrency = settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+        default = DomainProfile(
+            concurrency=concurrency,
+            max_concurrency=max(concurrency, settings.getint('SEARCHBOX_ADAPTIVE_MAX_CONCURRENCY')),
+            delay=settings.getfloat('DOWNLOAD_DELAY'),
+        )
+        controller = AdaptiveConcurrency(settings.getfloat('SEARCHBOX_ADAPTIVE_TARGET_LATENCY'),
+                                         settings.getfloat('SEARCHBOX_ADAPTIVE_MAX_DELAY'))
+        ext = cls(crawler, settings.getdict('SEARCHBOX_DOMAIN_PROFILES'), default, controller)
+        crawler.signals.connect(ext.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(ext.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(ext.request_left_downloader, signal=signals.request_left_downloader)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def _state(self, request: Request) -> Optional[SlotState]:
+        assert self.crawler.engine is not None
+        key = request.meta.get('download_slot')
+        if key is None:
+            return None
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return None
+
+        state = self.states.get(key)
+        if state is None:
+            profile = find_profile(key.split(':')[0], self.profiles, self.default)
+            slot.concurrency = profile.concurrency
+            slot.delay = profile.delay
+            state = SlotState(slot, profile)
+            self.states[key] = state
+        elif state.slot is not slot:
+            # The downloader drops idle slots, keep what we learned when it
+            # makes a new one
+            slot.concurrency = state.slot.concurrency
+            slot.delay = state.slot.delay
+            state.slot = slot
+        return state
+
+    def request_reached_downloader(self, request: Request, spider: Spider) -> None:
+        self._state(request)
+
+    def response_downloaded(self, response: Response, request: Request, spider: Spider) -> None:
+        state = self._state(request)
+        if state is None:
+            return
+        self.responded.add(request)
+
+        if response.status in BACKOFF_STATUSES:
+            self._error(state, request, spider)
+            return
+
+        latency = request.meta.get('download_latency')
+        if latency is not None and self.controller.success(state, latency):
+            logger.debug('Slot %s: concurrency %d, delay %.2fs', request.meta.get('download_slot'),
+                         state.slot.concurrency, state.slot.delay, extra={'spider': spider})
+
+    def request_left_downloader(self, request: Request, spider: Spider) -> None:
+        if request in self.responded:
+            self.responded.discard(request)
+            return
+        state = self._state(request)
+        if state is not None:
+            self._error(state, request, spider)
+
+    def _error(self, state: SlotState, request: Request, spider: Spider) -> None:
+        self.controller.error(state)
+        assert self.crawler.stats is not None
+        self.crawler.stats.inc_value('adaptive_concurrency/backoff', spider=spider)
+        logger.debug('Slot %s backing off: concurrency %d, delay %.2fs', request.meta.get('download_slot'),
+                     state.slot.concurrency, state.slot.delay, extra={'spider': spider})
+
+    def spider_closed(self, spider: Spider) -> None:
+        assert self.crawler.stats is not None
+        # Hosts that ended up above their starting concurrency
+        for key, state in sorted(self.states.items()):
+            if state.slot.concurrency > state.profile.concurrency:
+                self.crawler.stats.set_value('adaptive_concurrency/{}'.format(key),
+                                             state.slot.concurrency, spider=spider)
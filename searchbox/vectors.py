@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+# Similarity search for `bin/query sim`, on the CPU and without a model or
+# extra dependencies.
+#
+# - Embeddings are hashed features: the words of an item's name, description
+#   and content, and the character trigrams of the longer ones (so 'parser'
+#   is close to 'parsing'), each hashed to one of DIMENSIONS signed buckets,
+#   with sublinear counts weighted by field, normalised to unit length.
+# - Vectors are quantised to one signed byte per dimension, with a scale per
+#   vector, a quarter of the size of floats.
+# - The index is an IVF (inverted file): the vectors are clustered around
+#   centroids found with k-means, and stored grouped by cluster. A search
+#   compares the query with the centroids, and then only with the vectors of
+#   the closest clusters.
+# - It's built by `bin/query build-vectors` from what's in elasticsearch,
+#   and kept in a few files under .scrapy/searchbox/vectors. The vectors file
+#   is memory mapped, not read, when searching.
+
+import array
+import heapq
+import json
+import math
+import mmap
+import operator
+import os
+import random
+import re
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DIMENSIONS = 256
+FIELD_WEIGHTS = {'name': 3.0, 'description': 2.0, 'content': 1.0}
+# Trigrams are many more than words, they shouldn't outweigh them
+TRIGRAM_WEIGHT = 0.25
+# Long pages are represented by their beginning
+MAX_FIELD_CHARS = 20000
+
+# Vectors per cluster the index aims for, and k-means training
+VECTORS_PER_LIST = 100
+TRAINING_ITERATIONS = 4
+TRAINING_SAMPLE_PER_LIST = 20
+
+STOPWORDS = frozenset('''
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+you your we our not but can all also more about how what which when
+'''.split())
+
+_WORD = re.compile(r'\w+')
+
+INDEX_FILE = 'index.json'
+CENTROIDS_FILE = 'centroids.f32'
+VECTORS_FILE = 'vectors.i8'
+SCALES_FILE = 'scales.f32'
+
+Vector = Sequence[float]
+
+
+def features(text: str) -> Iterable[Tuple[str, float]]:
+    for word in _WORD.findall(text.lower()):
+        if word in STOPWORDS or word.isdigit():
+            continue
+        yield word, 1.0
+        if len(word) > 4:
+            padded = '<{}>'.format(word)
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], TRIGRAM_WEIGHT
+
+
+def dot(a: Iterable[float], b: Iterable[float]) -> float:
+    total: float = sum(map(operator.mul, a, b))
+    return total
+
+
+def normalised(vector: List[float]) -> List[float]:
+    norm = math.sqrt(dot(vector, vector))
+    if norm == 0.0:
+        return vector
+    return [x / norm for x in vector]
+
+
+def embed(fields: Dict[str, Optional[str]]) -> List[float]:
+    counts: Dict[str, float] = {}
+    for name, weight in FIELD_WEIGHTS.items():
+        text = fields.get(name)
+        if text:
+            for feature, feature_weight in features(text[:MAX_FIELD_CHARS]):
+                counts[feature] = counts.get(feature, 0.0) + weight * feature_weight
+
+    vector = [0.0] * DIMENSIONS
+    for feature, count in counts.items():
+        h = zlib.crc32(feature.encode('utf-8'))
+        value = math.log1p(count)
+        vector[h % DIMENSIONS] += value if h & 0x80000000 else -value
+    return normalised(vector)
+
+
+def quantise(vector: Vector) -> Tuple[List[int], float]:
+    largest = max(abs(x) for x in vector) or 1.0
+    scale = largest / 127
+    return [round(x / scale) for x in vector], scale
+
+
+def _nearest(vector: Vector, centroids: Sequence[Vector]) -> int:
+    return max(range(len(centroids)), key=lambda i: dot(vector, centroids[i]))
+
+
+def train_centroids(vectors: Sequence[Vector], lists: int, rng: random.Random) -> List[List[float]]:
+    # Spherical k-means over a sample, the vectors are unit length and so are
+    # the centroids
+    sample = rng.sample(list(vectors), min(len(vectors), lists * TRAINING_SAMPLE_PER_LIST))
+    centroids = [list(v) for v in rng.sample(sample, lists)]
+    for _ in range(TRAINING_ITERATIONS):
+        sums = [[0.0] * DIMENSIONS for _ in centroids]
+        for vector in sample:
+            total = sums[_nearest(vector, centroids)]
+            for i, x in enumerate(vector):
+                total[i] += x
+        # Empty clusters keep their centroid
+        centroids = [normalised(total) if any(total) else centroid
+                     for total, centroid in zip(sums, centroids)]
+    return centroids
+
+
+def _write(path: str, data: 'array.array[Any]') -> None:
+    with open(path + '.tmp', 'wb') as f:
+        data.tofile(f)
+    os.replace(path + '.tmp', path)
+
+
+def build_index(path: str, documents: Iterable[Tuple[str, Vector]], seed: int = 0) -> int:
+    # Returns how many vectors were indexed
+    ids: List[str] = []
+    vectors: List['array.array[float]'] = []
+    for doc_id, vector in documents:
+        ids.append(doc_id)
+        vectors.append(array.array('f', vector))
+    if not vectors:
+        return 0
+
+    lists = max(1, min(len(vectors) // VECTORS_PER_LIST, 1024))
+    centroids = train_centroids(vectors, lists, random.Random(seed))
+    members: List[List[int]] = [[] for _ in centroids]
+    for n, vector in enumerate(vectors):
+        members[_nearest(vector, centroids)].append(n)
+
+    quantised = array.array('b')
+    scales = array.array('f')
+    ordered_ids = []
+    offsets = [0]
+    for indices in members:
+        for n in indices:
+            values, scale = quantise(vectors[n])
+            quantised.extend(values)
+            scales.append(scale)
+            ordered_ids.append(ids[n])
+        offsets.append(len(ordered_ids))
+
+    os.makedirs(path, exist_ok=True)
+    _write(os.path.join(path, CENTROIDS_FILE), array.array('f', (x for c in centroids for x in c)))
+    _write(os.path.join(path, VECTORS_FILE), quantised)
+    _write(os.path.join(path, SCALES_FILE), scales)
+    # Last, an index is only there once this is
+    with open(os.path.join(path, INDEX_FILE + '.tmp'), 'w') as f:
+        json.dump({'dimensions': DIMENSIONS, 'offsets': offsets, 'ids': ordered_ids}, f)
+    os.replace(os.path.join(path, INDEX_FILE + '.tmp'), os.path.join(path, INDEX_FILE))
+    return len(ordered_ids)
+
+
+def _read_floats(path: str) -> 'array.array[float]':
+    data = array.array('f')
+    with open(path, 'rb') as f:
+        data.frombytes(f.read())
+    return data
+
+
+class VectorIndex(object):
+    def __init__(self, path: str) -> None:
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            meta = json.load(f)
+        if meta['dimensions'] != DIMENSIONS:
+            raise ValueError('Vector index built with {} dimensions, rebuild it'.format(meta['dimensions']))
+        self.offsets: List[int] = meta['offsets']
+        self.ids: List[str] = meta['ids']
+
+        flat = _read_floats(os.path.join(path, CENTROIDS_FILE))
+        self.centroids = [flat[i:i + DIMENSIONS] for i in range(0, len(flat), DIMENSIONS)]
+        self.scales = _read_floats(os.path.join(path, SCALES_FILE))
+
+        self.file = open(os.path.join(path, VECTORS_FILE), 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.vectors = memoryview(self.mmap).cast('b')
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, vector: Vector, k: int, nprobe: int) -> List[Tuple[float, str]]:
+        # The k most similar (cosine, approximately) in the nprobe closest
+        # clusters, best first
+        query, query_scale = quantise(vector)
+        probed = heapq.nlargest(nprobe, range(len(self.centroids)),
+                                key=lambda c: dot(vector, self.centroids[c]))
+
+        scores = []
+        vectors = self.vectors
+        scales = self.scales
+        for c in probed:
+            for n in range(self.offsets[c], self.offsets[c + 1]):
+                start = n * DIMENSIONS
+                similarity = dot(query, vectors[start:start + DIMENSIONS]) * scales[n] * query_scale
+                scores.append((similarity, n))
+
+        return [(similarity, self.ids[n]) for similarity, n in heapq.nlargest(k, scores)]
+
+    def close(self) -> None:
+        self.vectors.release()
+        self.mmap.close()
+        self.file.close()
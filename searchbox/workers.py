@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+
+# Parallel crawls, see `crawl.py --workers`. Each spider, or each shard of a
+# spider, runs in its own worker process, so parsing, extraction and the
+# pipelines scale with the number of cores instead of sharing the one reactor
+# thread.
+#
+# - Shards split a spider's work by URL: every shard fetches the API listings
+#   (stars, bookmarks, likes), and keeps only its share of what they list.
+#   Everything that follows from those stays in the shard.
+# - Request fingerprints go to a SQLite store shared by the workers, so no
+#   URL is downloaded twice by the same spider, eg. after a redirect.
+# - Workers don't write to elasticsearch themselves, items are queued for a
+#   single writer process that sends them in bulk. Items it fails to write
+#   are counted. If the writer dies anyway the workers are stopped, instead
+#   of waiting forever for room in its queue.
+# - Each worker's stats are sent back to the launcher and added up.
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Type
+
+from scrapy import Request, Spider
+from scrapy.crawler import Crawler, CrawlerProcess
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.settings import Settings
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.project import get_project_settings
+
+from .instrumentation import activate, timed
+from .items import CrawlItem
+from .jobs import is_pending, job_name, job_path
+from .scheduling import LISTING, request_kind
+from .store import SeenRequestStore, store_path
+from .types import SpiderResults
+
+logger = logging.getLogger(__name__)
+
+ELASTIC_PIPELINE = 'searchbox.elastic.TimedElasticSearchPipeline'
+WRITER_PIPELINE = 'searchbox.workers.WriterQueuePipeline'
+WRITER_NAME = 'elasticsearch_writer'
+
+# Seconds between checks that the writer is still there, while waiting on
+# its queue
+WRITER_CHECK_INTERVAL = 1.0
+# Seconds the workers have to exit once the writer is gone
+TERMINATE_TIMEOUT = 10.0
+
+if TYPE_CHECKING:
+    from multiprocessing.queues import Queue
+    from multiprocessing.synchronize import Event
+    ItemQueue = Queue[Optional[Dict[str, Any]]]
+    ResultQueue = Queue[Tuple[str, Dict[str, Any]]]
+
+
+class Job(NamedTuple):
+    spider: str
+    shard: int
+    shards: int
+
+    @property
+    def label(self) -> str:
+        if self.shards == 1:
+            return self.spider
+        return '{}[{}/{}]'.format(self.spider, self.shard, self.shards)
+
+    @property
+    def name(self) -> str:
+        return job_name(self.spider, self.shard, self.shards)
+
+
+def shard_of(url: str, shards: int) -> int:
+    # Stable across processes and runs, unlike hash()
+    digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    shard, shards = value.split('/')
+    return int(shard), int(shards)
+
+
+class ShardSpiderMiddleware(object):
+    def __init__(self, shard: int, shards: int, stats: StatsCollector) -> None:
+        self.shard = shard
+        self.shards = shards
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls: Type['ShardSpiderMiddleware'], crawler: Crawler) -> 'ShardSpiderMiddleware':
+        value = crawler.settings.get('SEARCHBOX_SHARD')
+        if not value:
+            raise NotConfigured
+        assert crawler.stats is not None
+        shard, shards = parse_shard(value)
+        return cls(shard, shards, crawler.stats)
+
+    def _is_mine(self, i: Any) -> bool:
+        if isinstance(i, Request):
+            return request_kind(i) == LISTING or shard_of(i.url, self.shards) == self.shard
+        if isinstance(i, CrawlItem):
+            return shard_of(i.url or '', self.shards) == self.shard
+        return True
+
+    def process_spider_output(
+        self,
+        result: SpiderResults,
+        spider: Spider,
+        response: Any = None,
+    ) -> SpiderResults:
+        request = response.request if response is not None else None
+        if request is None or request_kind(request) != LISTING:
+            yield from result
+            return
+
+        for i in result:
+            if self._is_mine(i):
+                yield i
+            else:
+                self.stats.inc_value('shard/skipped', spider=spider)
+
+
+class SharedDupeFilter(RFPDupeFilter):
+    store: SeenRequestStore
+    namespace: str
+
+    @classmethod
+    def from_crawler(cls: Type['SharedDupeFilter'], crawler: Crawler) -> 'SharedDupeFilter':
+        dupefilter = super().from_crawler(crawler)
+        dupefilter.store = SeenRequestStore(store_path(crawler.settings.get('SEARCHBOX_SEEN_REQUESTS_FILE')))
+        dupefilter.namespace = crawler.spidercls.name
+        return dupefilter
+
+    def request_seen(self, request: Request) -> bool:
+        if super().request_seen(request):
+            return True
+        # Every shard fetches the listings
+        if request_kind(request) == LISTING:
+            return False
+        return not self.store.add(self.namespace, self.request_fingerprint(request))
+
+    def close(self, reason: str) -> None:
+        self.store.close()
+        super().close(reason)
+
+
+# Set in worker processes, the queue to the elasticsearch writer, and set
+# once the writer is gone
+_WRITER_QUEUE: Optional['ItemQueue'] = None
+_WRITER_GONE: Optional['Event'] = None
+
+
+class WriterGone(DropItem):
+    pass
+
+
+def put_while(writer_queue: 'ItemQueue', item: Optional[Dict[str, Any]], alive: Callable[[], bool]) -> bool:
+    # Waits for room in the queue as long as the writer is there to make
+    # it, returns whether the item was queued
+    while alive():
+        try:
+            writer_queue.put(item, timeout=WRITER_CHECK_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class WriterQueuePipeline(object):
+    def __init__(self, writer_queue: 'ItemQueue', writer_gone: 'Event', crawler: Crawler) -> None:
+        self.writer_queue = writer_queue
+        self.writer_gone = writer_gone
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls: Type['WriterQueuePipeline'], crawler: Crawler) -> 'WriterQueuePipeline':
+        if _WRITER_QUEUE is None or _WRITER_GONE is None:
+            raise NotConfigured
+        return cls(_WRITER_QUEUE, _WRITER_GONE, crawler)
+
+    def process_item(self, item: Any, spider: Spider) -> Any:
+        # Blocks when the writer falls behind, which holds the crawl back
+        # instead of piling up items in memory
+        with activate(spider), timed('es_queue'):
+            queued = put_while(self.writer_queue, dict(item), lambda: not self.writer_gone.is_set())
+        if not queued:
+            assert self.crawler.engine is not None
+            self.crawler.engine.close_spider(spider, 'writer_gone')
+            raise WriterGone('The elasticsearch writer is gone')
+        return item
+
+
+def worker_settings(settings: Settings, job: Job) -> Dict[str, Any]:
+    pipelines = dict(settings.getdict('ITEM_PIPELINES'))
+    order = pipelines.pop(ELASTIC_PIPELINE, None)
+    if order is not None:
+        pipelines[WRITER_PIPELINE] = order
+
+    overrides: Dict[str, Any] = {
+        'ITEM_PIPELINES': pipelines,
+        'DUPEFILTER_CLASS': 'searchbox.workers.SharedDupeFilter',
+        'SEARCHBOX_ROUTE_ALL_SPIDERS': True,
+    }
+    path = job_path(settings, job.name)
+    if path is not None:
+        overrides['JOBDIR'] = path
+    if job.shards > 1:
+        overrides['SEARCHBOX_SHARD'] = '{}/{}'.format(job.shard, job.shards)
+        timings_dir = settings.get('SEARCHBOX_TIMINGS_DIR')
+        if timings_dir:
+            overrides['SEARCHBOX_TIMINGS_DIR'] = os.path.join(timings_dir, 'shard-{}'.format(job.shard))
+    return overrides
+
+
+def run_worker(job: Job, overrides: Dict[str, Any], writer_queue: 'ItemQueue',
+               writer_gone: 'Event', results: 'ResultQueue') -> None:
+    global _WRITER_QUEUE, _WRITER_GONE
+    _WRITER_QUEUE = writer_queue
+    _WRITER_GONE = writer_gone
+
+    settings = get_project_settings()
+    settings.setdict(overrides, priority='cmdline')
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(job.spider)
+    process.crawl(crawler)
+    process.start()
+
+    assert crawler.stats is not None
+    results.put((job.label, crawler.stats.get_stats()))
+
+
+def run_writer(writer_queue: 'ItemQueue', writer_gone: 'Event', results: 'ResultQueue') -> None:
+    from .elastic import TimedElasticSearchPipeline
+
+    try:
+        settings = get_project_settings()
+        crawler = Crawler(Spider, settings)
+        spider = Spider(WRITER_NAME)
+        pipeline = TimedElasticSearchPipeline.from_crawler(crawler)
+
+        written = 0
+        errors = 0
+        while True:
+            item = writer_queue.get()
+            if item is None:
+                break
+            # A failed bulk request is sent again with the next items
+            try:
+                pipeline.process_item(item, spider)
+                written += 1
+            except Exception:
+                logger.exception('Could not index %s', item.get('url'))
+                errors += 1
+        try:
+            pipeline.close_spider(spider)
+        except Exception:
+            logger.exception('Could not index the last items')
+            errors += 1
+
+        results.put((WRITER_NAME, {'item_written_count': written, 'item_write_errors': errors}))
+    finally:
+        writer_gone.set()
+
+
+# Stats where adding up the workers' values makes no sense
+_MAX_STATS = ('max', 'p50', 'p95', 'elapsed_time_seconds', 'startup')
+
+
+def _combine(key: str, total: Any, value: Any) -> Any:
+    if key == 'start_time':
+        return min(total, value)
+    if isinstance(value, datetime):
+        return max(total, value)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return total
+    if key.rsplit('/', 1)[-1] in _MAX_STATS or \
+            (key.startswith('adaptive_concurrency/') and key != 'adaptive_concurrency/backoff'):
+        return max(total, value)
+    return total + value
+
+
+def aggregate_stats(worker_stats: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    total: Dict[str, Any] = {}
+    for stats in worker_stats.values():
+        for key, value in stats.items():
+            total[key] = _combine(key, total[key], value) if key in total else value
+    return total
+
+
+def _collect(results: 'ResultQueue', processes: Sequence[multiprocessing.process.BaseProcess],
+             collected: Dict[str, Dict[str, Any]],
+             writer: Optional[multiprocessing.process.BaseProcess] = None) -> bool:
+    # Results are read while the processes run, a process can't exit until
+    # what it put in the queue has been read. Returns False if the writer
+    # died before they were done.
+    expected = {p.name for p in processes}
+    while expected - set(collected):
+        try:
+            label, stats = results.get(timeout=WRITER_CHECK_INTERVAL)
+            collected[label] = stats
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes):
+                break
+            if writer is not None and not writer.is_alive():
+                return False
+    return True
+
+
+def _terminate(processes: Sequence[multiprocessing.process.BaseProcess]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(TERMINATE_TIMEOUT)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+
+class ParallelCrawl(NamedTuple):
+    exit_code: int
+    # The stats of each worker and the writer, and their total
+    workers: Dict[str, Dict[str, Any]]
+    total: Dict[str, Any]
+
+
+def run_parallel(jobs: List[Job], settings: Settings) -> ParallelCrawl:
+    seen = SeenRequestStore(store_path(settings.get('SEARCHBOX_SEEN_REQUESTS_FILE')))
+    # Unless the spider's last crawl was interrupted, and is being resumed
+    for spider in sorted({job.spider for job in jobs}):
+        if not any(is_pending(job_path(settings, job.name)) for job in jobs if job.spider == spider):
+            seen.clear(spider)
+    seen.close()
+
+    # Spawned, not forked, so every worker starts with a fresh reactor
+    context = multiprocessing.get_context('spawn')
+    writer_queue: 'ItemQueue' = context.Queue(
+        maxsize=settings.getint('SEARCHBOX_WRITER_QUEUE_SIZE'))
+    results: 'ResultQueue' = context.Queue()
+    writer_gone = context.Event()
+
+    writer = context.Process(target=run_writer, args=(writer_queue, writer_gone, results), name=WRITER_NAME)
+    writer.start()
+    workers = []
+    for job in jobs:
+        worker = context.Process(target=run_worker, name=job.label,
+                                 args=(job, worker_settings(settings, job), writer_queue, writer_gone, results))
+        worker.start()
+        workers.append(worker)
+
+    collected: Dict[str, Dict[str, Any]] = {}
+    if not _collect(results, workers, collected, writer):
+        # Killed, or it would have said so itself
+        writer_gone.set()
+        logger.error('The elasticsearch writer died, stopping the workers')
+        _terminate([worker for worker in workers if worker.is_alive()])
+    for worker in workers:
+        worker.join()
+
+    if put_while(writer_queue, None, writer.is_alive):
+        _collect(results, [writer], collected)
+    writer.join()
+
+    failed = [p.name for p in workers + [writer] if p.exitcode != 0]
+    for name in failed:
+        logger.error('Worker %s failed', name)
+    if WRITER_NAME not in collected and WRITER_NAME not in failed:
+        failed.append(WRITER_NAME)
+
+    total = aggregate_stats({k: v for k, v in collected.items() if k != WRITER_NAME})
+    total.update(collected.get(WRITER_NAME, {}))
+    stats_file = settings.get('SEARCHBOX_STATS_FILE')
+    if stats_file:
+        with open(store_path(stats_file), 'w') as f:
+            json.dump({'total': total, 'workers': collected}, f, indent=2, sort_keys=True, default=str)
+
+    return ParallelCrawl(1 if failed else 0, collected, total)
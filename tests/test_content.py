@@ -0,0 +1,73 @@
+from unittest import mock
+
+from scrapy import Spider
+from scrapy.http import HtmlResponse, Request, TextResponse
+
+from searchbox.content import MainContentSpiderMiddleware, main_content
+from searchbox.extractors import body_text
+from searchbox.items import CrawlItem
+
+PARAGRAPH = ('The parser reads the whole document in a single pass, and keeps only the '
+             'parts of the tree that the extractors need, which saves a lot of memory.')
+PAGE = '''<html><head><title>Parser</title></head><body>
+<nav><ul><li><a href="/">Home</a></li><li><a href="/blog">Blog</a></li></ul></nav>
+<div class="cookie-banner">We use cookies to improve your experience. <button>Accept</button></div>
+<div class="layout">
+<h1>A faster parser</h1>
+<div class="post-content"><p>{p}</p><p>{p}</p><p>{p}</p>
+<ul class="links"><li><a href="/a">Another post about parsing</a></li><li><a href="/b">And another</a></li></ul>
+</div>
+<div class="sidebar"><p>Subscribe to the newsletter to get every new post in your inbox.</p></div>
+</div>
+<footer><a href="/about">About</a> Copyright, all rights reserved</footer>
+</body></html>'''.format(p=PARAGRAPH)
+
+
+class _Spider(Spider):
+    name = 'test'
+
+
+def _response(body, url='https://example.com/post'):
+    return HtmlResponse(url, body=body.encode('utf-8'), request=Request(url))
+
+
+def test_main_content_should_leave_out_boilerplate():
+    response = _response(PAGE)
+
+    content = main_content(response.selector.root)
+
+    assert content == '\n'.join(['A faster parser', PARAGRAPH, PARAGRAPH, PARAGRAPH])
+    _, text, _ = body_text(response)
+    assert 'Copyright' in text and 'cookies' in text and 'newsletter' in text
+
+
+def test_pages_without_main_content_should_keep_their_text():
+    assert main_content(_response('<html><body><p>Short page</p></body></html>').selector.root) is None
+    links = ''.join('<li><a href="/{0}">Link number {0}</a></li>'.format(n) for n in range(50))
+    assert main_content(_response('<html><body><ul>{}</ul></body></html>'.format(links)).selector.root) is None
+
+
+def test_middleware_should_replace_the_content_of_html_pages():
+    sut = MainContentSpiderMiddleware(keep_full_text=True)
+    response = _response(PAGE)
+    _, text, html = body_text(response)
+    item = CrawlItem(url=response.url, content=text, html=html)
+
+    output = list(sut.process_spider_output(iter([item]), _Spider(), response))
+
+    assert output == [item]
+    assert item.content == main_content(response.selector.root)
+    assert item.full_content == text
+
+    # Only HTML pages
+    response = TextResponse('https://example.com/readme', body=PAGE.encode('utf-8'))
+    item = CrawlItem(url=response.url, content=PAGE)
+    list(sut.process_spider_output(iter([item]), _Spider(), response))
+    assert item.content == PAGE and item.full_content is None
+
+
+def test_middleware_should_be_enabled_by_the_setting():
+    crawler = mock.MagicMock()
+    crawler.settings.getbool.side_effect = lambda name: name == 'SEARCHBOX_MAIN_CONTENT'
+
+    assert MainContentSpiderMiddleware.from_crawler(crawler).keep_full_text is False
@@ -0,0 +1,152 @@
+import io
+import time
+import zipfile
+from concurrent.futures import Future
+from unittest import mock
+
+import pytest
+from scrapy import Spider
+from scrapy.http import HtmlResponse, Request, Response
+
+from searchbox.documents import (DocumentPipeline, DocumentSpiderMiddleware, document_format,
+                                 extract_text)
+from searchbox.items import CrawlItem
+
+
+class _Spider(Spider):
+    name = 'test'
+
+
+def _pdf(pages):
+    # A PDF with a line of text on each page
+    objects = [b'<</Type/Catalog/Pages 2 0 R>>',
+               '<</Type/Pages/Kids[{}]/Count {}>>'.format(
+                   ' '.join('{} 0 R'.format(4 + 2 * n) for n in range(len(pages))), len(pages)).encode(),
+               b'<</Type/Font/Subtype/Type1/BaseFont/Helvetica>>']
+    for n, text in enumerate(pages):
+        stream = 'BT /F1 12 Tf 72 720 Td ({}) Tj ET'.format(text).encode()
+        objects.append('<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]/Contents {} 0 R'
+                       '/Resources<</Font<</F1 3 0 R>>>>>>'.format(5 + 2 * n).encode())
+        objects.append(b'<</Length %d>>stream\n%s\nendstream' % (len(stream), stream))
+
+    body = b'%PDF-1.4\n'
+    offsets = []
+    for n, obj in enumerate(objects):
+        offsets.append(len(body))
+        body += b'%d 0 obj\n%s\nendobj\n' % (n + 1, obj)
+    xref = len(body)
+    body += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    body += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    body += b'trailer\n<</Size %d/Root 1 0 R>>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return body
+
+
+def _docx(paragraphs):
+    xml = ('<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>{}'
+           '</w:body></w:document>').format(''.join(
+               '<w:p><w:r><w:t>{}</w:t></w:r><w:r><w:t> again</w:t></w:r></w:p>'.format(p) for p in paragraphs))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('word/document.xml', xml)
+    return buffer.getvalue()
+
+
+def test_text_should_be_extracted_from_the_first_pages_of_documents():
+    pytest.importorskip('pypdf')
+    assert extract_text(_pdf(['First page', 'Second page', 'Third page']), 2, 10) == 'First page\nSecond page'
+    assert extract_text(_docx(['Hello', 'World']), 2, 10) == 'Hello again\nWorld again'
+    with pytest.raises(Exception):
+        extract_text(b'<html>not a document</html>', 2, 10)
+
+
+def test_documents_should_be_recognised_by_content_type_or_extension():
+    def response(url, content_type):
+        return Response(url, headers={'Content-Type': content_type}, body=b'%PDF-1.4')
+
+    assert document_format(response('https://example.com/paper', 'application/pdf')) == 'pdf'
+    assert document_format(response('https://example.com/paper.docx', 'application/octet-stream')) == 'docx'
+    assert document_format(response('https://example.com/paper', 'application/octet-stream')) is None
+    assert document_format(response('https://example.com/image.png', 'image/png')) is None
+    html = HtmlResponse('https://example.com/paper.pdf', body=b'<html></html>')
+    assert document_format(html) is None
+
+
+def test_document_text_should_be_extracted_in_a_worker_process():
+    pytest.importorskip('pypdf')
+    stats = mock.MagicMock()
+    reactor = mock.MagicMock()
+    reactor.callFromThread.side_effect = lambda f, *args: f(*args)
+    middleware = DocumentSpiderMiddleware(1024 * 1024, stats)
+    sut = DocumentPipeline(1, 10, 30, stats, reactor)
+    spider = _Spider()
+
+    url = 'https://example.com/paper.pdf'
+    response = Response(url, headers={'Content-Type': 'application/pdf'}, body=_pdf(['A paper']),
+                        request=Request(url))
+    item, = middleware.process_spider_output(iter([CrawlItem(url=url, name='Paper')]), spider, response)
+    results = []
+    try:
+        sut.process_item(item, spider).addCallback(results.append)
+        deadline = time.monotonic() + 60
+        while not results and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        sut.close_spider(spider)
+
+    assert results == [item]
+    assert item.content == 'A paper' and item.document is None
+    stats.inc_value.assert_called_with('documents/extracted', spider=spider)
+    # Nothing to extract
+    other = CrawlItem(url='https://example.com')
+    assert sut.process_item(other, spider) is other
+
+
+class _Pool(object):
+    # Documents stay in it until the test says otherwise
+    pools = []
+
+    def __init__(self, *args, **kwargs):
+        self._processes = {1: mock.MagicMock(), 2: mock.MagicMock()}
+        self.futures = []
+        self.pools.append(self)
+
+    def submit(self, *args):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        for future in self.futures:
+            future.cancel()
+
+
+def test_the_pool_should_be_terminated_when_a_worker_stops_responding(monkeypatch):
+    monkeypatch.setattr('searchbox.documents.ProcessPoolExecutor', _Pool)
+    _Pool.pools = []
+    stats = mock.MagicMock()
+    reactor = mock.MagicMock()
+    reactor.callFromThread.side_effect = lambda f, *args: f(*args)
+    sut = DocumentPipeline(2, 10, 30, stats, reactor)
+    spider = _Spider()
+
+    items = [CrawlItem(url='https://example.com/{}.pdf'.format(n), document=b'%PDF-1.4') for n in range(3)]
+    results = []
+    for item in items:
+        sut.process_item(item, spider).addCallback(results.append)
+    # The third waits for a worker, its deadline hasn't started
+    first, = _Pool.pools
+    assert len(first.futures) == 2 and reactor.callLater.call_count == 2
+
+    # The deadline of the first fires before its worker reports anything
+    _, finish, future = reactor.callLater.call_args_list[0][0]
+    finish(future)
+
+    assert sorted(i.url for i in results) == [i.url for i in items[:2]]
+    assert all(p.terminate.called for p in first._processes.values())
+    stats.inc_value.assert_any_call('documents/deadline', spider=spider)
+    stats.inc_value.assert_any_call('documents/failed', spider=spider)
+    # The third went to a new pool
+    first, second = _Pool.pools
+    assert sut.executor is second and len(second.futures) == 1
+    second.futures[0].set_result('A paper')
+    assert results[2] is items[2] and items[2].content == 'A paper'
@@ -1,5 +1,5 @@
-from searchbox.extractors import MicroformatExtractor, fix_url, is_github_html, compare_urls
-from searchbox.extractors import get_links_from_markdown, get_text_from_markdown
+from searchbox.extractors import JsonLdIndex, MicroformatExtractor, extract_json_ld, fix_url, is_github_html, compare_urls
+from searchbox.extractors import extract_markdown, get_links_from_markdown, get_text_from_markdown, is_plain_text_markdown
 from scrapy.http import TextResponse
 
 
@@ -76,6 +76,26 @@ Another piece of text
         'Testing  Section 1  Look at this: other   Another piece of text'
 
 
+def test_plain_text_markdown_should_match_rendered_text():
+    response = TextResponse(url='https://test.com')
+    md = "A key-value store: fast, small.\nSecond line\n\n\nAnother paragraph "
+    assert is_plain_text_markdown(md)
+
+    # A link forces the full render, and the same paragraph structure should
+    # come out of both paths
+    rendered = get_text_from_markdown(response, md + '\n\n[link](/x)')
+    assert get_text_from_markdown(response, md) + '  link' == rendered
+
+
+def test_markdown_links_should_be_resolved_against_each_response():
+    md = "Docs at [the site](/docs) with a hard break  \nhere"
+    first = extract_markdown(TextResponse(url='https://one.com'), md)
+    second = extract_markdown(TextResponse(url='https://two.com'), md)
+    assert first.text == second.text == 'Docs at the site with a hard break here'
+    assert first.links == ['https://one.com/docs']
+    assert second.links == ['https://two.com/docs']
+
+
 def test_can_extract_rdfa_tags():
     html: str = """<html>
 <head>
@@ -96,3 +116,63 @@ def test_can_extract_rdfa_tags():
 
     assert tags == ('oranges', 'technology')
 
+
+
+def test_syntaxes_without_markup_should_not_be_extracted():
+    html = """<html><head><title>Plain</title></head>
+<body><div itemscope itemtype="http://schema.org/Article">
+<meta itemprop="keywords" content="Rust, WebAssembly" />
+</div></body></html>"""
+
+    extractor = MicroformatExtractor('https://example.com/post', html=html)
+
+    assert sorted(extractor.get_tags()) == ['rust', 'webassembly']
+    assert extractor.get_published_date() is None
+    assert extractor.data['json-ld'] == extractor.data['opengraph'] == []
+
+    # Nothing to extract, the page isn't even parsed
+    plain = MicroformatExtractor('https://example.com/plain', html='<html><p>Hi</p></html>')
+    assert list(plain.get_tags()) == []
+    assert plain._document is None
+
+
+def test_broken_json_ld_should_not_hide_other_syntaxes():
+    html = """<html><head>
+<script type="application/ld+json">{"keywords": "broken",</script>
+<meta property="article:published_time" content="2021-03-04T10:00:00Z" />
+<meta property="article:tag" content="databases" />
+</head><body></body></html>"""
+
+    extractor = MicroformatExtractor('https://example.com/post', html=html)
+
+    assert list(extractor.get_tags()) == ['databases']
+    assert extractor.get_published_date().year == 2021
+    assert extractor.data['json-ld'] == []
+
+
+def test_json_ld_blocks_should_be_decoded_one_by_one():
+    html = """<html><head>
+<SCRIPT type='application/ld+json'>
+<!--
+{"@type": "Article", "keywords": "a, b",
+ "description": "control\tcharacter"}
+-->
+</SCRIPT>
+<script type="application/ld+json">{"broken": </script>
+<script type="application/ld+json">[{"@type": "Person"}, {}]</script>
+<script type="text/javascript">{"@type": "NotJsonLd"}</script>
+</head></html>"""
+
+    assert [item['@type'] for item in extract_json_ld(html)] == ['Article', 'Person']
+
+
+def test_json_ld_index_should_find_the_date_of_the_page():
+    items = [{'@graph': [
+        {'@type': 'WebSite', 'url': 'https://example.com/', 'datePublished': '2001-01-01'},
+        {'@type': 'Article', '@id': 'http://example.com/post/', 'datePublished': '2022-02-02'},
+    ]}, {'@type': 'BlogPosting', 'datePublished': ['2023-03-03']}]
+
+    index = JsonLdIndex(items)
+
+    assert list(index.published_dates('https://example.com/post')) == ['2022-02-02', '2023-03-03']
+    assert list(index.published_dates('https://example.com/other')) == ['2023-03-03']
@@ -0,0 +1,98 @@
+import time
+from unittest import mock
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.settings import Settings
+from scrapy.utils.request import RequestFingerprinter
+
+from searchbox.httpcache import SqliteCacheStorage, cache_report, compact, evict
+
+
+def make_storage(tmp_path, **extra_settings):
+    settings = Settings({'HTTPCACHE_DIR': str(tmp_path), 'HTTPCACHE_EXPIRATION_SECS': 0,
+                         'SEARCHBOX_HTTPCACHE_COMPRESSION': 'gzip',
+                         'SEARCHBOX_HTTPCACHE_MAX_SIZE': 0, **extra_settings})
+    return SqliteCacheStorage(settings)
+
+
+def make_spider(rules=()):
+    spider = mock.MagicMock()
+    spider.name = 'test_spider'
+    spider.httpcache_expiration_rules = list(rules)
+    spider.crawler.request_fingerprinter = RequestFingerprinter()
+    return spider
+
+
+def test_cached_responses_should_round_trip(tmp_path):
+    storage = make_storage(tmp_path)
+    spider = make_spider()
+    storage.open_spider(spider)
+
+    request = Request('https://test.example.com/page')
+    body = b'<html><body>' + b'repeated text ' * 1000 + b'</body></html>'
+    response = HtmlResponse(request.url, status=200, body=body,
+                            headers={'Content-Type': 'text/html; charset=utf-8'})
+    storage.store_response(spider, request, response)
+
+    cached = storage.retrieve_response(spider, Request('https://test.example.com/page'))
+    assert isinstance(cached, HtmlResponse)
+    assert cached.body == body
+    assert cached.headers['Content-Type'] == b'text/html; charset=utf-8'
+    assert storage.retrieve_response(spider, Request('https://test.example.com/other')) is None
+
+    report = cache_report(storage.connection)
+    assert report[0].entries == 1
+    assert report[0].size < report[0].raw_size
+    storage.close_spider(spider)
+
+
+def test_expiration_rules_should_be_applied_by_url(tmp_path):
+    storage = make_storage(tmp_path)
+    spider = make_spider(rules=[(r'^https://api\.', 60)])
+    storage.open_spider(spider)
+
+    for url in ['https://api.example.com/data', 'https://www.example.com/']:
+        storage.store_response(spider, Request(url), HtmlResponse(url, body=b'test'))
+
+    later = time.time() + 120
+    with mock.patch('searchbox.httpcache.time.time', return_value=later):
+        assert storage.retrieve_response(spider, Request('https://api.example.com/data')) is None
+        assert storage.retrieve_response(spider, Request('https://www.example.com/')) is not None
+    storage.close_spider(spider)
+
+
+def test_least_recently_used_responses_should_be_evicted(tmp_path):
+    storage = make_storage(tmp_path, SEARCHBOX_HTTPCACHE_COMPRESSION='none')
+    spider = make_spider()
+    storage.open_spider(spider)
+
+    urls = ['https://www.example.com/{}'.format(i) for i in range(3)]
+    for url in urls:
+        storage.store_response(spider, Request(url), HtmlResponse(url, body=b'x' * 1000))
+    storage.retrieve_response(spider, Request(urls[0]))
+
+    connection = storage.connection
+    size = connection.execute('SELECT size FROM responses LIMIT 1').fetchone()[0]
+    assert evict(connection, max_size=size * 2) == 1
+
+    assert storage.retrieve_response(spider, Request(urls[0])) is not None
+    assert storage.retrieve_response(spider, Request(urls[1])) is None
+    assert storage.retrieve_response(spider, Request(urls[2])) is not None
+    storage.close_spider(spider)
+
+
+def test_compaction_should_keep_responses_their_rules_keep(tmp_path):
+    storage = make_storage(tmp_path, HTTPCACHE_EXPIRATION_SECS=60)
+    spider = make_spider(rules=[(r'^https://api\.', 3600), (r'^https://static\.', 0)])
+    storage.open_spider(spider)
+
+    urls = ['https://api.example.com/data', 'https://static.example.com/', 'https://www.example.com/']
+    for url in urls:
+        storage.store_response(spider, Request(url), HtmlResponse(url, body=b'test'))
+
+    later = time.time() + 120
+    with mock.patch('searchbox.httpcache.time.time', return_value=later):
+        assert compact(storage.connection, max_size=0, max_age=60) == (1, 0)
+    remaining = {row[0] for row in storage.connection.execute('SELECT url FROM responses')}
+    assert remaining == set(urls[:2])
+    storage.close_spider(spider)
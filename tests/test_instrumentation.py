@@ -0,0 +1,50 @@
+from unittest import mock
+
+from scrapy.http import Request, TextResponse
+
+from searchbox import instrumentation
+from searchbox.extractors import body_text
+from searchbox.instrumentation import CallbackTimingSpiderMiddleware, Histogram, Timings
+
+
+def test_histogram_quantiles_should_use_bucket_bounds():
+    histogram = Histogram()
+    for value in [0.003] * 90 + [2.0] * 10:
+        histogram.observe(value)
+
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 0.005
+    assert histogram.quantile(0.95) == 2.0
+    assert histogram.max == 2.0
+
+
+def test_prometheus_output_should_have_cumulative_buckets():
+    timings = Timings()
+    timings.observe('download_latency', 'example.com', 0.2)
+    timings.observe('download_latency', 'example.com', 100.0)
+
+    lines = timings.to_prometheus('test').splitlines()
+    labels = 'spider="test",stage="download_latency",key="example.com"'
+    assert 'searchbox_stage_seconds_bucket{{{},le="0.25"}} 1'.format(labels) in lines
+    assert 'searchbox_stage_seconds_bucket{{{},le="+Inf"}} 2'.format(labels) in lines
+    assert 'searchbox_stage_seconds_count{{{}}} 2'.format(labels) in lines
+
+
+def test_callback_timing_should_record_callback_and_nested_stages():
+    timings = Timings()
+    spider = mock.MagicMock()
+    spider.name = 'test_spider'
+
+    def parse_page(response):
+        yield body_text(response)
+
+    request = Request('https://test.example.com', callback=parse_page)
+    response = TextResponse(request.url, body=b'text', request=request)
+
+    with mock.patch.dict(instrumentation._TIMINGS, {'test_spider': timings}):
+        sut = CallbackTimingSpiderMiddleware()
+        result = list(sut.process_spider_output(parse_page(response), spider, response))
+
+    assert result == [(None, 'text', None)]
+    assert timings.histograms[('callback_cpu', 'parse_page')].count == 1
+    assert timings.histograms[('body_text', '')].count == 1
@@ -0,0 +1,73 @@
+from unittest import mock
+
+from scrapy import Spider
+from scrapy.http import Request, TextResponse
+
+from searchbox.jobs import ResumeSpiderMiddleware
+from searchbox.store import CursorStore
+
+
+class _Spider(Spider):
+    name = 'test'
+
+
+def _listing(url, **meta):
+    return Request(url, meta=dict(request_kind='listing', listing='stars', **meta))
+
+
+def _middleware(path):
+    return ResumeSpiderMiddleware(str(path), CursorStore(str(path / 'cursors.sqlite')), mock.MagicMock())
+
+
+def _process(sut, request, output, status=200):
+    response = TextResponse(request.url, status=status, body=b'[]', request=request)
+    return list(sut.process_spider_output(iter(output), _Spider(), response))
+
+
+def test_interrupted_listing_should_resume_from_its_cursor(tmp_path):
+    first_page = _listing('https://api.example.com/stars')
+    second_page = _listing('https://api.example.com/stars?page=2', cursor='https://api.example.com/stars?page=2')
+
+    sut = _middleware(tmp_path)
+    assert list(sut.process_start_requests([first_page], _Spider())) == [first_page]
+    _process(sut, first_page, [Request('https://example.com/repo'), second_page])
+    sut.spider_closed(_Spider(), 'shutdown')
+
+    sut = _middleware(tmp_path)
+    resumed = list(sut.process_start_requests([first_page], _Spider()))
+    assert [r.url for r in resumed] == ['https://api.example.com/stars?page=2']
+    assert resumed[0].dont_filter
+    assert resumed[0].meta['cursor'] == 'https://api.example.com/stars?page=2'
+
+
+def test_finished_listings_should_not_be_fetched_again(tmp_path):
+    first_page = _listing('https://api.example.com/stars')
+    other = Request('https://api.example.com/user', meta={'request_kind': 'listing'})
+
+    sut = _middleware(tmp_path)
+    # An error leaves the listing to be tried again
+    _process(sut, first_page, [], status=429)
+    assert sut.cursors.get('stars') is None
+    _process(sut, first_page, [Request('https://example.com/repo')])
+    sut.spider_closed(_Spider(), 'shutdown')
+
+    sut = _middleware(tmp_path)
+    resumed = list(sut.process_start_requests([first_page, other], _Spider()))
+    # Listings without a name are made again, past the dupefilter
+    assert [r.url for r in resumed] == ['https://api.example.com/user']
+    assert resumed[0].dont_filter
+
+
+def test_finished_crawl_should_drop_its_state(tmp_path):
+    (tmp_path / 'requests.seen').write_text('0123456789abcdef\n')
+    first_page = _listing('https://api.example.com/stars')
+
+    sut = _middleware(tmp_path)
+    assert sut.resuming
+    _process(sut, first_page, [_listing('https://api.example.com/stars?page=2', cursor=2)])
+    sut.spider_closed(_Spider(), 'finished')
+
+    sut = _middleware(tmp_path)
+    assert not sut.resuming
+    assert list(sut.process_start_requests([first_page], _Spider())) == [first_page]
+    assert (tmp_path / 'requests.seen').read_text() == ''
@@ -0,0 +1,43 @@
+from searchbox.language import detect, route, unrouted
+
+
+def test_language_should_be_detected_from_script_and_common_words():
+    assert detect('これはプラットフォームのためのライブラリです。高速なパーサー') == 'ja'
+    assert detect('这是一个用于解析的高性能库，支持多种格式') == 'zh'
+    assert detect('이것은 빠른 파서 라이브러리입니다') == 'ko'
+    assert detect('Это быстрая библиотека для разбора текста') == 'ru'
+    assert detect('Die Bibliothek ist nicht nur schnell, sondern auch mit der neuen API kompatibel') == 'de'
+    assert detect('Cette bibliothèque est rapide et une des plus simples pour les projets') == 'fr'
+    assert detect('La biblioteca es muy rápida y se usa para los proyectos con una API') == 'es'
+    assert detect('The library is fast and it is used for parsing of the files with this API') == 'en'
+    # Too short, or nothing to tell it by
+    assert detect('fast parser') is None
+    assert detect('Python parser JSON YAML TOML library rust') is None
+
+
+def test_text_should_go_to_the_fields_of_its_language():
+    fields = {'url': 'https://example.com', 'name': 'パーサー',
+              'description': 'これはプラットフォームのためのライブラリです',
+              'content': 'The library is fast and it is used for parsing of the files with this API'}
+
+    routed = route(fields)
+
+    assert routed == {'url': 'https://example.com', 'name': 'パーサー',
+                      'description_cjk': 'これはプラットフォームのためのライブラリです',
+                      'content': 'The library is fast and it is used for parsing of the files with this API',
+                      'language': 'en'}
+    assert unrouted(routed) == dict(fields, language='en')
+    assert route({'url': 'https://example.com', 'name': 'fast'}) == {'url': 'https://example.com', 'name': 'fast'}
+
+
+def test_merged_updates_should_clear_the_other_language_fields():
+    content = 'Cette bibliothèque est rapide et une des plus simples pour les projets'
+
+    routed = route({'url': 'https://example.com', 'content': content}, merge=True)
+
+    assert routed['content_fr'] == content
+    assert routed['content'] is None and routed['content_cjk'] is None
+    assert routed['language'] == 'fr'
+    # Only the text the item has, a README doesn't clear the description
+    assert not any(name.startswith('description') for name in routed)
+    assert unrouted(routed) == {'url': 'https://example.com', 'content': content, 'language': 'fr'}
@@ -0,0 +1,25 @@
+from unittest import mock
+
+from searchbox.items import CrawlItem
+from searchbox.middlewares import MetadataExtractionSpiderMiddleware
+
+
+def test_metadata_extraction_should_replace_html_with_metadata():
+    html = """<html>
+<head>
+<meta property='og:type' content='article' />
+<meta property='article:tag' content='oranges' />
+<meta property='article:published_time' content='2021-03-04T10:00:00' />
+</head>
+<body><p>Hello</p></body>
+</html>
+"""
+    sut = MetadataExtractionSpiderMiddleware()
+    item = CrawlItem(url='https://test.example.com/article', content='Hello', html=html)
+
+    result = list(sut.process_spider_output(iter([item]), mock.MagicMock()))
+
+    assert result == [item]
+    assert item.html is None
+    assert item.article_tags == ['oranges']
+    assert item.article_published_date == '2021-03-04T10:00:00'
@@ -1,6 +1,26 @@
 from typing import Any
+from unittest import mock
+
+import pytest
+
+from scrapy.settings import Settings
+
+from searchbox.indexed import AFTER_INDEX, IndexRecorder
 from searchbox.items import CrawlItem
-from searchbox.pipelines import ConvertToItemPipeline
+from searchbox.pipelines import ConvertToItemPipeline, SkipUnchangedPipeline, UnchangedItem
+from searchbox.store import IndexHashStore
+
+
+def _skip_unchanged(tmp_path, stats, max_age):
+    recorder = IndexRecorder(Settings({'SEARCHBOX_INDEX_HASHES_FILE': str(tmp_path / 'hashes.db')}))
+    return SkipUnchangedPipeline(IndexHashStore(str(tmp_path / 'hashes.db')), stats, max_age, recorder)
+
+
+def _index(pipeline, item, spider):
+    # What the elasticsearch pipeline does once the item is indexed
+    result = pipeline.process_item(item, spider)
+    pipeline.recorder.write(item.after_index)
+    return result
 
 
 def test_when_converting_to_scrapy_item_empty_values_should_be_ignored():
@@ -13,3 +33,89 @@ def test_when_converting_to_scrapy_item_empty_values_should_be_ignored():
     item = CrawlItem(name='testing', alt_url="http://test.example.com/test")
     result = pipeline.process_item(item, Any)
     assert sorted(result.field_names()) == ['alt_url', 'name']
+
+
+def test_index_dict_should_skip_empty_fields_without_copying_values():
+    tags = ['a', 'b']
+    item = CrawlItem(url='http://test.example.com', repository_tags=tags, content='')
+    result = item.to_index_dict()
+    assert result == {'url': 'http://test.example.com', 'repository_tags': ['a', 'b']}
+    assert result['repository_tags'] is tags
+
+
+def test_unchanged_items_should_be_skipped(tmp_path):
+    stats = mock.MagicMock()
+    pipeline = _skip_unchanged(tmp_path, stats, max_age=3600)
+    spider = mock.MagicMock()
+
+    def make_item(tags):
+        return CrawlItem(name='testing', url='http://test.example.com', repository_tags=tags)
+
+    _index(pipeline, make_item(['a']), spider)
+    # Same URL with different fields is tracked separately
+    _index(pipeline, CrawlItem(url='http://test.example.com', content='text'), spider)
+
+    with pytest.raises(UnchangedItem):
+        _index(pipeline, make_item(['a']), spider)
+
+    _index(pipeline, make_item(['a', 'b']), spider)
+    pipeline.close_spider(spider)
+
+    stats.inc_value.assert_any_call('searchbox/index/unchanged_skipped')
+    assert stats.inc_value.call_count == 4
+
+
+def test_unchanged_items_should_be_sent_again_when_old(tmp_path):
+    pipeline = _skip_unchanged(tmp_path, mock.MagicMock(), max_age=0)
+    item = CrawlItem(name='testing', url='http://test.example.com')
+    _index(pipeline, item, mock.MagicMock())
+    assert _index(pipeline, item, mock.MagicMock()) is item
+
+
+def test_items_should_only_count_as_indexed_once_they_are(tmp_path):
+    pipeline = _skip_unchanged(tmp_path, mock.MagicMock(), max_age=3600)
+    spider = mock.MagicMock()
+
+    # Lost before it got to the index
+    pipeline.process_item(CrawlItem(name='testing', url='http://test.example.com'), spider)
+    item = CrawlItem(name='testing', url='http://test.example.com')
+    assert pipeline.process_item(item, spider) is item
+
+    # The records go with the indexed fields
+    fields = ConvertToItemPipeline().process_item(item, spider)
+    assert fields[AFTER_INDEX] == item.after_index
+    assert 'after_index' not in item.to_index_dict()
+
+
+def test_elasticsearch_pipeline_should_record_items_once_sent(tmp_path):
+    pytest.importorskip('scrapyelasticsearch')
+    from searchbox.elastic import TimedElasticSearchPipeline
+
+    sut = TimedElasticSearchPipeline()
+    sut.settings = Settings({'ELASTICSEARCH_INDEX': 'scrapy', 'ELASTICSEARCH_TYPE': '_doc',
+                             'ELASTICSEARCH_UNIQ_KEY': 'url', 'ELASTICSEARCH_BUFFER_LENGTH': 2,
+                             'SEARCHBOX_INDEX_HASHES_FILE': str(tmp_path / 'hashes.db')})
+    sut.items_buffer = []
+    sut.records = []
+    sut.recorder = IndexRecorder(sut.settings)
+    spider = mock.MagicMock()
+
+    def item(url):
+        return {'url': url, AFTER_INDEX: [('index_hash', url + ' url', ('hash', 1.0))]}
+
+    with mock.patch('scrapyelasticsearch.scrapyelasticsearch.helpers.bulk') as bulk:
+        bulk.side_effect = RuntimeError('Unavailable')
+        with pytest.raises(RuntimeError):
+            for url in ['http://a.example.com', 'http://b.example.com']:
+                sut.process_item(item(url), spider)
+        assert IndexHashStore(str(tmp_path / 'hashes.db')).get('http://a.example.com url') is None
+
+        bulk.side_effect = None
+        sut.process_item(item('http://c.example.com'), spider)
+    sut.recorder.close()
+
+    store = IndexHashStore(str(tmp_path / 'hashes.db'))
+    assert store.get('http://a.example.com url') == ('hash', 1.0)
+    assert store.get('http://c.example.com url') == ('hash', 1.0)
+    # Not sent to elasticsearch
+    assert all(AFTER_INDEX not in action['_source'] for action in bulk.call_args[0][1])
@@ -0,0 +1,55 @@
+from searchbox.queries import (Filters, facet_counts, facets_search, hybrid_ranking, results_search,
+                               search_query, search_sort)
+
+
+def test_filters_should_go_in_filter_context():
+    query = search_query(['python'], Filters(tags=['machine_learning'], source='pocket', year=2021))
+
+    assert query['bool']['must'][0]['query_string']['query'] == 'python'
+    term, exists, year = query['bool']['filter']
+    assert term == {'term': {'pocket_tags.keyword': 'machine_learning'}}
+    assert exists == {'exists': {'field': 'pocket_tags'}}
+    assert year['bool']['should'][0] == {
+        'range': {'last_update': {'gte': '2021-01-01', 'lt': '2022-01-01'}}}
+    assert search_sort(['python']) is None
+
+
+def test_filters_without_text_should_match_everything_newest_first():
+    query = search_query([], Filters(tags=['rust']))
+
+    assert query == {'bool': {'filter': [{'term': {'tags': 'rust'}}]}}
+    assert [list(s) for s in search_sort([])] == [['last_update'], ['article_published_date']]
+
+
+def test_facet_counts_should_skip_empty_sources():
+    response = {'aggregations': {
+        'tags': {'buckets': [{'key': 'python', 'doc_count': 3}]},
+        'sources': {'buckets': {'repository': {'doc_count': 2}, 'pocket': {'doc_count': 0},
+                                'twitter': {'doc_count': 1}, 'article': {'doc_count': 0}}},
+        'years': {'buckets': [{'key': 2023, 'doc_count': 2}, {'key': 2021, 'doc_count': 1}]},
+    }}
+
+    assert facet_counts(response) == {
+        'tags': [('python', 3)],
+        'sources': [('repository', 2), ('twitter', 1)],
+        'years': [(2023, 2), (2021, 1)],
+    }
+
+
+def test_hybrid_ranking_should_mix_similarity_and_bm25():
+    hits = [{'_id': 'a', '_score': 10.0}, {'_id': 'b', '_score': None}, {'_id': 'c', '_score': 5.0}]
+    ranked = hybrid_ranking({'a': 0.2, 'b': 0.9, 'c': 0.6}, hits, weight=0.5)
+
+    assert [hit['_id'] for _, hit in ranked] == ['a', 'c', 'b']
+    assert ranked[1][0] == 0.5 * 0.6 + 0.5 * 0.5
+
+
+def test_results_and_facets_should_share_the_query():
+    filters = Filters(tags=['rust'], year=2022)
+
+    results = results_search([], filters, 30)
+    facets = facets_search([], filters, 10)
+
+    assert results['query'] == facets['query'] == search_query([], filters)
+    assert results['size'] == 30 and 'sort' in results
+    assert facets['size'] == 0 and facets['aggs']['tags']['terms']['size'] == 10
@@ -0,0 +1,87 @@
+from unittest import mock
+
+from scrapy import Spider
+from scrapy.http import Request, TextResponse
+
+from searchbox.items import CrawlItem
+from searchbox.reconcile import ReconcileSpiderMiddleware
+from searchbox.store import LiveURLStore
+
+LISTING_URL = 'https://api.example.com/stars'
+
+
+class _Spider(Spider):
+    name = 'test'
+
+
+def _listing_request(page=0):
+    meta = {'request_kind': 'listing', 'listing': 'stars'}
+    if page > 0:
+        meta['cursor'] = page
+    return Request('{}?page={}'.format(LISTING_URL, page), meta=meta)
+
+
+def _crawl(tmp_path, pages, status=200, reason='finished', others=None, max_delete_ratio=1.0):
+    # A listing with the given pages of (source URL, homepage or None), and
+    # the homepages they link to. Returns the URLs deleted.
+    deleted = []
+
+    def delete(urls):
+        deleted.extend(urls)
+        return len(urls)
+
+    sut = ReconcileSpiderMiddleware(LiveURLStore(str(tmp_path / 'live.sqlite')), 'test', 0, 1,
+                                    max_delete_ratio, delete, mock.MagicMock())
+    spider = _Spider()
+    list(sut.process_start_requests(iter([_listing_request()]), spider))
+    for n, page in enumerate(pages):
+        request = _listing_request(n)
+        response = TextResponse(request.url, body=b'[]', request=request,
+                                status=status if n == len(pages) - 1 else 200)
+        output = [CrawlItem(url=url, name=url) for url, _ in page]
+        if n < len(pages) - 1:
+            output.append(_listing_request(n + 1))
+        list(sut.process_spider_output(iter(output), spider, response))
+
+        for url, homepage in page:
+            if homepage is not None:
+                response = TextResponse(homepage, body=b'<html>', request=Request(homepage))
+                item = CrawlItem(url=homepage, repository_backlink=url, content='home')
+                list(sut.process_spider_output(iter([item]), spider, response))
+    for item in others or []:
+        response = TextResponse(item.url, body=b'<html>', request=Request(item.url))
+        list(sut.process_spider_output(iter([item]), spider, response))
+
+    sut.spider_closed(spider, reason)
+    return deleted
+
+
+def test_documents_of_sources_no_longer_listed_should_be_deleted(tmp_path):
+    pages = [[('https://github.com/a/a', 'https://a.org'), ('https://github.com/b/b', 'https://b.org')],
+             [('https://github.com/c/c', 'https://shared.org')]]
+    # Also linked from another source that's still there
+    other = CrawlItem(url='https://shared.org', repository_backlink='https://github.com/a/a')
+    assert _crawl(tmp_path, pages, others=[other]) == []
+
+    pages = [[('https://github.com/a/a', None)], []]
+    assert _crawl(tmp_path, pages) == ['https://b.org', 'https://github.com/b/b', 'https://github.com/c/c']
+    # Once
+    assert _crawl(tmp_path, pages) == []
+
+
+def test_nothing_should_be_deleted_unless_every_listing_was_read(tmp_path):
+    pages = [[('https://github.com/a/a', None)], [('https://github.com/b/b', None)]]
+    assert _crawl(tmp_path, pages) == []
+
+    # Rate limited on the last page
+    assert _crawl(tmp_path, pages[:1] + [[]], status=429) == []
+    # Interrupted, the next crawl continues it
+    assert _crawl(tmp_path, pages[:1], reason='shutdown') == []
+    assert _crawl(tmp_path, [[]]) == ['https://github.com/b/b']
+
+
+def test_nothing_should_be_deleted_when_too_many_sources_are_gone(tmp_path):
+    pages = [[('https://github.com/a/a', None), ('https://github.com/b/b', None)]]
+    assert _crawl(tmp_path, pages) == []
+    assert _crawl(tmp_path, [[]], max_delete_ratio=0.5) == []
+    assert _crawl(tmp_path, [pages[0][:1]], max_delete_ratio=0.5) == ['https://github.com/b/b']
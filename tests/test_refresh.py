@@ -0,0 +1,104 @@
+from unittest import mock
+
+from scrapy import Spider
+from scrapy.http import Request, TextResponse
+
+from searchbox.items import CrawlItem
+from searchbox.refresh import RefreshPolicy, RefreshSpiderMiddleware
+from searchbox.store import PageHistory, PageHistoryStore
+
+DAY = 24 * 3600
+
+
+class _Spider(Spider):
+    name = 'test'
+
+
+class _Clock(object):
+    def __init__(self) -> None:
+        self.now = 1000000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _readme(url):
+    return Request(url, meta={'request_kind': 'readme'})
+
+
+def _middleware(tmp_path, clock, budget=0):
+    return RefreshSpiderMiddleware(PageHistoryStore(str(tmp_path / 'history.sqlite')),
+                                   frozenset(['readme', 'page']), RefreshPolicy(DAY, 8 * DAY, 2.0),
+                                   budget, mock.MagicMock(), clock)
+
+
+def _crawl(sut, requests, content='README'):
+    # The requests made by an API callback, and the README callback of each
+    # one let through
+    api = TextResponse('https://api.example.com/repo', body=b'{}', request=Request('https://api.example.com/repo'))
+    allowed = list(sut.process_spider_output(iter(requests), _Spider(), api))
+    for request in allowed:
+        response = TextResponse(request.url, body=b'<html>', request=request)
+        item, = sut.process_spider_output(iter([CrawlItem(url=request.url, content=content)]),
+                                          _Spider(), response)
+        # Indexed
+        for _, url, history in item.after_index:
+            sut.store.put(url, PageHistory(*history))
+    return [r.url for r in allowed]
+
+
+def test_pages_should_only_be_fetched_when_due(tmp_path):
+    clock = _Clock()
+    sut = _middleware(tmp_path, clock)
+    api_request = Request('https://api.example.com/other', meta={'request_kind': 'api'})
+    assert _crawl(sut, [_readme('https://example.com/a'), api_request]) == \
+        ['https://example.com/a', 'https://api.example.com/other']
+
+    clock.now += DAY / 2
+    sut = _middleware(tmp_path, clock)
+    assert _crawl(sut, [_readme('https://example.com/a'), api_request]) == ['https://api.example.com/other']
+
+    clock.now += DAY
+    sut = _middleware(tmp_path, clock)
+    assert _crawl(sut, [_readme('https://example.com/a')]) == ['https://example.com/a']
+
+
+def test_interval_should_follow_how_often_pages_change(tmp_path):
+    clock = _Clock()
+    sut = _middleware(tmp_path, clock)
+    intervals = []
+    for content in ['v1', 'v1', 'v1', 'v1', 'v1', 'v2', 'v2']:
+        _crawl(sut, [_readme('https://example.com/a')], content)
+        history = sut.store.get('https://example.com/a')
+        intervals.append(history.interval / DAY)
+        clock.now = history.due_at
+        sut.allowed.clear()
+
+    assert intervals == [1, 2, 4, 8, 8, 4, 8]
+    assert history.changed_at == history.checked_at - 4 * DAY
+
+
+def test_budget_should_work_through_all_pages(tmp_path):
+    clock = _Clock()
+    urls = ['https://example.com/{}'.format(i) for i in range(5)]
+
+    fetched = []
+    for _ in range(3):
+        sut = _middleware(tmp_path, clock, budget=2)
+        fetched.append(_crawl(sut, [_readme(url) for url in urls]))
+        clock.now += 60
+
+    assert fetched == [urls[:2], urls[2:4], urls[4:]]
+
+
+def test_pages_should_be_fetched_again_unless_their_items_were_indexed(tmp_path):
+    clock = _Clock()
+    sut = _middleware(tmp_path, clock)
+    api = TextResponse('https://api.example.com/repo', body=b'{}', request=Request('https://api.example.com/repo'))
+    request, = sut.process_spider_output(iter([_readme('https://example.com/a')]), _Spider(), api)
+    response = TextResponse(request.url, body=b'<html>', request=request)
+    item, = sut.process_spider_output(iter([CrawlItem(url=request.url, content='README')]), _Spider(), response)
+
+    assert [kind for kind, _, _ in item.after_index] == ['page_history']
+    sut = _middleware(tmp_path, clock)
+    assert _crawl(sut, [_readme('https://example.com/a')]) == ['https://example.com/a']
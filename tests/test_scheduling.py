@@ -0,0 +1,132 @@
+from unittest import mock
+
+from scrapy import Spider
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+from searchbox.scheduling import KindAwareScheduler, RequestKindSpiderMiddleware
+
+
+def _request(url, kind):
+    return Request(url, meta={'request_kind': kind})
+
+
+def test_request_priority_should_follow_kind():
+    sut = RequestKindSpiderMiddleware({'api': 100, 'page': 0})
+    api = _request('https://api.example.com/1', 'api')
+    page = _request('https://example.com/', 'page')
+    explicit = Request('https://api.example.com/2', meta={'request_kind': 'api'}, priority=-5)
+
+    result = list(sut.process_spider_output(iter([api, page, explicit]), mock.MagicMock()))
+
+    assert result == [api, page, explicit]
+    assert api.priority == 100
+    assert page.priority == 0
+    assert explicit.priority == -5
+
+
+def _scheduler(active, **settings):
+    crawler = get_crawler(Spider, {
+        'SEARCHBOX_REQUEST_KIND_CONCURRENCY': {'page': 1},
+        'SCHEDULER_PRIORITY_QUEUE': 'scrapy.pqueues.ScrapyPriorityQueue',
+        **settings,
+    })
+    crawler.engine = mock.MagicMock()
+    crawler.engine.downloader.active = active
+    crawler.engine.scraper.slot.itemproc_size = 0
+    scheduler = KindAwareScheduler.from_crawler(crawler)
+    scheduler.open(Spider('test'))
+    return scheduler
+
+
+def test_scheduler_should_hold_requests_over_their_kind_limit():
+    active = set()
+    sut = _scheduler(active)
+    first_page = _request('https://one.example.com/', 'page')
+    second_page = _request('https://two.example.com/', 'page')
+    sut.enqueue_request(first_page)
+    sut.enqueue_request(second_page)
+
+    # Scrapy's memory queues are LIFO
+    assert sut.next_request() is second_page
+    active.add(second_page)
+
+    # The other page waits until the first one leaves the downloader, the
+    # API request doesn't
+    assert sut.next_request() is None
+    api = _request('https://api.example.com/', 'api')
+    sut.enqueue_request(api)
+    assert sut.next_request() is api
+    assert len(sut) == 1 and sut.has_pending_requests()
+
+    active.remove(second_page)
+    assert sut.next_request() is first_page
+    assert not sut.has_pending_requests()
+
+
+def test_scheduler_should_hold_listings_while_too_much_is_outstanding():
+    active = set()
+    sut = _scheduler(active, SEARCHBOX_BACKPRESSURE_HIGH=3, SEARCHBOX_BACKPRESSURE_LOW=1,
+                     SEARCHBOX_REQUEST_KIND_CONCURRENCY={})
+    apis = [_request('https://api.example.com/{}'.format(n), 'api') for n in range(3)]
+    for request in apis:
+        sut.enqueue_request(request)
+    listing = Request('https://api.example.com/stars?page=2', meta={'request_kind': 'listing'}, priority=100)
+    sut.enqueue_request(listing)
+
+    # Three API requests waiting, the next page of the listing is set aside
+    # until they're done
+    assert sut.next_request() is apis[2]
+    assert list(sut.deferred['listing']) == [listing]
+    active.add(apis[2])
+    assert sut.next_request() is apis[1]
+    active.add(apis[1])
+    active.remove(apis[2])
+    # Down to two, not below the low watermark yet
+    assert sut.next_request() is apis[0]
+    active.add(apis[0])
+    assert sut.next_request() is None and sut.has_pending_requests()
+
+    active.clear()
+    assert sut.next_request() is listing
+    assert not sut.has_pending_requests()
+
+
+class _Other(Spider):
+    name = 'other'
+
+    def parse_repo(self, response):
+        pass
+
+
+def test_requests_taken_over_by_another_spider_should_be_saved_with_the_job(tmp_path, monkeypatch):
+    other = _Other()
+    monkeypatch.setattr('searchbox.scheduling.routed_spider', lambda name: other if name == 'other' else None)
+    request = Request('https://github.com/example/repo', callback=other.parse_repo, meta={'request_kind': 'page'})
+
+    sut = _scheduler(set(), JOBDIR=str(tmp_path))
+    sut.enqueue_request(request)
+    assert sut.stats.get_value('scheduler/enqueued/disk') == 1
+    sut.close('shutdown')
+
+    sut = _scheduler(set(), JOBDIR=str(tmp_path))
+    resumed = sut.next_request()
+    assert resumed.url == request.url and resumed.callback == other.parse_repo
+    assert '_routed' not in resumed.meta
+    sut.close('finished')
+
+
+def test_requests_at_their_limit_should_not_hold_back_the_others():
+    api = _request('https://api.example.com/', 'api')
+    active = {api}
+    sut = _scheduler(active, SEARCHBOX_REQUEST_KIND_CONCURRENCY={'api': 1, 'page': 1})
+    page = _request('https://example.com/', 'page')
+    sut.enqueue_request(page)
+    sut.enqueue_request(_request('https://api.example.com/1', 'api'))
+    sut.enqueue_request(_request('https://api.example.com/2', 'api'))
+
+    # Both API requests come first, and are set aside in the same call
+    assert sut.next_request() is page
+    assert sut.next_request() is None
+    active.clear()
+    assert sut.next_request().url == 'https://api.example.com/2'
@@ -0,0 +1,28 @@
+from unittest import mock
+
+import pytest
+from elasticsearch.exceptions import TransportError
+
+from searchbox.search import msearch
+
+
+def test_msearch_should_send_every_search_in_one_request():
+    es = mock.MagicMock()
+    es.msearch.return_value = {'responses': [{'hits': 1}, {'hits': 2}]}
+
+    responses = msearch(es, [{'size': 30}, {'size': 0}], index='items')
+
+    assert responses == [{'hits': 1}, {'hits': 2}]
+    assert es.msearch.call_args.kwargs['body'] == [
+        {'index': 'items'}, {'size': 30}, {'index': 'items'}, {'size': 0}]
+
+
+def test_msearch_should_raise_for_failed_searches():
+    es = mock.MagicMock()
+    es.msearch.return_value = {'responses': [
+        {'hits': 1}, {'status': 400, 'error': {'type': 'parse_exception'}}]}
+
+    with pytest.raises(TransportError) as error:
+        msearch(es, [{}, {}])
+    assert error.value.status_code == 400
+    assert error.value.error == 'parse_exception'
@@ -0,0 +1,76 @@
+from unittest import mock
+
+from searchbox.items import CrawlItem
+from searchbox.pipelines import TagPipeline
+from searchbox.store import TagVocabularyStore
+from searchbox.tags import TagVocabulary, normalise, tag_key
+
+
+def test_normalise_should_clean_up_tags_and_drop_prefixes():
+    assert normalise(' Machine Learning ') == 'machine_learning'
+    assert normalise('[data-science]') == 'data_science'
+    assert normalise('topic:python') == 'python'
+    assert normalise('プラットフォーム:switch') == 'switch'
+    assert normalise('tag: rust') == 'rust'
+    # Attributes, not tags
+    assert normalise('lite:true') is None
+    assert normalise('tag:') is None
+
+
+def test_vocabulary_should_pick_the_most_common_spelling():
+    vocabulary = TagVocabulary({}, min_cooccurrence=2)
+    for n, tags in enumerate((['machine_learning'], ['machinelearning'], ['machine_learning'], ['tutorials'])):
+        vocabulary.observe('https://example.com/{}'.format(n), tags)
+
+    assert vocabulary.canonical('machinelearning') == 'machine_learning'
+    assert vocabulary.canonical('tutorial') == 'tutorials'
+    assert vocabulary.canonical('unseen') == 'unseen'
+
+
+def test_vocabulary_should_learn_acronyms_and_keep_them(tmp_path):
+    path = str(tmp_path / 'vocabulary.sqlite')
+    vocabulary = TagVocabulary({}, min_cooccurrence=2, store=TagVocabularyStore(path))
+    vocabulary.observe('https://example.com/1', ['ml', 'machine_learning'])
+    assert vocabulary.canonical('ml') == 'ml'
+    # Crawled again
+    vocabulary.observe('https://example.com/1', ['ml', 'machine_learning', 'python'])
+    assert vocabulary.canonical('ml') == 'ml'
+    vocabulary.observe('https://example.com/2', ['ml', 'machine_learning', 'python'])
+    assert vocabulary.canonical('ml') == 'machine_learning'
+    vocabulary.close()
+
+    vocabulary = TagVocabulary({'golang': 'go'}, min_cooccurrence=2, store=TagVocabularyStore(path))
+    assert vocabulary.canonical('ml') == 'machine_learning'
+    assert vocabulary.canonical('golang') == 'go'
+    vocabulary.observe('https://example.com/2', ['python'])
+    assert vocabulary.counts['python'] == 2
+    vocabulary.close()
+
+
+def test_vocabulary_should_only_merge_plurals_of_known_tags():
+    vocabulary = TagVocabulary({}, min_cooccurrence=2)
+    for n, tags in enumerate((['new'], ['news'], ['news'], ['redis'], ['.net'], ['net'], ['node.js'],
+                              ['nodejs'], ['nodejs'], ['tutorial'], ['tutorials'], ['tutorials'])):
+        vocabulary.observe('https://example.com/{}'.format(n), tags)
+
+    assert tag_key('.net') != tag_key('net')
+    assert vocabulary.canonical('new') == 'new'
+    assert vocabulary.canonical('news') == 'news'
+    assert vocabulary.canonical('redis') == 'redis'
+    assert vocabulary.canonical('.net') == '.net'
+    assert vocabulary.canonical('node.js') == 'nodejs'
+    assert vocabulary.canonical('tutorial') == 'tutorials'
+    assert vocabulary.canonical('kubernetes') == 'kubernetes'
+
+
+def test_tag_pipeline_should_store_canonical_tags():
+    pipeline = TagPipeline(TagVocabulary({'k8s': 'kubernetes'}, min_cooccurrence=3))
+    item = CrawlItem(url='https://example.com', pocket_tags=['Kubernetes', 'how-to'],
+                     article_tags=['k8s', 'topic:devops'], twitter_tags=['lite:true'])
+
+    pipeline.process_item(item, mock.MagicMock())
+
+    assert item.pocket_tags == ['kubernetes', 'how_to']
+    assert item.article_tags == ['kubernetes', 'devops']
+    assert item.twitter_tags == []
+    assert item.get_all_tags() == ['devops', 'how_to', 'kubernetes']
@@ -0,0 +1,50 @@
+from searchbox.store import TermDictionaryStore
+from searchbox.terms import TermDictionary, build, edit_distance
+
+COUNTS = {'python': 50, 'pytest': 20, 'pypy': 20, 'parser': 30, 'parsing': 10, 'parse': 30,
+          'receive': 5, 'recipe': 8, 'rust': 40, 'asynchronous': 3, 'typo': 1}
+
+
+def _dictionary(tmp_path):
+    store = TermDictionaryStore(str(tmp_path / 'terms.sqlite'))
+    assert build(COUNTS, 2, store) == len(COUNTS)
+    return TermDictionary(store, 2)
+
+
+def test_completions_should_be_the_most_frequent_words(tmp_path):
+    dictionary = _dictionary(tmp_path)
+
+    assert dictionary.complete('P') == ['python', 'parse', 'parser', 'pypy', 'pytest', 'parsing']
+    assert dictionary.complete('py', size=2) == ['python', 'pypy']
+    assert dictionary.complete('parsi') == ['parsing']
+    assert dictionary.complete('typ') == []
+    assert dictionary.complete('typo') == []
+
+
+def test_misspelled_words_should_be_corrected(tmp_path):
+    dictionary = _dictionary(tmp_path)
+
+    assert edit_distance('pyhton', 'python') == 1
+    assert dictionary.correct('Pyhton') == 'python'
+    assert dictionary.correct('recieve') == 'receive'
+    assert dictionary.correct('asyncronous') == 'asynchronous'
+    assert dictionary.correct('asyncchronouss') == 'asynchronous'
+    # Closest first, then most frequent
+    assert dictionary.correct('parsr') == 'parse'
+    assert dictionary.correct('rusty') == 'rust'
+    # Rare words are known, but never a correction
+    assert dictionary.correct('typo') == 'typo'
+    assert dictionary.correct('tyop') is None
+    assert dictionary.correct('golang') is None
+
+
+def test_query_terms_should_keep_their_syntax(tmp_path):
+    dictionary = _dictionary(tmp_path)
+
+    terms, all_known = dictionary.correct_query(['pyhton AND name:pasre', 'rust*', '"parsr recipe"'])
+    assert terms == ['python AND name:parse', 'rust*', '"parse recipe"']
+    assert all_known
+
+    terms, all_known = dictionary.correct_query(['python', 'golang'])
+    assert terms == ['python', 'golang']
+    assert not all_known
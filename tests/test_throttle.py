@@ -0,0 +1,51 @@
+from scrapy.core.downloader import Slot
+
+from searchbox.throttle import AdaptiveConcurrency, DomainProfile, SlotState, find_profile
+
+DEFAULT = DomainProfile(concurrency=2, max_concurrency=4, delay=0.0)
+
+
+def test_profile_should_match_parent_domains():
+    profiles = {'github.com': {'concurrency': 4, 'max_concurrency': 12}}
+
+    assert find_profile('api.github.com', profiles, DEFAULT) == DomainProfile(4, 12, 0.0)
+    assert find_profile('github.com', profiles, DEFAULT) == DomainProfile(4, 12, 0.0)
+    assert find_profile('notgithub.com', profiles, DEFAULT) == DEFAULT
+
+
+def _state(concurrency=2, queued=0):
+    slot = Slot(concurrency, 0.0, False)
+    slot.queue.extend([None] * queued)
+    return SlotState(slot, DomainProfile(concurrency, 4, 0.0))
+
+
+def test_fast_responses_should_raise_concurrency_only_with_queued_requests():
+    sut = AdaptiveConcurrency(target_latency=1.0, max_delay=60.0)
+    busy = _state(queued=5)
+    idle = _state()
+
+    for _ in range(20):
+        sut.success(busy, 0.1)
+        sut.success(idle, 0.1)
+
+    assert busy.slot.concurrency == 4
+    assert idle.slot.concurrency == 2
+
+
+def test_errors_should_back_off_and_fast_responses_recover():
+    sut = AdaptiveConcurrency(target_latency=1.0, max_delay=60.0)
+    state = _state(concurrency=4, queued=5)
+
+    sut.error(state)
+    sut.error(state)
+    assert state.slot.concurrency == 1
+    assert state.slot.delay == 0.5
+
+    for _ in range(3):
+        sut.success(state, 2.0)
+    assert state.slot.delay == 0.5
+
+    for _ in range(20):
+        sut.success(state, 0.1)
+    assert state.slot.delay == 0.0
+    assert state.slot.concurrency > 1
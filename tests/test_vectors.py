@@ -0,0 +1,43 @@
+import random
+
+from searchbox.vectors import VectorIndex, build_index, dot, embed, quantise
+
+
+def test_similar_texts_should_have_closer_embeddings():
+    query = embed({'name': 'parsing json in python'})
+    related = embed({'name': 'Fast JSON parser', 'description': 'A Python library to parse JSON'})
+    unrelated = embed({'name': 'Sourdough bread', 'description': 'Baking recipes for beginners'})
+
+    assert abs(dot(query, query) - 1.0) < 1e-9
+    assert dot(query, related) > dot(query, unrelated) + 0.2
+
+
+def test_quantised_vectors_should_keep_their_similarity():
+    a = embed({'content': 'vector search with quantised embeddings'})
+    b = embed({'content': 'approximate nearest neighbour search'})
+    qa, scale_a = quantise(a)
+    qb, scale_b = quantise(b)
+
+    assert all(-127 <= x <= 127 for x in qa)
+    assert abs(dot(qa, qb) * scale_a * scale_b - dot(a, b)) < 0.02
+
+
+def test_index_should_find_nearest_neighbours(tmp_path):
+    rng = random.Random(1)
+    words = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet']
+    documents = {'doc{}'.format(i): ' '.join(rng.choice(words) + str(rng.randint(0, 40)) for _ in range(8))
+                 for i in range(300)}
+    path = str(tmp_path / 'vectors')
+    assert build_index(path, ((doc_id, embed({'content': text})) for doc_id, text in documents.items())) == 300
+
+    index = VectorIndex(path)
+    query = embed({'content': documents['doc42']})
+    # Every cluster searched, it's exact up to quantisation
+    results = index.search(query, 5, nprobe=len(index.centroids))
+    assert results[0][1] == 'doc42'
+    assert results[0][0] > 0.95
+    assert [s for s, _ in results] == sorted((s for s, _ in results), reverse=True)
+
+    # The closest clusters only, it should still be there
+    assert index.search(query, 5, nprobe=2)[0][1] == 'doc42'
+    index.close()
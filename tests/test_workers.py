@@ -0,0 +1,112 @@
+import queue
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+from scrapy import Spider
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+
+from searchbox.items import CrawlItem
+from searchbox.workers import (ShardSpiderMiddleware, SharedDupeFilter, WriterGone, WriterQueuePipeline, _collect,
+                               aggregate_stats, shard_of)
+
+
+class _Spider(Spider):
+    name = 'test'
+
+
+def _listing_response():
+    request = Request('https://api.example.com/stars', meta={'request_kind': 'listing'})
+    return TextResponse(request.url, body=b'[]', request=request)
+
+
+def test_shards_should_split_listed_urls_and_keep_listings():
+    urls = ['https://example.com/{}'.format(i) for i in range(20)]
+    next_page = Request('https://api.example.com/stars?page=2', meta={'request_kind': 'listing'})
+
+    kept = []
+    for shard in range(2):
+        sut = ShardSpiderMiddleware(shard, 2, mock.MagicMock())
+        output = [next_page] + [Request(url) for url in urls] + [CrawlItem(url=url) for url in urls]
+        result = list(sut.process_spider_output(iter(output), mock.MagicMock(), _listing_response()))
+        assert next_page in result
+        kept.append([i.url for i in result if i is not next_page])
+
+    assert sorted(kept[0] + kept[1]) == sorted(urls * 2)
+    assert all(shard_of(url, 2) == 0 for url in kept[0])
+
+
+def test_shards_should_keep_everything_from_other_responses():
+    sut = ShardSpiderMiddleware(0, 2, mock.MagicMock())
+    response = TextResponse('https://example.com/', body=b'', request=Request('https://example.com/'))
+    output = [Request('https://example.com/{}'.format(i)) for i in range(10)]
+
+    assert list(sut.process_spider_output(iter(output), mock.MagicMock(), response)) == output
+
+
+def test_shared_dupefilter_should_see_requests_from_other_processes(tmp_path):
+    settings = {'SEARCHBOX_SEEN_REQUESTS_FILE': str(tmp_path / 'seen.sqlite')}
+    first = SharedDupeFilter.from_crawler(get_crawler(_Spider, settings))
+    second = SharedDupeFilter.from_crawler(get_crawler(_Spider, settings))
+
+    assert not first.request_seen(Request('https://example.com/page'))
+    assert second.request_seen(Request('https://example.com/page'))
+
+    # Every shard gets its own copy of the listings
+    listing = {'request_kind': 'listing'}
+    assert not first.request_seen(Request('https://api.example.com/stars', meta=listing))
+    assert not second.request_seen(Request('https://api.example.com/stars', meta=listing))
+
+    first.close('finished')
+    second.close('finished')
+
+
+def test_aggregate_stats_should_add_counts_and_keep_time_bounds():
+    total = aggregate_stats({
+        'pocket[0/2]': {'item_scraped_count': 3, 'start_time': datetime(2023, 1, 1, 10),
+                        'finish_time': datetime(2023, 1, 1, 11), 'timings/body_text/max': 0.5},
+        'pocket[1/2]': {'item_scraped_count': 4, 'start_time': datetime(2023, 1, 1, 9),
+                        'finish_time': datetime(2023, 1, 1, 12), 'timings/body_text/max': 0.2},
+    })
+
+    assert total == {'item_scraped_count': 7, 'start_time': datetime(2023, 1, 1, 9),
+                     'finish_time': datetime(2023, 1, 1, 12), 'timings/body_text/max': 0.5}
+
+
+def test_items_should_be_dropped_and_the_crawl_stopped_once_the_writer_is_gone():
+    writer_queue = queue.Queue(maxsize=1)
+    writer_gone = mock.MagicMock()
+    writer_gone.is_set.return_value = False
+    crawler = mock.MagicMock()
+    sut = WriterQueuePipeline(writer_queue, writer_gone, crawler)
+    spider = _Spider()
+
+    item = {'url': 'https://example.com/1'}
+    assert sut.process_item(item, spider) is item
+    assert writer_queue.get_nowait()['url'] == 'https://example.com/1'
+
+    # The queue is full and nobody reads it anymore
+    writer_queue.put({})
+    writer_gone.is_set.side_effect = [False, True]
+    with pytest.raises(WriterGone):
+        sut.process_item({'url': 'https://example.com/2'}, spider)
+    crawler.engine.close_spider.assert_called_once_with(spider, 'writer_gone')
+
+
+def test_collect_should_give_up_when_the_writer_dies():
+    worker = mock.MagicMock()
+    worker.name = 'worker'
+    worker.is_alive.return_value = True
+    writer = mock.MagicMock()
+    writer.is_alive.return_value = False
+    results = mock.MagicMock()
+    results.get.side_effect = queue.Empty
+
+    assert _collect(results, [worker], {}, writer) is False
+
+    results.get.side_effect = [('worker', {'item_scraped_count': 1})]
+    collected = {}
+    assert _collect(results, [worker], collected, writer) is True
+    assert collected == {'worker': {'item_scraped_count': 1}}